@@ -0,0 +1,366 @@
+'''
+
+    blargs benchmarks
+    ~~~~~~~~~~~~~~~~~
+
+    Parse latency and throughput of blargs, compared with argparse on
+    equivalent parsers. Run with:
+
+    ::
+
+        python bench.py --output after.json --compare before.json
+
+    :copyright: (c) 2012 by Karl Gyllstrom
+    :license: BSD (see LICENSE.txt)
+
+'''
+
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from timeit import default_timer
+
+import blargs
+from blargs import Parser
+
+
+def best_of(f, repeat, number):
+    ''' Best time, in seconds, of one call to ``f``. '''
+
+    best = None
+    for _ in range(repeat):
+        start = default_timer()
+        for _ in range(number):
+            f()
+        elapsed = (default_timer() - start) / number
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return best
+
+
+def options_argv(count, every=10):
+    ''' Command line specifying every ``every``-th of ``count`` options. '''
+
+    argv = []
+    for i in range(0, count, every):
+        argv += ['--opt%d' % i, str(i)]
+    return argv
+
+
+# ---------- benchmarks ---------- #
+
+# Each benchmark takes a scale factor and returns a dict of name -> callable
+# that performs one operation.
+
+
+def flat(count):
+    def build_blargs():
+        p = Parser()
+        for i in range(count):
+            p.int('opt%d' % i)
+        return p
+
+    def build_add_many():
+        p = Parser()
+        p.add_many([{'name': 'opt%d' % i, 'type': 'int'} for i in
+            range(count)])
+        return p
+
+    def build_lazy():
+        p = Parser()
+        p.add_many([{'name': 'opt%d' % i, 'type': 'int'} for i in
+            range(count)], lazy=True)
+        return p
+
+    def build_argparse():
+        p = argparse.ArgumentParser()
+        for i in range(count):
+            p.add_argument('--opt%d' % i, type=int)
+        return p
+
+    argv = options_argv(count)
+    bp, ap = build_blargs(), build_argparse()
+    generated = {}
+    exec(compile(bp.codegen(), '<codegen>', 'exec'), generated)
+
+    return {'build/blargs': build_blargs,
+            'build/add_many': build_add_many,
+            'build/argparse': build_argparse,
+            'build/lazy': build_lazy,
+            'parse/blargs': lambda: bp._process_command_line(argv),
+            'parse/result': lambda: bp.parse(argv),
+            'parse/codegen': lambda: generated['parse'](argv),
+            'parse/argparse': lambda: ap.parse_args(argv)}
+
+
+def small(scale):
+    return flat(5)
+
+
+def typical(scale):
+    ''' Parse latency of a small parser using the common features, as in
+    the startup benchmark, on a short command line. '''
+
+    bp = Parser({})
+    bp.int('count').default(1)
+    bp.str('name').shorthand('n').required()
+    bp.flag('verbose').shorthand('v')
+    bp.float('ratio').requires(bp['count'] > 0)
+    bp.str('mode').default('fast')
+
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--count', type=int, default=1)
+    ap.add_argument('-n', '--name', required=True)
+    ap.add_argument('-v', '--verbose', action='store_true')
+    ap.add_argument('--ratio', type=float)
+    ap.add_argument('--mode', default='fast')
+
+    argv = ['-n', 'x', '--count=3', '-v', '--ratio', '0.5']
+    return {'parse/blargs': lambda: bp._process_command_line(argv),
+            'parse/result': lambda: bp.parse(argv),
+            'parse/argparse': lambda: ap.parse_args(argv)}
+
+
+def medium(scale):
+    return flat(100)
+
+
+def huge(scale):
+    return flat(max(1, int(5000 * scale)))
+
+
+def multiple(scale):
+    count = max(1, int(100000 * scale))
+    argv = ['--x', '1'] * count
+
+    bp = Parser()
+    bp.int('x').multiple()
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--x', type=int, action='append')
+
+    return {'parse/blargs': lambda: bp._process_command_line(argv),
+            'parse/argparse': lambda: ap.parse_args(argv)}
+
+
+def positional(scale):
+    count = max(1, int(100000 * scale))
+    argv = [str(i) for i in range(count)]
+
+    bp = Parser()
+    bp.str('files').unspecified_default().multiple()
+    ap = argparse.ArgumentParser()
+    ap.add_argument('files', nargs='*')
+
+    return {'parse/blargs': lambda: bp._process_command_line(argv),
+            'parse/argparse': lambda: ap.parse_args(argv)}
+
+
+def config(scale):
+    count = max(1, int(1000 * scale))
+    fd, fname = tempfile.mkstemp(suffix='.cfg')
+    with os.fdopen(fd, 'w') as f:
+        f.write('[bench]\n')
+        for i in range(count):
+            f.write('opt%d = %d\n' % (i, i))
+    # as an existing file; those just written are read on every parse
+    os.utime(fname, (0, 0))
+
+    p = Parser()
+    p.config('conf')
+    for i in range(count):
+        p.int('opt%d' % i)
+
+    return {'parse/blargs': lambda: p._process_command_line(['--conf',
+        fname])}
+
+
+def constraints(scale):
+    groups = max(1, int(100 * scale))
+
+    p = Parser()
+    for g in range(groups):
+        names = ['g%d_%d' % (g, i) for i in range(4)]
+        p.require_one(
+            p.all_if_any(p.int(names[0]), p.int(names[1])),
+            p.only_one_if_any(p.int(names[2]), p.int(names[3])))
+        p.float('g%d_lo' % g).requires(p['g%d_lo' % g] < p.float('g%d_hi' %
+            g))
+        p.enum('g%d_mode' % g, ('fast', 'slow', 'auto'))
+
+    argv = []
+    for g in range(groups):
+        argv += ['--g%d_0' % g, '1', '--g%d_1' % g, '2', '--g%d_lo' % g, '0.5',
+                 '--g%d_hi' % g, '1.5', '--g%d_mode' % g, 'auto']
+
+    return {'parse/blargs': lambda: p._process_command_line(argv)}
+
+
+def shared(scale):
+    ''' Many conditions on one argument with an expensive cast. '''
+
+    count = max(1, int(100 * scale))
+
+    def cast(value):
+        sum(range(1000))
+        return int(value)
+
+    p = Parser()
+    level = p.str('level').cast(cast)
+    for i in range(count):
+        p.flag('f%d' % i).requires(level >= 0, level < count)
+
+    # satisfies every condition, whatever the scale
+    argv = ['--level', str(count - 1)] + ['--f%d' % i for i in range(count)]
+    return {'parse/blargs': lambda: p._process_command_line(argv)}
+
+
+def defined(count):
+    ''' Build function for a parser of ``count`` described arguments with
+    defaults, shorthands and constraints, as CLIs with many options have. '''
+
+    def build(p):
+        for i in range(count):
+            option = p.int('opt%d' % i).described_as('Option %d.' % i)
+            if i % 3 == 0:
+                option.default(i)
+            if i % 10 == 0:
+                option.shorthand('o%d' % i)
+            if i % 4 == 1:
+                option.requires('opt%d' % (i - 1), p['opt0'] > 0)
+            if i % 7 == 2:
+                option.conflicts('opt%d' % (i - 1))
+
+    return build
+
+
+def cached(scale):
+    ''' Building a parser against loading it with Parser.cached. '''
+
+    build = defined(max(1, int(500 * scale)))
+    directory = tempfile.mkdtemp()
+    # the first call builds and stores the parser
+    Parser.cached(build, cache_dir=directory)
+
+    def build_blargs():
+        p = Parser()
+        build(p)
+        return p
+
+    return {'build/blargs': build_blargs,
+            'build/cached': lambda: Parser.cached(build,
+                cache_dir=directory)}
+
+
+STARTUP_BLARGS = '''
+from blargs import Parser
+p = Parser({})
+p.int('count').default(1)
+p.str('name').shorthand('n').required()
+p.flag('verbose').shorthand('v')
+p.float('ratio').requires(p['count'] > 0)
+p._process_command_line(['-n', 'x', '--count', '3', '-v'])
+'''
+
+STARTUP_ARGPARSE = '''
+from argparse import ArgumentParser
+p = ArgumentParser()
+p.add_argument('--count', type=int, default=1)
+p.add_argument('-n', '--name', required=True)
+p.add_argument('-v', '--verbose', action='store_true')
+p.add_argument('--ratio', type=float)
+p.parse_args(['-n', 'x', '--count', '3', '-v'])
+'''
+
+
+def startup(scale):
+    ''' Run time of a fresh interpreter that imports the library, defines a
+    typical parser and parses a command line. '''
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    # measure with blargs byte-compiled, as argparse is
+    env = dict(os.environ)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+
+    def run(code):
+        return lambda: subprocess.check_call([sys.executable, '-c', code],
+                cwd=here, env=env)
+
+    return {'python': run('pass'),
+            'blargs': run(STARTUP_BLARGS),
+            'argparse': run(STARTUP_ARGPARSE)}
+
+
+BENCHMARKS = [('small', small), ('typical', typical), ('medium', medium),
+              ('huge', huge), ('multiple', multiple),
+              ('positional', positional), ('config', config),
+              ('constraints', constraints), ('shared', shared),
+              ('cached', cached), ('startup', startup)]
+
+
+def run(names, scale, repeat, out):
+    results = {}
+    for name, create in BENCHMARKS:
+        if names and name not in names:
+            continue
+
+        ops = create(scale)
+        for op, f in sorted(ops.items()):
+            key = '%s/%s' % (name, op)
+            # aim for ~0.2s per repeat
+            number = max(1, int(0.2 / max(best_of(f, 1, 1), 1e-6)))
+            results[key] = best_of(f, repeat, number)
+            print('%-36s %12.3f us' % (key, results[key] * 1e6), file=out)
+
+    return results
+
+
+def compare(results, baseline, out):
+    print(file=out)
+    print('%-36s %12s %12s %8s' % ('benchmark', 'before (us)', 'after (us)',
+        'ratio'), file=out)
+    for key in sorted(results):
+        if key not in baseline:
+            continue
+        print('%-36s %12.3f %12.3f %8.2f' % (key, baseline[key] * 1e6,
+            results[key] * 1e6, results[key] / baseline[key]), file=out)
+
+
+def main():
+    p = Parser({})
+    p.str('output').shorthand('o').described_as('Write results as JSON.')
+    p.str('compare').shorthand('c').described_as(
+            'Compare with results of an earlier run.')
+    p.float('scale').default('1').described_as(
+            'Scale sizes of the huge/multiple/positional/config/constraints'
+            + '/shared/cached benchmarks.')
+    p.int('repeat').default('5').described_as('Repeats per benchmark.')
+    p.str('benchmarks').unspecified_default().multiple().described_as(
+            ', '.join(name for name, create in BENCHMARKS))
+    vals = p.process_command_line()
+
+    # unspecified multiple() values are placeholders, not names
+    names = [name for name in vals['benchmarks'] if isinstance(name, str)]
+    results = run(names, vals['scale'], vals['repeat'], sys.stdout)
+
+    if vals['compare']:
+        with open(vals['compare']) as f:
+            compare(results, json.load(f)['results'], sys.stdout)
+
+    if vals['output']:
+        with open(vals['output'], 'w') as f:
+            json.dump({'blargs': blargs.__version__,
+                       'python': platform.python_version(),
+                       'scale': vals['scale'],
+                       'results': results}, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -12,26 +12,31 @@
 
 from __future__ import print_function
 
+from bisect import bisect_left
+from collections import OrderedDict
 import os
 import operator
 from functools import partial, wraps
-from itertools import starmap, permutations
+from itertools import chain
 import sys
+import time
 
 
 if sys.version_info[0] == 3:
     iterkeys = lambda x: x.keys()
     iteritems = lambda x: iter(x.items())
     isstring = lambda x: isinstance(x, str)
-    from urllib.parse import urlparse
     xrange = range
-    import configparser as cpars
+    unicode = str
 else:
     iterkeys = lambda x: x.iterkeys()
     iteritems = lambda x: x.iteritems()
     isstring = lambda x: isinstance(x, basestring)
-    from urlparse import urlparse
-    import ConfigParser as cpars
+
+# Modules needed only by some argument types (e.g., configparser for config(),
+# urllib for url()) are imported when first used, to keep `import blargs` fast.
+
+_clock = getattr(time, 'perf_counter', time.time)
 
 
 class Multidict(object):
@@ -48,7 +53,9 @@ class Multidict(object):
         return self._values.__contains__(key)
 
     def copy(self):
-        return Multidict(self._values.copy())
+        # lists are appended to in place, so must not be shared
+        return Multidict(dict((k, v[:] if isinstance(v, list) else v) for k, v
+            in iteritems(self._values)))
 
     def get(self, key):
         return self._values.get(key)
@@ -60,14 +67,13 @@ class Multidict(object):
         self._values[key] = value
 
     def __setitem__(self, key, value):
-        if key in self._values:
-            v = self._values[key]
-            if not isinstance(v, list):
-                v = [v]
-
-            value = v + [value]
-
-        self._values[key] = value
+        v = self._values.get(key)
+        if v is None:
+            self._values[key] = value
+        elif isinstance(v, list):
+            v.append(value)
+        else:
+            self._values[key] = [v, value]
 
     def __getitem__(self, key):
         return self._values.__getitem__(key)
@@ -76,16 +82,176 @@ class Multidict(object):
         return iteritems(self._values)
 
 
+class _Values(dict):
+    ''' Parsed values, in a ``dict`` whose derived values (see
+    :meth:`Parser.derived`) are computed when first used. '''
+
+    __slots__ = ('_pending',)
+
+    def __init__(self, *args, **kwargs):
+        super(_Values, self).__init__(*args, **kwargs)
+        # name -> (function, names of its arguments)
+        self._pending = {}
+
+    def __missing__(self, key):
+        pending = self._pending.get(key)
+        if pending is None:
+            raise KeyError(key)
+
+        function, names = pending
+        value = self[key] = function(*[self[name] for name in names])
+        del self._pending[key]
+        return value
+
+    def _compute(self):
+        for key in list(self._pending):
+            if key in self._pending:
+                self[key]
+
+    def __contains__(self, key):
+        return super(_Values, self).__contains__(key) or key in self._pending
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def pop(self, key, *default):
+        if key in self._pending:
+            self[key]
+        return super(_Values, self).pop(key, *default)
+
+    def __iter__(self):
+        self._compute()
+        return super(_Values, self).__iter__()
+
+    def __len__(self):
+        return super(_Values, self).__len__() + len(self._pending)
+
+    def __eq__(self, other):
+        self._compute()
+        return super(_Values, self).__eq__(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        self._compute()
+        return super(_Values, self).__repr__()
+
+    def __reduce__(self):
+        self._compute()
+        return (_Values, (dict(self),))
+
+
+def _computing(name):
+    ''' ``dict`` method ``name``, for :class:`_Values` that first computes
+    derived values. '''
+
+    method = getattr(dict, name)
+
+    def inner(self, *args):
+        self._compute()
+        return method(self, *args)
+
+    inner.__name__ = name
+    return inner
+
+
+for _name in ('keys', 'values', 'items', 'copy', 'iterkeys', 'itervalues',
+        'iteritems'):
+    if hasattr(dict, _name):
+        setattr(_Values, _name, _computing(_name))
+del _name
+
+
+def _parameters(function):
+    ''' Names of the parameters of ``function``. '''
+
+    import inspect
+    try:
+        signature = inspect.signature
+    except AttributeError:
+        return inspect.getargspec(function).args
+
+    return [name for name, parameter in iteritems(signature(
+        function).parameters) if parameter.kind in (parameter.POSITIONAL_ONLY,
+            parameter.POSITIONAL_OR_KEYWORD, parameter.KEYWORD_ONLY)]
+
+
+# path -> ((size, modification time), index) of the configuration files read
+# most recently, least recent first; see _config_index
+_CONFIG_FILES = OrderedDict()
+
+# number of files kept in _CONFIG_FILES
+_CONFIG_CACHE_SIZE = 16
+
+# files modified this recently (in seconds) are read again, as a change within
+# the resolution of modification times would not change them
+_CONFIG_SETTLED = 2
+
+
+def _read_config(filename):
+    try:
+        import configparser as cpars
+    except ImportError:
+        import ConfigParser as cpars
+
+    cfp = cpars.ConfigParser()
+    with open(filename) as f:
+        (getattr(cfp, 'read_file', None) or cfp.readfp)(f)
+
+    index = {}
+    for sec in cfp.sections():
+        for key, value in cfp.items(sec):
+            index.setdefault(key, []).append(value)
+
+    return index
+
+
+def _config_index(filename):
+    ''' Values of each key of configuration file ``filename``, over all of its
+    sections. The file is only read again when its size or modification time
+    changes. '''
+
+    path = os.path.abspath(filename)
+    st = os.stat(path)
+    mtime = getattr(st, 'st_mtime_ns', None)
+    if mtime is None:
+        mtime = st.st_mtime * 1e9
+    stamp = (st.st_size, mtime)
+
+    cached = _CONFIG_FILES.pop(path, None)
+    if cached is not None and cached[0] == stamp:
+        _CONFIG_FILES[path] = cached
+        return cached[1]
+
+    index = _read_config(path)
+    if time.time() - mtime / 1e9 > _CONFIG_SETTLED:
+        _CONFIG_FILES[path] = (stamp, index)
+        if len(_CONFIG_FILES) > _CONFIG_CACHE_SIZE:
+            _CONFIG_FILES.popitem(last=False)
+    return index
+
+
 class _ConfigCaster(object):
     def __init__(self, parent):
         self._parent = parent
 
     def __call__(self, filename):
-        cfp = cpars.ConfigParser()
-        cfp.readfp(open(filename))
-        for sec in cfp.sections():
-            for key, value in cfp.items(sec):
-                yield key, value
+        return _config_index(filename)
+
+
+def _url(value):
+    try:
+        from urllib.parse import urlparse
+    except ImportError:
+        from urlparse import urlparse
+
+    if urlparse(value).scheme == '':
+        raise FormatError('%s not valid URL' % value)
+    return value
 
 
 class _RangeCaster(object):
@@ -142,6 +308,356 @@ class _FileOpenerCaster(object):
         return open(*args, **self._kw)
 
 
+def _format_cpus(cpus):
+    ''' Format CPU numbers compactly, e.g., [0, 1, 2, 3, 8] -> '0-3,8'. '''
+
+    ranges = []
+    for cpu in sorted(cpus):
+        if ranges and ranges[-1][1] == cpu - 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+
+    return ','.join(str(a) if a == b else '%d-%d' % (a, b) for a, b in ranges)
+
+
+class _CpuSetCaster(object):
+    ''' CPU list such as ``0-3,8-11``; applied with ``os.sched_setaffinity``.
+    '''
+
+    def __call__(self, value):
+        cpus = set()
+        try:
+            for term in value.split(','):
+                if '-' in term:
+                    first, last = term.split('-')
+                    cpus.update(xrange(int(first), int(last) + 1))
+                else:
+                    cpus.add(int(term))
+        except ValueError:
+            raise FormatError('%s is not CPU list format: 0-3,8' % value)
+
+        if not cpus or min(cpus) < 0:
+            raise FormatError('%s is not CPU list format: 0-3,8' % value)
+
+        return sorted(cpus)
+
+    def apply(self, cpus):
+        os.sched_setaffinity(0, cpus)
+
+    def effective(self):
+        if not hasattr(os, 'sched_getaffinity'):
+            return None
+        return _format_cpus(os.sched_getaffinity(0))
+
+
+class _NiceCaster(object):
+    ''' Scheduling priority; applied with ``os.setpriority``. '''
+
+    def __call__(self, value):
+        value = int(value)
+        if not -20 <= value <= 19:
+            raise FormatError('nice value %d not in -20..19' % value)
+        return value
+
+    def apply(self, value):
+        os.setpriority(os.PRIO_PROCESS, 0, value)
+
+    def effective(self):
+        if not hasattr(os, 'getpriority'):
+            return None
+        return str(os.getpriority(os.PRIO_PROCESS, 0))
+
+
+class _RlimitCaster(object):
+    ''' Resource limit with unit suffixes (e.g., ``512M``, ``4k``) or
+    ``unlimited``; the soft limit is applied with ``resource.setrlimit``. '''
+
+    SUFFIXES = 'kmgtp'
+
+    def __init__(self, limit, base):
+        self._limit = limit
+        self._base = base
+
+    def __call__(self, value):
+        def raise_error():
+            raise FormatError(('%s is not limit format: N, N[KMGTP] or'
+                    + ' unlimited') % value)
+
+        if value.lower() == 'unlimited':
+            return -1
+
+        number = value.lower()
+        for suffix in ('ib', 'b'):
+            if self._base == 1024 and number.endswith(suffix):
+                number = number[:-len(suffix)]
+                break
+
+        scale = 1
+        if number and number[-1] in _RlimitCaster.SUFFIXES:
+            scale = self._base ** (_RlimitCaster.SUFFIXES.index(number[-1]) +
+                    1)
+            number = number[:-1]
+
+        try:
+            limit = int(float(number) * scale)
+        except ValueError:
+            raise_error()
+
+        if limit < 0:
+            raise_error()
+
+        return limit
+
+    def _resource(self):
+        import resource
+        return resource, getattr(resource, self._limit)
+
+    def apply(self, limit):
+        resource, which = self._resource()
+        if limit == -1:
+            limit = resource.RLIM_INFINITY
+        hard = resource.getrlimit(which)[1]
+        resource.setrlimit(which, (limit, hard))
+
+    def effective(self):
+        try:
+            resource, which = self._resource()
+        except (ImportError, AttributeError):
+            return None
+
+        soft = resource.getrlimit(which)[0]
+        if soft == resource.RLIM_INFINITY:
+            return 'unlimited'
+        return str(soft)
+
+
+def _cgroup_cpu_limit():
+    ''' Number of CPUs allowed by the cgroup CPU quota, or ``None`` if there
+    is no quota. '''
+
+    def read(path):
+        try:
+            with open(path) as f:
+                return f.read().split()
+        except (IOError, OSError):
+            return None
+
+    # cgroup v2: "<quota> <period>", quota may be "max"
+    toks = read('/sys/fs/cgroup/cpu.max')
+    if toks is None:
+        # cgroup v1
+        quota = read('/sys/fs/cgroup/cpu/cpu.cfs_quota_us')
+        period = read('/sys/fs/cgroup/cpu/cpu.cfs_period_us')
+        if quota is None or period is None:
+            return None
+        toks = quota + period
+
+    try:
+        quota, period = int(toks[0]), int(toks[1])
+    except (ValueError, IndexError):
+        return None
+
+    if quota <= 0 or period <= 0:
+        return None
+
+    return max(1, -(-quota // period))
+
+
+def _available_cpus():
+    ''' CPUs this process may run on, honoring affinity and cgroup quota. '''
+
+    if hasattr(os, 'sched_getaffinity'):
+        count = len(os.sched_getaffinity(0))
+    elif hasattr(os, 'cpu_count'):
+        count = os.cpu_count() or 1
+    else:
+        import multiprocessing
+        count = multiprocessing.cpu_count()
+
+    limit = _cgroup_cpu_limit()
+    if limit is not None:
+        count = min(count, limit)
+
+    return max(1, count)
+
+
+class LazyExecutor(object):
+    ''' A ``concurrent.futures`` executor that is not created until first
+    used. Returned as the value of :meth:`Parser.executor` arguments. '''
+
+    def __init__(self, kind, max_workers, start_method=None):
+        self.kind = kind
+        self.max_workers = max_workers
+        self.start_method = start_method
+        self._executor = None
+
+    def _get(self):
+        if self._executor is None:
+            import concurrent.futures as futures
+
+            if self.kind == 'threads':
+                self._executor = futures.ThreadPoolExecutor(self.max_workers)
+            else:
+                kw = {}
+                if self.start_method is not None:
+                    import multiprocessing
+                    kw['mp_context'] = multiprocessing.get_context(
+                            self.start_method)
+                self._executor = futures.ProcessPoolExecutor(self.max_workers,
+                        **kw)
+
+        return self._executor
+
+    def submit(self, fn, *args, **kwargs):
+        return self._get().submit(fn, *args, **kwargs)
+
+    def map(self, fn, *iterables, **kwargs):
+        return self._get().map(fn, *iterables, **kwargs)
+
+    def shutdown(self, wait=True):
+        if self._executor is not None:
+            self._executor.shutdown(wait)
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
+        return False
+
+    def __repr__(self):
+        return 'LazyExecutor(%s:%d)' % (self.kind, self.max_workers)
+
+
+class _ExecutorCaster(object):
+    KINDS = {'threads': 'threads', 'thread': 'threads',
+             'procs': 'processes', 'processes': 'processes',
+             'proc': 'processes'}
+
+    def __init__(self, kind, start_method):
+        self._kind = kind
+        self._start_method = start_method
+
+    def __call__(self, value):
+        def raise_error():
+            raise FormatError(('%s is not executor format: N, auto, threads:N'
+                    + ' or procs:N') % value)
+
+        kind = self._kind
+        count = value
+        if ':' in value:
+            kind, count = value.split(':', 1)
+            kind = _ExecutorCaster.KINDS.get(kind)
+            if kind is None:
+                raise_error()
+
+        if count == 'auto':
+            count = _available_cpus()
+        else:
+            try:
+                count = int(count)
+            except ValueError:
+                raise_error()
+
+            if count < 1:
+                raise_error()
+
+        return LazyExecutor(kind, count, self._start_method)
+
+
+def _completions(labels, prefix):
+    ''' Labels of sorted list ``labels`` that start with ``prefix``. '''
+
+    i = j = bisect_left(labels, prefix)
+    while j < len(labels) and labels[j].startswith(prefix):
+        j += 1
+
+    return labels[i:j]
+
+
+def _trigrams(label):
+    padded = '  %s ' % label
+    return set(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def _trigram_index(labels):
+    ''' Trigram -> indices of the ``labels`` that contain it. '''
+
+    index = {}
+    for i, label in enumerate(labels):
+        for gram in _trigrams(label):
+            index.setdefault(gram, []).append(i)
+
+    return index
+
+
+def _edit_distance(a, b, limit):
+    ''' Levenshtein distance of ``a`` and ``b``, or ``limit + 1`` if it is
+    more than ``limit``. '''
+
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+
+    previous = list(range(len(b) + 1))
+    for i, x in enumerate(a):
+        current = [i + 1]
+        for j, y in enumerate(b):
+            cost = previous[j] + (x != y)
+            if previous[j + 1] < cost:
+                cost = previous[j + 1] + 1
+            if current[j] < cost:
+                cost = current[j] + 1
+            current.append(cost)
+
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+
+    return previous[-1]
+
+
+def _suggestions(label, labels, index):
+    ''' Up to three of ``labels`` close to ``label``, best first. Only labels
+    sharing uncommon trigrams with ``label`` (see :func:`_trigram_index`)
+    are compared, so the cost does not grow with the number of labels. '''
+
+    common = max(32, len(labels) // 20)
+    shared = {}
+    for gram in _trigrams(label):
+        indices = index.get(gram, ())
+        if len(indices) <= common:
+            for i in indices:
+                shared[i] = shared.get(i, 0) + 1
+
+    candidates = sorted(shared, key=lambda i: (-shared[i], labels[i]))[:8]
+    limit = max(1, len(label) // 3)
+    scored = []
+    for i in candidates:
+        distance = _edit_distance(label, labels[i], limit)
+        if distance <= limit:
+            scored.append((distance, labels[i]))
+
+    return [candidate for distance, candidate in sorted(scored)[:3]]
+
+
+def _column_widths(rows):
+    widths = [0] * len(rows[0]) if rows else []
+    for row in rows:
+        for i, column in enumerate(row):
+            if len(column) > widths[i]:
+                widths[i] = len(column)
+
+    return widths
+
+
+def _words(text):
+    ''' Lower case words of ``text``, for help search. '''
+
+    return ''.join(c if c.isalnum() else ' ' for c in text.lower()).split()
+
+
 # ---------- decorators ---------- #
 
 
@@ -151,7 +667,10 @@ def _names_to_options(f):
         new_args = []
         for arg in args[1:]:
             if isstring(arg):
-                arg = args[0]._options[arg]
+                if arg in args[0]._derived:
+                    arg = Option(arg, args[0])
+                else:
+                    arg = args[0]._options[arg]
 
             new_args.append(arg)
 
@@ -185,8 +704,10 @@ def _verify_args_exist(f):
 
         self = args[0]
         for arg in args[1:]:
-            if isstring(arg) and arg not in self._readers:
-                raise_error(arg)
+            if (isstring(arg) and arg not in self._readers and arg not in
+                    self._derived):
+                if not self._materialize([arg]):
+                    raise_error(arg)
 
         return f(*args, **kwargs)
 
@@ -278,9 +799,12 @@ class UnspecifiedArgumentError(ArgumentError):
 
     message = 'illegal option {0}'
 
-    def __init__(self, arg):
-        super(UnspecifiedArgumentError,
-                self).__init__(UnspecifiedArgumentError.message.format(arg))
+    def __init__(self, arg, suggestions=()):
+        message = UnspecifiedArgumentError.message.format(arg)
+        if suggestions:
+            message += ' (did you mean %s?)' % ', '.join(suggestions)
+
+        super(UnspecifiedArgumentError, self).__init__(message)
 
 
 class MultipleSpecifiedArgumentError(ArgumentError):
@@ -306,7 +830,8 @@ class ConflictError(ArgumentError):
 
 
 class FailedConditionError(ArgumentError):
-    ''' Condition failed. '''
+    ''' Condition failed, or could not be checked as an argument it refers to
+    has no valid value. '''
     pass
 
 
@@ -319,18 +844,122 @@ class InvalidEnumValueError(ArgumentError):
     ''' Enum value provided not allowed. '''
     pass
 
+
+class ResourceError(ArgumentError):
+    ''' Resource setting (e.g., CPU affinity or memory limit) could not be
+    applied. '''
+    pass
+
+
+class AmbiguousArgumentError(ArgumentError):
+    ''' User supplies an abbreviation of more than one argument. '''
+
+    message = 'ambiguous option {0}: {1}'
+
+    def __init__(self, arg, candidates):
+        super(AmbiguousArgumentError, self).__init__(
+                AmbiguousArgumentError.message.format(arg,
+                    ', '.join(candidates)))
+
+
+class UnknownCommandError(ArgumentError):
+    ''' User supplies a command that isn't specified. '''
+
+    message = 'unknown command {0}'
+
+    def __init__(self, command):
+        super(UnknownCommandError,
+                self).__init__(UnknownCommandError.message.format(command))
+
 # ---------- end exceptions ---------- #
 
 
+class Violation(object):
+    ''' A problem with a command line, as found by :meth:`Parser.validate`.
+
+    ``code`` is ``'required'``, ``'requires'``, ``'conflicts'``,
+    ``'condition'``, ``'multiple'``, ``'value'`` (a value is missing or cannot
+    be cast) or ``'parse'`` (the command line cannot be read, e.g., it has an
+    unknown label). ``options`` are the names of the arguments involved, and
+    ``condition`` is the violated condition, if any. The message is only
+    formatted when the violation is converted to a string.
+
+    '''
+
+    __slots__ = ('code', 'options', 'condition', '_error', '_args')
+
+    def __init__(self, code, options, condition, error, args=()):
+        self.code = code
+        self.options = options
+        self.condition = condition
+        self._error = error
+        self._args = args
+
+    def error(self):
+        ''' The :class:`ArgumentError` that parsing would raise. '''
+
+        if isinstance(self._error, ArgumentError):
+            return self._error
+        return self._error(*self._args)
+
+    def __str__(self):
+        return str(self.error())
+
+    def __repr__(self):
+        return 'Violation(%r, %r)' % (self.code, self.options)
+
+
+def _missing_value(name):
+    return MissingValueError('%s specified but missing given value' % name)
+
+
+def _unevaluable(code, option, condition, error):
+    ''' Violation of ``condition``, of ``option``, that cannot be evaluated
+    as a value it refers to is missing or cannot be cast. '''
+
+    if code == 'requires' and isinstance(condition, _CallableCondition):
+        code = 'condition'
+    return Violation(code, (option.argname,), condition, _cannot_check,
+            (option, condition, error))
+
+
+def _cannot_check(option, condition, error):
+    if isinstance(error, FailedConditionError):
+        return error
+
+    message = 'cannot check %r for %s: ' % (condition, option.argname)
+    if str(error):
+        message += str(error)
+    else:
+        names = set()
+        condition._argnames(names)
+        message += 'no valid value for %s' % ', '.join(sorted(names))
+    return FailedConditionError(message)
+
+
+def _multiple_specified(option):
+    return MultipleSpecifiedArgumentError('%s specified multiple times' %
+            option)
+
+
+def _invalid_value(name):
+    return FormatError('invalid value for %s' % name)
+
+
 class Condition(object):
+    # conditions (and options) are kept in __slots__ since a parser may hold
+    # very many of them; see Parser.memory_report
+    __slots__ = ('_other_conditions', '_and', '_neg')
+
     def __init__(self):
-        self._other_conditions = []
+        # shared until combined with and_/or_, which work on copies
+        self._other_conditions = ()
         self._and = True
         self._neg = False
 
     def _copy(self):
         c = self.__new__(self.__class__)
-        c._other_conditions = self._other_conditions[:]
+        c._other_conditions = list(self._other_conditions)
         c._and = self._and
         c._neg = self._neg
         return c
@@ -357,24 +986,114 @@ class Condition(object):
         c._and = False
         return c
 
-    def _is_satisfied(self, parsed):
-        def _inner():
-            for n in self._other_conditions:
-                if not n._is_satisfied(parsed):
-                    if self._and:
-                        return False
-                elif not self._and:
-                    return True
+    def _argnames(self, names):
+        ''' Add the names of the arguments this condition refers to to
+        ``names``. '''
+
+        for c in self._other_conditions:
+            c._argnames(names)
+
+    def _compile_inner(self, compiled):
+        return self._inner_satisfied
+
+    def _compile(self, compiled):
+        ''' Flatten this condition into a function of an :class:`_Evaluation`,
+        taking sub-conditions from ``compiled``. Both and and or stop at the
+        first sub-condition that decides the result. '''
 
-            return self._inner_satisfied(parsed)
+        inner = self._compile_inner(compiled)
+        if not self._other_conditions:
+            check = inner
+        else:
+            checks = [compiled(c) for c in self._other_conditions] + [inner]
+            if self._and:
+                def check(evaluation):
+                    for c in checks:
+                        if not c(evaluation):
+                            return False
+                    return True
+            else:
+                def check(evaluation):
+                    for c in checks:
+                        if c(evaluation):
+                            return True
+                    return False
 
-        result = _inner()
         if self._neg:
-            result = not result
-        return result
+            positive = check
+            check = lambda evaluation: not positive(evaluation)
+
+        return check
+
+
+def _is_in(value, choices):
+    return value in choices
+
+
+def _holds(xs, ys, call):
+    ''' Whether ``call(x, y)`` holds for every ``x`` in ``xs`` and ``y`` in
+    ``ys``. Between lists of numbers, orders are decided by the extremes and
+    (in)equality by sets, rather than by trying every pair. '''
+
+    if len(xs) > 1 and len(ys) > 1 and call in (operator.lt, operator.le,
+            operator.gt, operator.ge, operator.eq, operator.ne):
+        values = xs + ys
+        # no NaN, which is unordered
+        if all(type(v) in (int, float) and v == v for v in values):
+            if call is operator.eq:
+                return len(set(values)) == 1
+            if call is operator.ne:
+                return not set(xs).intersection(ys)
+            if call in (operator.lt, operator.le):
+                return call(max(xs), min(ys))
+            return call(min(xs), max(ys))
+
+    for x in xs:
+        for y in ys:
+            if not call(x, y):
+                return False
+    return True
+
+
+def _check_holds(xs, ys, call, text, names):
+    ''' :func:`_holds`, raising :class:`FailedConditionError` rather than
+    ``TypeError`` (e.g., for ``None > 5``) if arguments ``names``, those of
+    ``xs`` and ``ys`` (``None`` for constants), have no value. '''
+
+    try:
+        return _holds(xs, ys, call)
+    except TypeError:
+        missing = [name for name, values in zip(names, (xs, ys)) if name is
+                not None and any(v is None or v is UNSPECIFIED for v in
+                    values)]
+        if not missing:
+            raise
+        raise FailedConditionError('cannot check %s: no value for %s' % (text,
+            ', '.join(missing)))
+
+
+class _Choices(object):
+    ''' Allowed values of :meth:`Parser.enum`. '''
+
+    __slots__ = ('_values', '_lookup')
+
+    def __init__(self, values):
+        self._values = tuple(values)
+        try:
+            self._lookup = frozenset(self._values)
+        except TypeError:
+            self._lookup = self._values
+
+    def __contains__(self, value):
+        return value in self._lookup
+
+    def __str__(self):
+        return '(%s)' % ', '.join(str(v) for v in self._values)
 
 
 class _CallableCondition(Condition):
+    __slots__ = ('_call', '_main', '_other')
+
     def __init__(self, call, main, other):
         super(_CallableCondition, self).__init__()
         self._call = call
@@ -388,26 +1107,32 @@ class _CallableCondition(Condition):
         c._other = self._other
         return c
 
-    def _inner_satisfied(self, parsed):
-        operands = []
+    def _argnames(self, names):
         for item in (self._main, self._other):
             if isinstance(item, Option):
-                v = parsed.get(item.argname)
-                if isinstance(v, list):
-                    v = [vi.getvalue() for vi in v]
-                else:
-                    v = [v.getvalue()]
-            else:
-                v = [item]
+                names.add(item.argname)
+        super(_CallableCondition, self)._argnames(names)
+
+    def _compile_inner(self, compiled):
+        def operand(item):
+            if isinstance(item, Option):
+                name = item.argname
+                return lambda evaluation: evaluation.values(name)
+            constant = [item]
+            return lambda evaluation: constant
 
-            operands.append(v)
+        call = self._call
+        main, other = operand(self._main), operand(self._other)
+        text, names = repr(self), self._operand_names()
 
-        for x1 in operands[0]:
-            for x2 in operands[1]:
-                if not self._call(x1, x2):
-                    return False
+        return lambda evaluation: _check_holds(main(evaluation),
+                other(evaluation), call, text, names)
 
-        return True
+    def _operand_names(self):
+        ''' Names of the arguments compared, ``None`` for constants. '''
+
+        return tuple(item.argname if isinstance(item, Option) else None for
+                item in (self._main, self._other))
 
     def __repr__(self):
         x = self._main.argname
@@ -417,7 +1142,8 @@ class _CallableCondition(Condition):
                  operator.gt: '>',
                  operator.ge: '>=',
                  operator.eq: '==',
-                 operator.ne: '!='}
+                 operator.ne: '!=',
+                 _is_in: 'in'}
 
         x += ' ' + names[self._call] + ' ' + str(self._other)
         return x
@@ -427,12 +1153,13 @@ class Option(Condition):
     ''' Do not construct directly, as it will not be tethered to a
     :class:`Parser` object and so will not be handled in argument parsing. '''
 
+    __slots__ = ('argname', '_parser', '_allows_multiple', '_description')
+
     def __init__(self, argname, parser):
         super(Option, self).__init__()
 
         self.argname = argname
         self._parser = parser
-        self._conditions = []
         self._allows_multiple = False
         self._description = None
 
@@ -440,7 +1167,6 @@ class Option(Condition):
         c = super(Option, self)._copy()
         c.argname = self.argname
         c._parser = self._parser
-        c._conditions = self._conditions
         return c
 
     def described_as(self, description):
@@ -453,6 +1179,7 @@ class Option(Condition):
         '''
 
         self._description = description
+        self._parser._invalidate()
         return self
 
     def requires(self, *conditions):
@@ -524,12 +1251,13 @@ class Option(Condition):
 
         '''
 
-        default = os.environ.get(self.argname)
+        getenv = self._parser._getenv
+        default = getenv(self.argname)
         if default is None:
-            default = os.environ.get(self.argname.lower())
+            default = getenv(self.argname.lower())
 
             if default is None:
-                default = os.environ.get(self.argname.upper())
+                default = getenv(self.argname.upper())
 
         if default is not None:
             # XXX not tested
@@ -542,6 +1270,7 @@ class Option(Condition):
 
         self._parser._readers[self.argname] = Caster(
                 self._parser._readers[self.argname], cast)
+        self._parser._invalidate()
 
         return self
 
@@ -573,17 +1302,17 @@ class Option(Condition):
         ''' Indicate that the argument can be specified multiple times. '''
 
         self._allows_multiple = True
+        self._parser._invalidate()
         return self
 
     # --- conditions
 
-    def _inner_satisfied(self, parsed):
-        v = parsed.get(self.argname)
-
-        if not isinstance(v, list):
-            v = [v]
+    def _argnames(self, names):
+        names.add(self.argname)
+        super(Option, self)._argnames(names)
 
-        return all(x.is_resolvable() for x in v)
+    def _inner_satisfied(self, evaluation):
+        return evaluation.resolvable(self.argname)
 
     def _make_condition(self, func, other):
         return _CallableCondition(func, self, other)
@@ -646,8 +1375,14 @@ class _ArgumentReader(object):
         def __repr__(self):
             return 'UNSPECIFIED'
 
+        def __reduce__(self):
+            # keep the singleton when pickled (see Parser.cached)
+            return (getattr, (_ArgumentReader, 'UNSPECIFIED'))
+
     UNSPECIFIED = _UNSPECIFIED()
 
+    __slots__ = ('value', 'parent', '_default')
+
     def __init__(self, parent):
         self.value = _ArgumentReader.UNSPECIFIED
         self.parent = parent
@@ -695,7 +1430,14 @@ class _ArgumentReader(object):
         return self.default()
 
 
+# the value of arguments that are not given and have no default; shared
+# with generated parsers (see Parser.codegen)
+UNSPECIFIED = _ArgumentReader.UNSPECIFIED
+
+
 class _MultiWordArgumentReader(_ArgumentReader):
+    __slots__ = ()
+
     def consume_or_skip(self, arg):
         if self.parent._is_argument_label(arg):
             return False
@@ -715,6 +1457,8 @@ class _MultiWordArgumentReader(_ArgumentReader):
 
 
 class _FlagArgumentReader(_ArgumentReader):
+    __slots__ = ()
+
     def _init(self):
         self.value = False
 
@@ -736,6 +1480,8 @@ class _FlagArgumentReader(_ArgumentReader):
 
 
 class _SingleWordReader(_ArgumentReader):
+    __slots__ = ()
+
     def consume_or_skip(self, arg):
         if self.is_specified():
             return False
@@ -750,6 +1496,8 @@ class _SingleWordReader(_ArgumentReader):
 
 
 class Caster(object):
+    __slots__ = ('_reader', '_cast')
+
     def __init__(self, reader, cast):
         self._reader = reader
         self._cast = cast
@@ -768,6 +1516,8 @@ class Caster(object):
                 return None
 
             return self._cast(v)
+        except FormatError:
+            raise  # the cast's own message
         except ValueError:
             raise FormatError
 
@@ -788,126 +1538,2688 @@ class Caster(object):
 
 
 class Group(Option):
+    __slots__ = ('_names', '_default')
+
     def __init__(self, parser, *names):
         self._parser = parser
 #        super(Group, self).__init__('group', parser)
         self._names = names
         self.argname = self
 
-    def default(self, name):
-        if name not in self._names:
-            raise ValueError('%s not in group' % name)
+    def default(self, name):
+        if name not in self._names:
+            raise ValueError('%s not in group' % name)
+
+        self._default = name
+        return self
+
+    def _argnames(self, names):
+        for name in self._names:
+            name._argnames(names)
+
+    def _compile(self, compiled):
+        checks = [compiled(name) for name in self._names]
+
+        def satisfied(evaluation):
+            for c in checks:
+                if c(evaluation):
+                    return True
+            return False
+
+        return satisfied
+
+    def __str__(self):
+        return ', '.join([str(name) for name in self._names])
+
+
+class _Members(Condition):
+    ''' Condition on the members of an aggregate call (e.g.,
+    :meth:`Parser.all_if_any`). One instance is shared by all members, and
+    which members are satisfied is worked out once per parse. '''
+
+    __slots__ = ('_members',)
+
+    def __init__(self, members):
+        super(_Members, self).__init__()
+        self._members = members
+
+    def _copy(self):
+        c = super(_Members, self)._copy()
+        c._members = self._members
+        return c
+
+    def _argnames(self, names):
+        for m in self._members:
+            m._argnames(names)
+        super(_Members, self)._argnames(names)
+
+    def _satisfied_members(self, evaluation):
+        memo = evaluation._members
+        try:
+            return memo[id(self)]
+        except KeyError:
+            satisfied = memo[id(self)] = [m for m in self._members if
+                    evaluation.satisfied(m)]
+            return satisfied
+
+    def _others(self, option):
+        return [m for m in self._members if m is not option and str(m) !=
+                str(option)]
+
+    def __str__(self):
+        return ', '.join(str(m) for m in self._members)
+
+
+class _AllOf(_Members):
+    __slots__ = ()
+
+    def _inner_satisfied(self, evaluation):
+        return len(self._satisfied_members(evaluation)) == len(self._members)
+
+    def _missing(self, evaluation):
+        # options compare into conditions, so match by identity
+        satisfied = set(id(m) for m in self._satisfied_members(evaluation))
+        for m in self._members:
+            if id(m) not in satisfied:
+                return m
+
+
+class _AnyOf(_Members):
+    __slots__ = ()
+
+    def _inner_satisfied(self, evaluation):
+        return len(self._satisfied_members(evaluation)) > 0
+
+
+class _MoreThanOne(_Members):
+    __slots__ = ()
+
+    def _inner_satisfied(self, evaluation):
+        return len(self._satisfied_members(evaluation)) > 1
+
+    def _offender(self, option, evaluation):
+        others = set(id(m) for m in self._others(option))
+        for m in self._satisfied_members(evaluation):
+            if id(m) in others:
+                return m
+
+
+class _Evaluation(object):
+    ''' One parse's arguments as seen by conditions. Each argument's values
+    (and so its cast) and whether it is satisfied, and the result of each
+    compiled condition, are worked out at most once and shared by every
+    condition referring to them. '''
+
+    __slots__ = ('_parser', '_parsed', '_compiled', '_values', '_resolvable',
+                 '_results', '_members')
+
+    def __init__(self, parser, parsed):
+        self._parser = parser
+        self._parsed = parsed
+        self._compiled = parser._cache.setdefault('conditions', {})
+        self._values = {}
+        self._resolvable = {}
+        self._results = {}
+        self._members = {}
+
+    def _derive(self, argname):
+        parser = self._parser
+        function, names = parser._derived[argname]
+        args = []
+        for name in names:
+            v = self.values(name)
+            if name in parser._derived or not (
+                    parser._options[name]._allows_multiple):
+                v = v[0]
+                if v is _ArgumentReader.UNSPECIFIED:
+                    v = None
+            args.append(v)
+
+        return function(*args)
+
+    def _derived_values(self):
+        ''' The derived values computed so far, by name. '''
+
+        derived = self._parser._derived
+        if not derived:
+            return {}
+        return dict((name, v[0]) for name, v in iteritems(self._values) if
+                name in derived)
+
+    def values(self, argname):
+        v = self._values.get(argname)
+        if v is None:
+            v = self._parsed.get(argname)
+            if v is None and argname in self._parser._derived:
+                v = [self._derive(argname)]
+            elif isinstance(v, list):
+                v = [vi.getvalue() for vi in v]
+            else:
+                v = [v.getvalue()]
+
+            self._values[argname] = v
+
+        return v
+
+    def resolvable(self, argname):
+        resolvable = self._resolvable.get(argname)
+        if resolvable is None:
+            v = self._parsed.get(argname)
+            if v is None and argname in self._parser._derived:
+                resolvable = self.values(argname)[0] is not None
+            elif isinstance(v, list):
+                resolvable = all(x.is_resolvable() for x in v)
+            else:
+                resolvable = v.is_resolvable()
+
+            resolvable = self._resolvable[argname] = bool(resolvable)
+
+        return resolvable
+
+    def forget(self, argname):
+        ''' Drop what is known about ``argname``, and the arguments derived
+        from it, after its value changed. '''
+
+        for name in [argname] + self._parser._dependents().get(argname, []):
+            self._values.pop(name, None)
+            self._resolvable.pop(name, None)
+        self._results.clear()
+        self._members.clear()
+
+    def satisfied(self, condition):
+        key = id(condition)
+        result = self._results.get(key)
+        if result is None:
+            compiled = self._compiled.get(key)
+            if compiled is None:
+                check = self._parser._compiled(condition)
+            else:
+                check = compiled[1]
+            result = self._results[key] = check(self)
+
+        return result
+
+
+# ---------- instrumentation ---------- #
+
+
+class _Observer(object):
+    ''' Observes the steps of a parse. This base observes nothing; see
+    :class:`ParseStats` and :class:`_Hooks`. '''
+
+    def _time(self, name, f, *args):
+        return f(*args)
+
+    def _tokens(self, tokenized):
+        return tokenized
+
+    def _multidict(self):
+        return Multidict()
+
+    def _watch(self, parsed):
+        return parsed
+
+    def _verify(self, parser, assigned):
+        return parser._verify(assigned)
+
+    def _error(self, e):
+        pass
+
+
+_UNOBSERVED = _Observer()
+
+
+class _TimedReader(object):
+    ''' Reader wrapper that reports time spent getting (i.e., casting) its
+    value. '''
+
+    __slots__ = ('_reader', '_argname', '_observer')
+
+    def __init__(self, reader, argname, observer):
+        self._reader = reader
+        self._argname = argname
+        self._observer = observer
+
+    def getvalue(self):
+        start = _clock()
+        try:
+            return self._reader.getvalue()
+        finally:
+            self._observer._add_cast(self._argname, _clock() - start)
+
+    def is_resolvable(self):
+        return self._reader.is_resolvable()
+
+    def is_specified(self):
+        return self._reader.is_specified()
+
+
+class _CountingMultidict(Multidict):
+    ''' Counts lookups made while evaluating conditions. '''
+
+    def __init__(self, stats):
+        super(_CountingMultidict, self).__init__()
+        self._stats = stats
+
+    def get(self, key):
+        self._stats.condition_lookups += 1
+        return super(_CountingMultidict, self).get(key)
+
+
+def _time_casts(parsed, observer, watched):
+    ''' Copy ``parsed`` to ``watched``, wrapping readers that cast. '''
+
+    for key, value in parsed:
+        if isinstance(value, list):
+            value = [_TimedReader(v, key, observer) for v in value]
+        elif isinstance(value, (Caster, _TimedReader)):
+            value = _TimedReader(value, key, observer)
+        watched.overwrite(key, value)
+
+    return watched
+
+
+class ParseStats(_Observer):
+    ''' Timings and counts for one parse by an instrumented parser (see
+    :meth:`Parser.instrument`). Times are in seconds.
+
+    * ``phases``: time per parse phase (``tokenize``, ``parse``, ``verify``,
+      ...), with ``calls`` holding the number of times each ran
+    * ``casts``: time spent casting each argument's value, with
+      ``cast_calls`` holding the number of casts
+    * ``tokens``: number of command line tokens
+    * ``condition_lookups``: argument lookups made while evaluating
+      requirements, dependencies, conflicts and conditions
+    * ``total``: time for the whole parse
+
+    '''
+
+    def __init__(self):
+        self.phases = {}
+        self.calls = {}
+        self.casts = {}
+        self.cast_calls = {}
+        self.tokens = 0
+        self.condition_lookups = 0
+        self.total = 0.0
+
+    def _time(self, name, f, *args):
+        start = _clock()
+        try:
+            return f(*args)
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + _clock() - start
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    def _tokens(self, tokenized):
+        self.tokens = len(tokenized)
+        return tokenized
+
+    def _add_cast(self, argname, seconds):
+        self.casts[argname] = self.casts.get(argname, 0.0) + seconds
+        self.cast_calls[argname] = self.cast_calls.get(argname, 0) + 1
+
+    def _watch(self, parsed):
+        return _time_casts(parsed, self, _CountingMultidict(self))
+
+    def as_dict(self):
+        return {'phases': self.phases, 'calls': self.calls,
+                'casts': self.casts, 'cast_calls': self.cast_calls,
+                'tokens': self.tokens,
+                'condition_lookups': self.condition_lookups,
+                'total': self.total}
+
+    def to_json(self):
+        import json
+        return json.dumps(self.as_dict(), sort_keys=True)
+
+
+def _print_stats(stats):
+    print(stats.to_json(), file=sys.stderr)
+
+
+_OPAQUE = (type, type(sys), type(_print_stats), type(len), type(Multidict.get),
+           partial)
+
+
+def _deep_size(obj, seen):
+    ''' Bytes used by ``obj`` and everything it references, skipping objects
+    whose ids are in ``seen`` (which is updated). Classes, modules and
+    functions are counted but not followed. '''
+
+    size = 0
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, _OPAQUE):
+            continue
+
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        elif not isinstance(obj, (str, bytes, int, float)):
+            if hasattr(obj, '__dict__'):
+                stack.append(obj.__dict__)
+            for cls in type(obj).__mro__:
+                for name in cls.__dict__.get('__slots__', ()):
+                    if hasattr(obj, name):
+                        stack.append(getattr(obj, name))
+
+    return size
+
+
+class _HookedMultidict(Multidict):
+    ''' Reports each argument as the parser starts reading it. '''
+
+    def __init__(self, hooks):
+        super(_HookedMultidict, self).__init__()
+        self._hooks = hooks
+
+    def __setitem__(self, key, value):
+        self._hooks._emit('option_start', self._hooks._parser._options[key])
+        super(_HookedMultidict, self).__setitem__(key, value)
+
+
+class _Hooks(_Observer):
+    ''' Callbacks registered via :meth:`Parser.on_token` and friends. '''
+
+    def __init__(self, parser):
+        self._parser = parser
+        self._callbacks = {}
+
+    def _add(self, event, callback):
+        self._callbacks.setdefault(event, []).append(callback)
+
+    def _emit(self, event, *args):
+        for callback in self._callbacks.get(event, ()):
+            callback(*args)
+
+    def _tokens(self, tokenized):
+        for arg in tokenized:
+            self._emit('token', arg)
+            yield arg
+
+    def _multidict(self):
+        if 'option_start' not in self._callbacks:
+            return Multidict()
+        return _HookedMultidict(self)
+
+    def _watch(self, parsed):
+        if 'cast' not in self._callbacks:
+            return parsed
+        return _time_casts(parsed, self, Multidict())
+
+    def _add_cast(self, argname, seconds):
+        self._emit('cast', self._parser._options[argname], seconds)
+
+    def _verify(self, parser, assigned):
+        if 'constraint' not in self._callbacks:
+            return parser._verify(assigned)
+
+        evaluation = _Evaluation(parser, assigned)
+        for kind, table, check in (
+                ('required', parser._required, parser._check_required),
+                ('requires', parser._requires, parser._check_dependencies),
+                ('conflicts', parser._conflicts, parser._check_conflicts)):
+            for arg, conditions in iteritems(table):
+                try:
+                    check(evaluation, {arg: conditions})
+                except ArgumentError:
+                    self._emit('constraint', kind, arg, False)
+                    raise
+                self._emit('constraint', kind, arg, True)
+
+            if kind == 'required':
+                parser._check_lazy_required()
+
+        return evaluation
+
+    def _error(self, e):
+        self._emit('error', e)
+
+
+class _Profiler(object):
+    ''' Profiles the program run after parsing; started by arguments added
+    with :meth:`Parser.profiling`. '''
+
+    def __init__(self, path, timing, top, out):
+        self._path = path
+        self._timing = timing
+        self._top = top
+        self._out = out
+        self._profile = None
+        self._running = False
+        self._registered = False
+
+    def start(self):
+        import atexit
+
+        if self._top:
+            import tracemalloc
+            tracemalloc.start()
+
+        if self._path:
+            import cProfile
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+
+        self._start = _clock()
+        self._running = True
+        if not self._registered:
+            atexit.register(self.stop)
+            self._registered = True
+
+    def stop(self):
+        if not self._running:
+            return
+        self._running = False
+
+        import atexit
+        # so that stopped profilers are not kept until exit; python 2 cannot
+        # unregister, but stopping again does nothing
+        if hasattr(atexit, 'unregister'):
+            atexit.unregister(self.stop)
+            self._registered = False
+
+        elapsed = _clock() - self._start
+
+        if self._profile is not None:
+            self._profile.disable()
+            self._profile.dump_stats(self._path)
+
+        if self._top:
+            import tracemalloc
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            for stat in snapshot.statistics('lineno')[:self._top]:
+                print('blargs: %s' % stat, file=self._out)
+
+        if self._timing:
+            print('blargs: ran in %.3fs' % elapsed, file=self._out)
+
+
+# ---------- sweeps ---------- #
+
+
+def _sweep_term(term, numeric):
+    ''' Expand ``start:stop[:step]`` to its integer values, if ``numeric``;
+    any other term is returned as is. '''
+
+    toks = term.split(':')
+    if numeric and 2 <= len(toks) <= 3:
+        try:
+            return [str(i) for i in xrange(*[int(t) for t in toks])]
+        except ValueError:
+            pass
+
+    return [term]
+
+
+def _sweep_values(reader):
+    ''' Values to sweep for ``reader``, or ``None`` if it holds a single
+    value. '''
+
+    if isinstance(reader, list):
+        return None
+
+    if isinstance(reader, Caster) and isinstance(reader._cast, _ConfigCaster):
+        return None
+
+    # only numbers are given as ranges
+    numeric = isinstance(reader, Caster) and reader._cast in (int, float)
+
+    inner = reader
+    while isinstance(inner, Caster):
+        inner = inner._reader
+
+    if not isinstance(inner, _SingleWordReader) or not inner.is_specified():
+        return None
+
+    values = []
+    for term in inner.value.split(','):
+        values += _sweep_term(term, numeric)
+
+    if values == [inner.value]:
+        return None
+
+    return values
+
+
+# errors of points that break a constraint, rather than having bad values
+_SWEEP_PRUNED = (MissingRequiredArgumentError,
+        ManyAllowedNoneSpecifiedArgumentError, DependencyError, ConflictError,
+        ConditionError)
+
+
+class Sweep(object):
+    ''' Lazy Cartesian product of parse results. Created by
+    :meth:`Parser.sweep`; do not construct directly. '''
+
+    def __init__(self, parser, parsed, axes):
+        self._parser = parser
+        self._parsed = parsed
+        self._axes = axes
+
+        self._size = 1
+        for key, values in axes:
+            self._size *= len(values)
+
+    def __len__(self):
+        ''' Number of points in the grid, including those that will be
+        skipped. '''
+
+        return self._size
+
+    def point(self, index):
+        ''' Parse the point at ``index`` of the grid. Raises
+        :class:`ArgumentError` if the point is invalid. '''
+
+        if not 0 <= index < self._size:
+            raise IndexError('%s not in sweep of %d' % (index, self._size))
+
+        parsed = self._parsed.copy()
+        for key, values in reversed(self._axes):
+            index, i = divmod(index, len(values))
+            reader = self._parsed[key].fresh_copy()
+            reader.activate()
+            reader.consume_or_skip(values[i])
+            parsed.overwrite(key, reader)
+
+        assigned, derived = self._parser._resolve(parsed)
+        if self._parser._derived:
+            self._parser._assign_derived(assigned, derived)
+        return assigned
+
+    def shard(self, index, count):
+        ''' Iterate over the valid points of shard ``index`` out of ``count``;
+        shard ``i`` holds every ``count``-th point starting at ``i``. '''
+
+        if not 0 <= index < count:
+            raise ValueError('shard %s not in 0..%s' % (index, count - 1))
+
+        for i in xrange(index, self._size, count):
+            try:
+                yield self.point(i)
+            except _SWEEP_PRUNED:
+                continue
+
+    def __iter__(self):
+        return self.shard(0, 1)
+
+
+# ---------- sessions ---------- #
+
+
+def _unique_violations(report):
+    ''' ``report`` without the second report of each conflict, which is
+    found from both sides. '''
+
+    violations, conflicts = [], set()
+    for violation in report:
+        if violation.code == 'conflicts':
+            pair = frozenset(violation.options)
+            if pair in conflicts:
+                continue
+            conflicts.add(pair)
+        violations.append(violation)
+
+    return violations
+
+
+class ParseSession(object):
+    ''' Arguments that are changed one at a time, with their values and
+    violations kept up to date. Created by :meth:`Parser.session`; do not
+    construct directly.
+
+    ``values`` holds the value of each argument whose value is valid, and
+    of each derived argument whose arguments are. Arguments may be set in
+    any order: a condition on an argument that is not set yet is reported
+    as a ``'condition'`` violation until it is. '''
+
+    def __init__(self, parser, parsed):
+        self._parser = parser
+        self._parsed = parsed
+        self._recheck()
+
+    def _recheck(self):
+        ''' Check everything, as when the parser's definition changed. '''
+
+        parser = self._parser
+        for name in parser._readers:
+            if name not in self._parsed:
+                self._parsed.overwrite(name, parser._readers[name])
+
+        self._constraints = parser._constraints()
+        self._evaluation = _Evaluation(parser, self._parsed)
+        self.values, self._problems, self._violations = {}, {}, {}
+        for name, reader in self._parsed:
+            self._assign(name)
+        if parser._derived:
+            self._derive(parser._derived_order())
+        for i in xrange(len(self._constraints[0])):
+            self._check(i)
+
+    def _assign(self, name):
+        parser = self._parser
+        report = []
+        single = Multidict({name: self._parsed[name]})
+        parser._check_multiple(single, report)
+        if report:
+            # as Parser.validate, use the last of the values
+            self._parsed.overwrite(name, single[name][-1])
+            single.overwrite(name, single[name][-1])
+
+        assigned = parser._assign(single, report)
+        if name in assigned:
+            value = self.values[name] = assigned[name]
+            if value is not None:
+                # conditions see the values just cast
+                if not parser._options[name]._allows_multiple:
+                    value = [value]
+                self._evaluation._values[name] = value
+        else:
+            self.values.pop(name, None)
+
+        if report:
+            self._problems[name] = report
+        else:
+            self._problems.pop(name, None)
+
+    def _derive(self, names):
+        ''' Compute the derived arguments ``names``, in order, from valid
+        values. '''
+
+        derived = self._parser._derived
+        for name in names:
+            if all(n in self.values for n in derived[name][1]):
+                self.values[name] = self._evaluation.values(name)[0]
+            else:
+                self.values.pop(name, None)
+
+    def _check(self, i):
+        check, entry = self._constraints[0][i]
+        report = []
+        check(self._evaluation, entry, report)
+        if report:
+            self._violations[i] = report
+        else:
+            self._violations.pop(i, None)
+
+    def _update(self, name):
+        if self._parser._cache.get('constraints') is not self._constraints:
+            self._recheck()
+        else:
+            self._evaluation.forget(name)
+            self._assign(name)
+            self._derive(self._parser._dependents().get(name, ()))
+            for i in self._constraints[1].get(name, ()):
+                self._check(i)
+
+        return self.violations()
+
+    def _name(self, name):
+        name = self._parser._localize(name)
+        if name not in self._parser._readers:
+            raise ValueError('%s not known' % name)
+        return name
+
+    def set(self, name, value):
+        ''' Give argument ``name`` ``value``, as if on the command line:
+        a string, a list of strings for a :meth:`Option.multiple` argument,
+        or ``True`` for a flag. Returns :meth:`violations`. '''
+
+        name = self._name(name)
+        if value is False:
+            return self.unset(name)
+
+        readers = []
+        for v in (value if isinstance(value, list) else [value]):
+            reader = self._parser._readers[name].fresh_copy()
+            reader.activate()
+            if v is not True:
+                reader.consume_or_skip(v)
+            readers.append(reader)
+
+        self._parsed.overwrite(name, readers[0] if len(readers) == 1 else
+                readers)
+        return self._update(name)
+
+    def unset(self, name):
+        ''' Return argument ``name`` to its default, as if not given on the
+        command line. Returns :meth:`violations`. '''
+
+        name = self._name(name)
+        self._parsed.overwrite(name, self._parser._readers[name])
+        return self._update(name)
+
+    def violations(self):
+        ''' The :class:`Violation` objects of the current arguments, as
+        :meth:`Parser.validate` would find them. '''
+
+        report = []
+        for name in sorted(self._problems):
+            report += self._problems[name]
+        for i in sorted(self._violations):
+            report += self._violations[i]
+
+        return _unique_violations(report)
+
+
+# ---------- results ---------- #
+
+
+class _Result(object):
+    ''' Base of the classes of :meth:`Parser.parse` results, which are made
+    by :func:`_result_class`. '''
+
+    __slots__ = ()
+
+    # argument names, and their attributes; derived ones last
+    _fields = ()
+    _attributes = ()
+    _attribute_of = {}
+    # set the attributes of the arguments that are not derived
+    _setters = ()
+    # attribute -> (function, attributes of its arguments)
+    _derived = {}
+    # (attribute, label, words) of each argument given on command lines;
+    # words is the function giving the words of a value, None for flags
+    _arguments = ()
+
+    @classmethod
+    def _make(cls, values, derived=None):
+        result = cls.__new__(cls)
+        for setter, value in zip(cls._setters, values):
+            setter(result, tuple(value) if isinstance(value, list) else value)
+        if derived:
+            for name, value in iteritems(derived):
+                object.__setattr__(result, cls._attribute_of[name], value)
+        return result
+
+    def __getattr__(self, attribute):
+        derived = self._derived.get(attribute)
+        if derived is None:
+            raise AttributeError(attribute)
+
+        function, attributes = derived
+        value = function(*[getattr(self, a) for a in attributes])
+        object.__setattr__(self, attribute, value)
+        return value
+
+    def __setattr__(self, attribute, value):
+        raise AttributeError('parse results are read-only')
+
+    def __delattr__(self, attribute):
+        raise AttributeError('parse results are read-only')
+
+    def __getitem__(self, name):
+        return getattr(self, self._attribute_of[name])
+
+    def _values(self):
+        return tuple(getattr(self, a) for a in
+                self._attributes[:len(self._setters)])
+
+    def __eq__(self, other):
+        return (self.__class__ is other.__class__ and self._values() ==
+                other._values())
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self._values())
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__, ', '.join('%s=%r' % (
+            field, value) for field, value in zip(self._fields,
+                self._values())))
+
+    def _asdict(self):
+        ''' The values, derived ones included, in a ``dict``. '''
+
+        return dict((field, getattr(self, a)) for field, a in
+                zip(self._fields, self._attributes))
+
+    def _close(self):
+        ''' Shut down the pools of :meth:`Parser.executor` values. '''
+
+        for value in self._values():
+            if isinstance(value, LazyExecutor):
+                value.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._close()
+        return False
+
+    def _to_argv(self):
+        ''' Command line arguments that parse to this result. Values are
+        written as they are given: ranges as ``start:stop[:step]``, files by
+        name and multiword values word by word. Raises :class:`ValueError`
+        for values that have no such form, such as those of custom casts. '''
+
+        argv = []
+        for attribute, label, words in self._arguments:
+            value = getattr(self, attribute)
+            if words is None:
+                if value:
+                    argv.append(label)
+            elif value is not None:
+                for v in (value if isinstance(value, tuple) else (value,)):
+                    if v is not _ArgumentReader.UNSPECIFIED:
+                        argv.append(label)
+                        argv.extend(words(v))
+
+        return argv
+
+
+def _word(value):
+    return [str(value)]
+
+
+def _multiple_words(value):
+    return value.split(' ')
+
+
+def _range_words(value):
+    words = '%d:%d' % (value.start, value.stop)
+    if value.step != 1:
+        words += ':%d' % value.step
+    return [words]
+
+
+def _file_words(value):
+    return value.name.split(' ')
+
+
+def _no_words(value):
+    raise ValueError('%r has no command line form' % (value,))
+
+
+def _argv_words(reader):
+    ''' Function giving the command line words of a value read by ``reader``
+    (see :meth:`_Result._to_argv`), or ``None`` for flags. '''
+
+    cast = reader._cast if isinstance(reader, Caster) else None
+    while isinstance(reader, Caster):
+        reader = reader._reader
+
+    if isinstance(reader, _FlagArgumentReader):
+        return None
+    if cast is None or cast in (int, float, _url) or isinstance(cast,
+            _DirectoryOpenerCaster):
+        if isinstance(reader, _MultiWordArgumentReader):
+            return _multiple_words
+        return _word
+    if isinstance(cast, _RangeCaster):
+        return _range_words
+    if isinstance(cast, _FileOpenerCaster):
+        return _file_words
+    return _no_words
+
+
+def _attribute(name):
+    ''' Attribute for argument ``name`` in parse results. '''
+
+    attribute = ''.join(c if c.isalnum() or c == '_' else '_' for c in name)
+    if not attribute or attribute[0].isdigit():
+        attribute = '_' + attribute
+    return attribute
+
+
+def _check_attribute(name):
+    ''' Raises :class:`ValueError` if argument ``name`` would hide a member of
+    parse results. '''
+
+    # the members all start with _, as do the attributes of names that do
+    # not start with a letter
+    if not name[:1].isalpha() and _attribute(name) in _RESULT_MEMBERS:
+        raise ValueError('%s clashes with a member of parse results' % name)
+
+
+def _result_class(parser, names):
+    ''' Class of :meth:`Parser.parse` results with values for ``names``,
+    followed by the derived arguments of ``parser``. '''
+
+    derived = parser._derived_order() if parser._derived else []
+    fields = tuple(names) + tuple(derived)
+    attributes = tuple(_attribute(name) for name in fields)
+    if len(set(attributes)) < len(attributes):
+        raise ValueError('arguments %s have the same attributes' %
+                ', '.join(name for name, a in zip(fields, attributes) if
+                    attributes.count(a) > 1))
+
+    attribute_of = dict(zip(fields, attributes))
+    arguments = []
+    for name in names:
+        reader = parser._readers.get(name)
+        if reader is None:
+            # a lazy spec, whose argument is not created yet
+            spec = parser._lazy[name]
+            reader = parser._spec_reader(_spec_kind(spec))
+            if 'cast' in spec:
+                reader = Caster(reader, spec['cast'])
+
+        arguments.append((attribute_of[name], parser._double_prefix +
+            parser._unlocalize(name), _argv_words(reader)))
+
+    cls = type('Result', (_Result,), {
+        '__slots__': attributes,
+        '_fields': fields,
+        '_attributes': attributes,
+        '_attribute_of': attribute_of,
+        '_derived': dict((attribute_of[name], (parser._derived[name][0],
+            [attribute_of[n] for n in parser._derived[name][1]])) for name in
+            derived),
+        '_arguments': tuple(arguments)})
+    cls._setters = tuple(getattr(cls, a).__set__ for a in
+            attributes[:len(names)])
+    return cls
+
+
+_RESULT_MEMBERS = frozenset(dir(_Result))
+
+
+# ---------- spec cache ---------- #
+
+
+def _cache_dir():
+    d = os.environ.get('BLARGS_CACHE_DIR')
+    if d:
+        return d
+
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(
+            os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'blargs')
+
+
+def _trusted_dir(directory):
+    ''' Whether only this user could have written the files in
+    ``directory``: it is theirs, and no one else may write to it. '''
+
+    try:
+        st = os.stat(directory)
+    except OSError:
+        return False
+
+    if not hasattr(os, 'getuid'):
+        return True  # no owners to check, e.g., on Windows
+    return st.st_uid == os.getuid() and not st.st_mode & 0o022
+
+
+def _file_stamp(filename):
+    try:
+        st = os.stat(filename)
+        return '%s %d %r' % (filename, st.st_size, st.st_mtime)
+    except (OSError, TypeError):
+        return repr(filename)
+
+
+# constants that are part of a definition by value
+_CONSTANT_TYPES = (type(None), bool, int, float, complex, str, bytes,
+        unicode, type(2 ** 64))
+
+
+def _is_constant(value):
+    if isinstance(value, (tuple, frozenset)):
+        return all(_is_constant(v) for v in value)
+    return isinstance(value, _CONSTANT_TYPES)
+
+
+def _dependencies(build):
+    ''' What ``build`` refers to through its closure and globals, and its
+    nested functions: the code of functions, the files of functions,
+    classes and modules, and constants. '''
+
+    values = []
+    for cell in build.__closure__ or ():
+        try:
+            values.append(cell.cell_contents)
+        except ValueError:
+            pass  # not yet assigned
+
+    codes = [build.__code__]
+    names = set()
+    while codes:
+        code = codes.pop()
+        names.update(code.co_names)
+        codes.extend(c for c in code.co_consts if hasattr(c, 'co_names'))
+
+    values.extend(build.__globals__[name] for name in sorted(names) if name
+            in build.__globals__)
+
+    found = []
+    for value in values:
+        if _is_constant(value):
+            found.append(repr(value))
+        elif hasattr(value, '__code__'):
+            found.append(value.__code__)
+            found.append(_file_stamp(value.__code__.co_filename))
+        elif isinstance(value, type(sys)):
+            found.append(_file_stamp(getattr(value, '__file__', None)))
+        elif isinstance(value, type):
+            module = sys.modules.get(value.__module__)
+            found.append(_file_stamp(getattr(module, '__file__', None)))
+
+    return tuple(found)
+
+
+def _definition_key(build, key):
+    ''' The code of ``build``, the file it is defined in, what it refers to
+    (see :func:`_dependencies`), ``key``, and the blargs and Python versions,
+    as bytes. '''
+
+    import marshal
+
+    code = build.__code__
+    return marshal.dumps((code, _file_stamp(code.co_filename),
+        _dependencies(build), repr(key), __version__, sys.version))
+
+
+def _pickle():
+    try:
+        # the C implementation alone; pickle.py imports re and more, which
+        # would cost more than the cache saves
+        import _pickle as pickle
+    except ImportError:
+        import pickle
+    return pickle
+
+
+# ---------- code generation ---------- #
+
+
+class _Lines(list):
+    ''' File-like object that keeps what is written to it. '''
+
+    def write(self, s):
+        self.append(s)
+
+
+_CODEGEN_HEADER = '''# Generated by blargs %(version)s (python -m blargs codegen %(spec)s).
+# Do not edit; regenerate when the parser definition changes.
+
+from __future__ import print_function
+
+from bisect import bisect_left
+import operator
+import sys
+
+from blargs import UNSPECIFIED
+%(imports)s
+
+class ArgumentError(ValueError):
+    pass
+
+
+class FormatError(ArgumentError):
+    pass
+
+
+class ConditionError(ArgumentError):
+    pass
+
+
+class FailedConditionError(ArgumentError):
+    pass
+
+
+class MissingRequiredArgumentError(ArgumentError):
+    pass
+
+
+class ManyAllowedNoneSpecifiedArgumentError(ArgumentError):
+    pass
+
+
+class UnspecifiedArgumentError(ArgumentError):
+    pass
+
+
+class AmbiguousArgumentError(ArgumentError):
+    pass
+
+
+class MultipleSpecifiedArgumentError(ArgumentError):
+    pass
+
+
+class DependencyError(ArgumentError):
+    pass
+
+
+class ConflictError(ArgumentError):
+    pass
+
+
+class MissingValueError(ArgumentError):
+    pass
+
+
+try:
+    xrange
+except NameError:
+    xrange = range
+
+
+def _is_in(value, choices):
+    return value in choices
+
+'''
+
+_CODEGEN_PARSE = '''
+
+def parse(args=None):
+    \'\'\' Parse ``args`` (by default, ``sys.argv[1:]``) and return a dict of
+    argument values. Raises :class:`ArgumentError` on invalid input. \'\'\'
+
+    if args is None:
+        args = sys.argv[1:]
+
+    if not isinstance(args, list):
+        raise TypeError('%%s not list' %% args)
+
+    tokens = []
+    for arg in args:
+        if '=' in arg:
+            tokens += arg.split('=')
+        else:
+            tokens.append(arg)
+
+    given = [None] * %(count)d
+    # tokens that were neither arguments nor their values
+    extras = []
+    pending = None
+    words = None
+    for arg in tokens:
+        if pending is not None:
+            pending[-1] = arg
+            pending = None
+            continue
+
+        if words is not None:
+            if not arg.startswith(_PREFIXES):
+                words.append(arg)
+                continue
+            words = None
+
+        if arg.startswith(_PREFIXES):
+            if arg.startswith(%(double)r):
+                name = arg[%(double_length)d:]
+                labels, label = _FULL, name%(localize)s
+            else:
+                name = arg[%(single_length)d:]
+                labels, label = _SHORT, name%(localize)s
+
+            i = labels.get(label)
+            if i is None and label:
+                matches = _completions(_SORTED[labels is _FULL], label)
+                if len(matches) > 1:
+                    raise AmbiguousArgumentError('ambiguous option %%s: %%s'
+                            %% (label, ', '.join(matches)))
+                if matches:
+                    i = labels[matches[0]]
+
+            if i is None:
+                if _INDEX[0] is None:
+                    _INDEX[0] = _trigram_index(_LABELS)
+                suggestions = _suggestions(arg, _LABELS, _INDEX[0])
+                message = 'illegal option %%s' %% name
+                if suggestions:
+                    message += ' (did you mean %%s?)' %% ', '.join(suggestions)
+                raise UnspecifiedArgumentError(message)
+
+            occurrences = given[i]
+            if occurrences is None:
+                occurrences = given[i] = []
+
+            kind = _KINDS[i]
+            if kind == 0:
+                occurrences.append(UNSPECIFIED)
+                pending = occurrences
+            elif kind == 1:
+                words = []
+                occurrences.append(words)
+            else:
+                occurrences.append(True)
+%(positional)s
+    if pending is not None:
+        raise MissingValueError()
+%(body)s
+'''
+
+_CODEGEN_FOOTER = '''
+
+def usage():
+    return 'Usage: %%s ' %% sys.argv[0] + _USAGE
+
+
+def print_help():
+    print(usage())
+    sys.stdout.write(_HELP)
+
+
+def process_command_line(args=None):
+    \'\'\' Like :func:`parse`, but on invalid input prints the error and usage
+    and exits. \'\'\'
+
+    try:
+        return parse(args)
+    except ArgumentError as e:
+        print('Error: ' + str(e) + '\\n' + usage())
+        raise SystemExit(1)
+
+
+_USAGE = %(usage)r
+
+_HELP = %(help)r
+'''
+
+_CODEGEN_OPERATORS = {operator.le: 'operator.le',
+                      operator.lt: 'operator.lt',
+                      operator.gt: 'operator.gt',
+                      operator.ge: 'operator.ge',
+                      operator.eq: 'operator.eq',
+                      operator.ne: 'operator.ne',
+                      _is_in: '_is_in'}
+
+
+class _Codegen(object):
+    ''' Writes the source of a module that parses like a given parser. See
+    :meth:`Parser.codegen`. '''
+
+    def __init__(self, parser, spec):
+        if (parser._instrument is not None or parser._hooks is not None or
+                parser._profiling is not None or parser._appliers or
+                parser._subcommands or parser._derived):
+            raise ValueError('cannot generate code for instrumented, hooked,'
+                    + ' profiling, resource or derived arguments or'
+                    + ' subcommands')
+
+        parser._materialize(list(parser._lazy))
+        self._parser = parser
+        self._spec = spec
+        self._names = list(parser._readers)
+        self._index = dict((name, i) for i, name in enumerate(self._names))
+        self._imports = []
+        self._helpers = []
+        self._definitions = []
+        self._constants = []
+        self._members = {}
+
+    def _literal(self, value):
+        import ast
+
+        text = repr(value)
+        try:
+            same = ast.literal_eval(text) == value
+        except (ValueError, SyntaxError):
+            same = False
+
+        if not same:
+            raise ValueError('cannot generate code for value %s' % text)
+        return text
+
+    def _helper(self, obj):
+        if obj not in self._helpers:
+            self._helpers.append(obj)
+
+    def _cast(self, cast):
+        if cast in (int, float, str, bool):
+            return cast.__name__
+        if cast is _url:
+            self._helper(_url)
+            return '_url'
+        if isinstance(cast, _RangeCaster):
+            self._helper(_RangeCaster)
+            return '_RangeCaster()'
+        if isinstance(cast, _FileOpenerCaster):
+            self._helper(_FileOpenerCaster)
+            return '_FileOpenerCaster(**%s)' % self._literal(cast._kw)
+        if isinstance(cast, _DirectoryOpenerCaster):
+            self._helper(_DirectoryOpenerCaster)
+            if 'import os' not in self._imports:
+                self._imports.append('import os')
+            return '_DirectoryOpenerCaster(%s)' % self._literal(cast._create)
+
+        # anything else is imported by name
+        module = getattr(cast, '__module__', None)
+        name = getattr(cast, '__qualname__', getattr(cast, '__name__', ''))
+        if module not in (None, __name__, '__main__') and '<' not in name:
+            obj = sys.modules.get(module)
+            for part in name.split('.'):
+                obj = getattr(obj, part, None)
+
+            if obj is cast:
+                line = 'from %s import %s' % (module, name.split('.')[0])
+                if line not in self._imports:
+                    self._imports.append(line)
+                return name
+
+        raise ValueError('cannot generate code for cast %r' % (cast,))
+
+    def _option(self, i, name):
+        reader = self._parser._readers[name]
+        casts = []
+        while isinstance(reader, Caster):
+            casts.insert(0, reader._cast)
+            reader = reader._reader
+
+        if type(reader) is _SingleWordReader:
+            kind = 0
+        elif type(reader) is _MultiWordArgumentReader:
+            kind = 1
+        elif type(reader) is _FlagArgumentReader:
+            kind = 2
+        else:
+            raise ValueError('cannot generate code for reader of %s' % name)
+
+        out = self._definitions
+        out.append('')
+        out.append('# %s' % name)
+        if casts:
+            out.append('_CASTS_%d = (%s,)' % (i, ', '.join(self._cast(c) for c
+                in casts)))
+            out.append('')
+            out.append('')
+            out.append('def _cast_%d(v):' % i)
+            out.append('    try:')
+            out.append('        for cast in _CASTS_%d:' % i)
+            out.append('            v = None if v is UNSPECIFIED else cast(v)')
+            out.append('    except FormatError:')
+            out.append('        raise')
+            out.append('    except ValueError:')
+            out.append('        raise FormatError()')
+            out.append('    return v')
+
+        value = {0: 'o', 1: "' '.join(o)", 2: 'o'}[kind]
+        if casts:
+            value = '_cast_%d(%s)' % (i, value)
+        out.append('')
+        out.append('')
+        out.append('def _value_%d(o):' % i)
+        if name == self._parser._unspecified_default:
+            # positional values are not cast
+            out.append('    if o.__class__ is tuple:')
+            out.append('        return o[0]')
+        out.append('    return %s' % value)
+
+        if reader._default is not _ArgumentReader.UNSPECIFIED:
+            default = self._literal(reader._default)
+        elif kind == 2:
+            default = 'False'
+        else:
+            default = 'UNSPECIFIED'
+
+        out.append('')
+        out.append('')
+        out.append('def _default_%d():' % i)
+        if casts:
+            out.append('    return _cast_%d(%s)' % (i, default))
+        else:
+            out.append('    return %s' % default)
+
+        if not casts and default == 'UNSPECIFIED':
+            assigned_default = 'None'
+        else:
+            assigned_default = '_default_%d()' % i
+
+        resolvable = kind != 2 and (reader._default is not
+                _ArgumentReader.UNSPECIFIED)
+        return kind, resolvable, assigned_default
+
+    # -- conditions, as expressions over `given`
+
+    def _known(self, option):
+        i = self._index.get(option.argname)
+        if i is None:
+            raise ValueError('%s not known' % option.argname)
+        return i
+
+    def _values(self, item):
+        if isinstance(item, Option):
+            i = self._known(item)
+            return ('([_default_%d()] if given[%d] is None else [_value_%d(o)'
+                    + ' for o in given[%d]])') % (i, i, i, i)
+
+        if isinstance(item, _Choices):
+            values = self._literal(item._values)
+            if isinstance(item._lookup, frozenset):
+                values = 'frozenset(%s)' % values
+            self._constants.append(values)
+            return '(_K%d,)' % (len(self._constants) - 1)
+
+        return '(%s,)' % self._literal(item)
+
+    def _satisfied(self, cond):
+        if isinstance(cond, Group):
+            terms = []
+            for item in cond._names:
+                if not isinstance(item, Condition):
+                    raise ValueError('cannot generate code for group of %r' %
+                            (item,))
+                terms.append(self._satisfied(item))
+            return '(%s)' % ' or '.join(terms)
+
+        if isinstance(cond, Option):
+            i = self._known(cond)
+            inner = 'given[%d] is not None' % i
+            if self._resolvable[i]:
+                inner = 'True'
+        elif isinstance(cond, _CallableCondition):
+            call = _CODEGEN_OPERATORS.get(cond._call)
+            if call is None:
+                raise ValueError('cannot generate code for %r' % (cond,))
+            inner = '_check_holds(%s, %s, %s, %r, %r)' % (self._values(
+                cond._main), self._values(cond._other), call, repr(cond),
+                cond._operand_names())
+        elif isinstance(cond, _Members):
+            count = self._members.get(id(cond))
+            if count is None:
+                count = self._members[id(cond)] = ('n%d' % len(self._members),
+                        cond)
+            name = count[0]
+            if isinstance(cond, _AllOf):
+                inner = '%s == %d' % (name, len(cond._members))
+            elif isinstance(cond, _AnyOf):
+                inner = '%s > 0' % name
+            else:
+                inner = '%s > 1' % name
+        else:
+            raise ValueError('cannot generate code for %r' % (cond,))
+
+        terms = [self._satisfied(c) for c in cond._other_conditions]
+        terms.append(inner)
+        result = (' and ' if cond._and else ' or ').join(terms)
+        if len(terms) > 1:
+            result = '(%s)' % result
+        if cond._neg:
+            result = '(not %s)' % result
+        return result
+
+    def _raise(self, out, indent, error, message):
+        out.append('%sraise %s(%r)' % (' ' * indent, error, message))
+
+    def _checks(self):
+        # in the order of Parser._verify, so that the first error is the same
+        p = self._parser
+        out = []
+
+        for arg, replacements in iteritems(p._required):
+            out.append('    if not %s:' % self._satisfied(arg))
+            missing = []
+            for v in replacements:
+                if isinstance(v, Group):
+                    missing += v._names
+                elif isinstance(v, _AnyOf):
+                    for m in v._others(arg):
+                        if isinstance(m, Group):
+                            missing += m._names
+                elif not isinstance(v, Condition):
+                    missing.append(v)
+
+            indent = 8
+            if replacements:
+                out.append('        if not (%s):' % ' or '.join(
+                    self._satisfied(v) for v in replacements))
+                indent = 12
+
+            if missing:
+                error = ManyAllowedNoneSpecifiedArgumentError([arg] + missing)
+            else:
+                error = MissingRequiredArgumentError(arg)
+            self._raise(out, indent, type(error).__name__, str(error))
+
+        for arg, deps in iteritems(p._requires):
+            out.append('    if %s:' % self._satisfied(arg))
+            for v in deps:
+                out.append('        if not %s:' % self._satisfied(v))
+                if isinstance(v, _CallableCondition):
+                    self._raise(out, 12, 'ConditionError', str(ConditionError(
+                        arg.argname, v)))
+                elif isinstance(v, _AllOf):
+                    for m in v._members:
+                        out.append('            if not %s:' % self._satisfied(m))
+                        self._raise(out, 16, 'DependencyError',
+                                str(DependencyError(arg, m)))
+                else:
+                    self._raise(out, 12, 'DependencyError',
+                            str(DependencyError(arg, v)))
+
+        for arg, conflicts in iteritems(p._conflicts):
+            out.append('    if %s:' % self._satisfied(arg))
+            for conflict in conflicts:
+                out.append('        if %s:' % self._satisfied(conflict))
+                if isinstance(conflict, _MoreThanOne):
+                    for m in conflict._others(arg):
+                        out.append('            if %s:' % self._satisfied(m))
+                        self._raise(out, 16, 'ConflictError', str(ConflictError(
+                            arg.argname, m.argname)))
+                elif isinstance(conflict, Option):
+                    self._raise(out, 12, 'ConflictError', str(ConflictError(
+                        arg.argname, conflict.argname)))
+                else:
+                    self._raise(out, 12, 'ConflictError', str(ConflictError(
+                        arg.argname, conflict)))
+
+        # members of aggregate conditions are counted once; being arguments,
+        # counting them casts nothing and so raises no error of its own
+        counts = []
+        for name, cond in self._members.values():
+            counts.append('    %s = %s' % (name, ' + '.join('(%s)' %
+                self._satisfied(m) for m in cond._members)))
+
+        return counts + out
+
+    def source(self):
+        import inspect
+
+        p = self._parser
+        for helper in (_holds, _check_holds, _completions, _trigrams, _trigram_index,
+                _edit_distance, _suggestions):
+            self._helper(helper)
+        kinds, self._resolvable, assigned = [], [], []
+        for i, name in enumerate(self._names):
+            kind, resolvable, default = self._option(i, name)
+            kinds.append(kind)
+            self._resolvable.append(resolvable)
+            assigned.append(default)
+
+        body = []
+        for i, name in enumerate(self._names):
+            if kinds[i] == 1:
+                body.append('    if given[%d] is not None and [] in given[%d]:'
+                        % (i, i))
+                body.append('        raise MissingValueError()')
+
+        if 'help' in self._index:
+            body.append('')
+            body.append('    if given[%d] is not None:' % self._index['help'])
+            body.append('        print_help()')
+            body.append('        raise SystemExit(0)')
+
+        body.append('')
+        for i, name in enumerate(self._names):
+            option = p._options[name]
+            if not option._allows_multiple:
+                body.append('    if given[%d] is not None and len(given[%d]) >'
+                        ' 1:' % (i, i))
+                self._raise(body, 8, 'MultipleSpecifiedArgumentError',
+                        '%s specified multiple times' % option)
+
+        body.append('')
+        body += self._checks()
+
+        body.append('')
+        body.append('    return {')
+        for i, name in enumerate(self._names):
+            if p._options[name]._allows_multiple:
+                value = ('[_value_%d(o) for o in given[%d]] if given[%d] is not'
+                        + ' None else [_default_%d()]') % (i, i, i, i)
+            else:
+                value = ('_value_%d(given[%d][0]) if given[%d] is not None else'
+                        + ' %s') % (i, i, i, assigned[i])
+            body.append('        %r: %s,' % (name, value))
+        body.append('    }')
+
+        if p._unspecified_default is None:
+            positional = ('        else:\n'
+                          '            extras.append(arg)\n')
+        else:
+            i = self._index[p._unspecified_default]
+            positional = ('        else:\n'
+                          '            if given[%d] is None:\n'
+                          '                given[%d] = []\n'
+                          '            given[%d].append((arg,))\n') % (i, i, i)
+
+        localize = ''
+        if p._to_underscore:
+            localize = ".replace('-', '_')"
+
+        full = dict((p._options[name].argname, self._index[name]) for name in
+                self._names)
+        short = dict((alias, self._index[source]) for alias, source in
+                iteritems(p._alias))
+
+        lines = _Lines()
+        out, p.out = p.out, lines
+        try:
+            p.print_help()
+        finally:
+            p.out = out
+        usage = p._usage()
+        text = ''.join(lines)[len(usage) + 1:]
+
+        parts = [_CODEGEN_HEADER % {
+            'version': __version__,
+            'spec': self._spec,
+            'imports': '\n'.join(self._imports) + '\n' if self._imports else ''}]
+        for helper in self._helpers:
+            parts.append('\n' + inspect.getsource(helper) + '\n')
+        parts.append('\n_PREFIXES = (%r, %r)\n' % (p._single_prefix,
+            p._double_prefix))
+        parts.append('_KINDS = %r\n' % (tuple(kinds),))
+        parts.append('_FULL = %r\n' % full)
+        parts.append('_SHORT = %r\n' % short)
+        parts.append('_SORTED = (sorted(_SHORT), sorted(_FULL))\n')
+        # for suggestions, built on the first unknown label
+        parts.append('_LABELS = sorted([%r + label for label in _FULL] + [%r +'
+                ' label for label in _SHORT])\n' % (p._double_prefix,
+                    p._single_prefix))
+        parts.append('_INDEX = [None]\n')
+        parts.append('\n'.join(self._definitions) + '\n')
+        for i, value in enumerate(self._constants):
+            parts.append('\n_K%d = %s\n' % (i, value))
+        parts.append(_CODEGEN_PARSE % {
+            'count': len(self._names),
+            'double': p._double_prefix,
+            'double_length': len(p._double_prefix),
+            'single_length': len(p._single_prefix),
+            'localize': localize,
+            'positional': positional,
+            'body': '\n'.join(body)})
+        parts.append(_CODEGEN_FOOTER % {
+            'usage': usage[len('Usage: %s ' % sys.argv[0]):],
+            'help': text})
+
+        return ''.join(parts)
+
+
+def _load(spec):
+    ''' The object ``name`` of module ``module``, given ``module:name``. '''
+
+    module, _, name = spec.partition(':')
+    __import__(module)
+    obj = sys.modules[module]
+    for part in name.split('.'):
+        obj = getattr(obj, part)
+
+    return obj
+
+
+def _build(obj):
+    ''' ``obj`` if it is a :class:`Parser`; otherwise a parser on which
+    function ``obj`` defined arguments. '''
+
+    if isinstance(obj, Parser):
+        return obj
+
+    parser = Parser()
+    obj(parser)
+    return parser
+
+
+def _codegen_main(args):
+    ''' ``python -m blargs codegen module:name [-o file]``, where ``name`` is a
+    :class:`Parser` or a function that defines arguments on the parser passed
+    to it (as with :meth:`Parser.cached`). '''
+
+    if not args or args[0] != 'codegen':
+        print('Usage: python -m blargs codegen module:name [-o file]',
+                file=sys.stderr)
+        raise SystemExit(1)
+
+    p = Parser({})
+    p.str('spec').unspecified_default().required().described_as(
+            'module:name of a Parser, or of a function that defines one')
+    p.str('output').shorthand('o').described_as(
+            'File to write (default: stdout)')
+    vals = p.process_command_line(args[1:])
+
+    sys.path.insert(0, os.getcwd())
+    obj = _build(_load(vals['spec']))
+
+    source = obj.codegen(vals['spec'])
+    if vals['output']:
+        with open(vals['output'], 'w') as f:
+            f.write(source)
+    else:
+        sys.stdout.write(source)
+
+
+# ---------- declarative specs ---------- #
+
+# types that add_many registers directly: reader class, cast
+_SPEC_TYPES = {'str': (_SingleWordReader, None),
+               'int': (_SingleWordReader, int),
+               'float': (_SingleWordReader, float),
+               'url': (_SingleWordReader, _url),
+               'flag': (_FlagArgumentReader, None),
+               'bool': (_FlagArgumentReader, None),
+               'multiword': (_MultiWordArgumentReader, None),
+               'range': (_MultiWordArgumentReader, _RangeCaster())}
+
+# types that add_many creates through the parser method of the same name
+_SPEC_METHODS = frozenset(['file', 'directory', 'config', 'executor', 'cpus',
+    'nice', 'max_memory', 'max_open_files'])
+
+
+def _spec_kind(spec):
+    ''' The ``_SPEC_TYPES`` type of lazy ``spec``. '''
+
+    kind = spec.get('type', 'str')
+    return 'str' if kind == 'enum' else kind
+
+
+_SPEC_KEYS = frozenset(['name', 'type', 'shorthand', 'default', 'description',
+    'required', 'multiple', 'requires', 'conflicts', 'cast',
+    'unspecified_default', 'values'])
+
+# keys of specs that need no more than an argument of their type
+_SPEC_PLAIN = frozenset(['name', 'type'])
+
+
+# ---------- subcommands ---------- #
+
+
+class _Subcommand(object):
+    ''' Command added with :meth:`Parser.subcommand`; its parser is built, and
+    its builder imported, when the command is first selected. '''
+
+    __slots__ = ('description', '_builder', '_parser')
+
+    def __init__(self, builder, description):
+        self.description = description
+        self._builder = builder
+        self._parser = None
+
+    def parser(self, parent):
+        if self._parser is None:
+            builder = self._builder
+            if isstring(builder):
+                builder = _load(builder)
+
+            parser = _build(builder)
+            names = set(parser._readers) | set(parser._lazy) | set(
+                    parser._derived)
+            names.discard('help')
+            clash = [name for name in names if name == 'command' or
+                    parent._argument_exists(name)]
+            if clash:
+                raise ValueError('command arguments %s are also arguments of'
+                        ' the parser' % ', '.join(sorted(clash)))
+
+            parser.out = parent.out
+            parser._sys_exit_error = parent._sys_exit_error
+            self._parser = parser
+
+        return self._parser
+
+
+class Parser(object):
+    ''' Command line parser. '''
+
+    def __init__(self, store=None):
+        self._options = {}
+        self._readers = {}
+        self._extras = []
+        self._unspecified_default = None
+
+        # dict of A (required) -> args that could replace A if A is not
+        # specified
+        self._required = {}
+
+        # dict of A -> args that A depends on
+        self._requires = {}
+
+        # dict of A -> args that A conflicts with
+        self._conflicts = {}
+
+        self._alias = {}
+        self._source_to_alias = {}
+
+        # specs added with add_many(lazy=True) whose arguments are not created
+        # yet, their values when not given, and those that are required
+        self._lazy = {}
+        self._lazy_values = {}
+        self._lazy_required = []
+
+        # sorted short and full labels, with the number of arguments they were
+        # sorted for; see _lookup
+        self._sorted_labels = [None, None]
+
+        # labels and their _trigram_index, for suggestions; see _suggest
+        self._label_index = None
+
+        # derived from the definition (e.g., help text), and dropped when it
+        # changes; see _invalidate
+        self._cache = {}
+
+        # help search term of the last parse, from --help=<term>
+        self._help_term = None
+
+        # name -> (function, names of its arguments); see derived()
+        self._derived = {}
+
+        # name -> _Subcommand; see subcommand()
+        self._subcommands = {}
+        # (name, arguments) of the command selected by the last parse
+        self._command = None
+
+        # convert arg labels to understore in value dict
+        self._to_underscore = False
+
+        # prefix to shorthand args
+        self._single_prefix = '-'
+
+        # prefix to fullname args
+        self._double_prefix = '--'
+
+        # help message
+        self._help_prefix = None
+
+        self._sys_exit_error = SystemExit
+        self.out = sys.stdout # XXX not documented
+
+        # executors etc. created by argument values; released by close()
+        self._resources = []
+
+        # arguments whose values are applied to the process after parsing
+        self._appliers = []
+
+        # names of the arguments added by profiling(); see _start_profiling
+        self._profiling = None
+        self._profiler = None
+
+        # see on_token() etc.
+        self._hooks = None
+
+        # environment variables read while building, and their values; see
+        # cached()
+        self._environ = {}
+
+        # called with the ParseStats of each parse; see instrument()
+        self._instrument = None
+        if self._getenv('BLARGS_INSTRUMENT'):
+            self.instrument()
+
+        # set by user
+        self._init_user_set(store)
+
+        self.flag('help').shorthand('h').described_as('Print help message.')
+
+    def _init_user_set(self, store=None):
+        # only a store of our own holds derived values to compute later
+        self._own_store = store is None
+        if store is None:
+            store = _Values() if self._derived else {}
+        self._store = store
+        self._namemaps = {}
+        self._rnamemaps = {}
+
+    def _getenv(self, name):
+        ''' Environment variable ``name``, noted as part of the definition. '''
+
+        value = os.environ.get(name)
+        self._environ.setdefault(name, value)
+        return value
+
+    def _invalidate(self):
+        ''' Called when the definition changes. '''
+
+        if self._cache:
+            self._cache = {}
+
+    def _argument_exists(self, name_or_alias):
+        return (name_or_alias in self._readers or name_or_alias in self._alias
+                or name_or_alias in self._lazy or name_or_alias in
+                self._derived)
+
+    def set_help_prefix(self, message):
+        ''' Indicate text to appear before argument list when the ``help``
+        function is triggered. '''
+
+        self._help_prefix = message
+        self._invalidate()
+        return self
+
+    def underscore(self):
+        ''' Convert '-' to '_' in argument names. This is enabled if
+        ``with_locals`` is used, as variable naming rules are applied. '''
+
+        self._to_underscore = True
+        self._invalidate()
+        return self
+
+    def set_single_prefix(self, flag):
+        ''' Set the single flag prefix. This appears before short arguments
+        (e.g., -a). '''
+
+        if self._double_prefix in flag:
+            raise ValueError(
+                    'single_prefix cannot be superset of double_prefix')
+
+        self._single_prefix = flag
+        self._invalidate()
+        return self
+
+    def set_double_prefix(self, flag):
+        ''' Set the double flag prefix. This appears before long arguments
+        (e.g., --arg). '''
+
+        if flag in self._single_prefix:
+            raise ValueError('single_flag cannot be superset of double_flag')
+
+        self._double_prefix = flag
+        self._invalidate()
+        return self
+
+    def instrument(self, callback=None):
+        ''' Collect timings and counts for each parse, passing the resulting
+        :class:`ParseStats` to ``callback``. Without a ``callback``, the stats
+        are written to ``stderr`` as a line of JSON. Setting the
+        ``BLARGS_INSTRUMENT`` environment variable instruments every parser
+        this way.
+
+        ::
+
+            p.instrument(lambda stats: log.debug(stats.as_dict()))
+
+        Parsers that are not instrumented do not pay for it.
+
+        '''
+
+        self._instrument = callback or _print_stats
+        return self
+
+    def memory_report(self):
+        ''' Bytes held by this parser, as a dict with keys:
+
+        * ``options``: :class:`Option` objects and their conditions
+        * ``readers``: argument readers and casts
+        * ``constraints``: requirements, dependencies and conflicts
+        * ``names``: aliases and name mappings
+        * ``total``: all of the above, and the rest of the parser
+
+        Sizes come from ``sys.getsizeof``; anything shared is counted once,
+        under the first key it is reached from. Useful for keeping an eye on
+        parsers with very many options.
+
+        '''
+
+        seen = set([id(self), id(self.out), id(self._store),
+            id(_ArgumentReader.UNSPECIFIED)])
+        report = {}
+        for key, attrs in (
+                ('options', ('_options', '_lazy', '_lazy_values',
+                             '_lazy_required')),
+                ('readers', ('_readers', '_extras', '_appliers')),
+                ('constraints', ('_required', '_requires', '_conflicts')),
+                ('names', ('_alias', '_source_to_alias', '_namemaps',
+                           '_rnamemaps'))):
+            report[key] = sum(_deep_size(getattr(self, attr), seen) for attr
+                    in attrs)
+
+        seen.discard(id(self))
+        report['total'] = sum(report.values()) + _deep_size(self, seen)
+        return report
+
+    def profiling(self):
+        ''' Add arguments that profile the program run after parsing:
+
+        * ``--blargs-profile <file>``: write ``cProfile`` stats to file
+        * ``--blargs-timing``: print the run time
+        * ``--blargs-tracemalloc <N>``: print the ``N`` largest allocation
+          sites, as found by ``tracemalloc``
+
+        Profiling starts right after the command line is parsed and results
+        are written when the program exits, or when the function passed to
+        :meth:`run` returns. It starts once: parsing again while it runs
+        leaves it running as it is. These arguments are not assigned to the
+        store.
+
+        ::
+
+            with Parser(locals()).profiling() as p:
+                p.int('arg1')
+
+        ::
+
+            python test.py --arg1 3 --blargs-profile out.prof
+
+        '''
+
+        self._profiling = (
+                self.str('blargs-profile').described_as(
+                    'Write cProfile stats to file.').argname,
+                self.flag('blargs-timing').described_as(
+                    'Print run time.').argname,
+                self.int('blargs-tracemalloc').described_as(
+                    'Print N largest allocation sites.').argname)
+        return self
+
+    def run(self, main, *args, **kwargs):
+        ''' Parse the command line and call ``main``, returning its result.
+        Profiling requested via :meth:`profiling` arguments is reported when
+        ``main`` returns. '''
+
+        self.process_command_line()
+        try:
+            return main(*args, **kwargs)
+        finally:
+            if self._profiler is not None:
+                self._profiler.stop()
+
+    def _hook(self, event, callback):
+        if self._hooks is None:
+            self._hooks = _Hooks(self)
+        self._hooks._add(event, callback)
+        return self
+
+    def on_token(self, callback):
+        ''' Call ``callback(token)`` for each command line token as it is
+        parsed. For example:
+
+        ::
+
+            tokens = []
+            p.on_token(tokens.append)
+            p.process_command_line(['--port', '80'])    # tokens now has both
+
+        Parsers without hooks take the usual path, at no extra cost.
+
+        '''
+
+        return self._hook('token', callback)
+
+    def on_option_start(self, callback):
+        ''' Call ``callback(option)`` with the :class:`Option` whose label (or
+        unlabeled value) was just read. '''
+
+        return self._hook('option_start', callback)
+
+    def on_cast(self, callback):
+        ''' Call ``callback(option, seconds)`` after each cast of an
+        argument's value. '''
+
+        return self._hook('cast', callback)
+
+    def on_constraint(self, callback):
+        ''' Call ``callback(kind, option, result)`` after checking the
+        requirements (``kind`` is ``'required'``), dependencies
+        (``'requires'``) or conflicts (``'conflicts'``) of ``option``.
+        ``result`` is ``False`` if the check failed. '''
+
+        return self._hook('constraint', callback)
+
+    def on_error(self, callback):
+        ''' Call ``callback(error)`` with any :class:`ArgumentError` raised
+        while parsing. '''
+
+        return self._hook('error', callback)
+
+    def use_aliases(self):
+        raise NotImplementedError
+
+    @classmethod
+    def with_locals(cls):
+        ''' Create :class:`Parser` using locals() dict. '''
+
+        vals = sys._getframe(1).f_locals
+        return Parser(vals).underscore()
+
+    @classmethod
+    def cached(cls, build, store=None, key=None, cache_dir=None):
+        ''' Create a :class:`Parser` by calling ``build`` with a new parser,
+        reusing the result of an earlier run when possible.
+
+        ::
+
+            def build(p):
+                p.int('arg1').requires('arg2')
+                ...
+
+            p = Parser.cached(build, locals())
+
+        The built parser is pickled to ``cache_dir`` (by default
+        ``$BLARGS_CACHE_DIR`` or ``~/.cache/blargs``) along with the code of
+        ``build`` and of the functions it refers to, the size and time of the
+        files these and the modules it refers to are in, the simple constants
+        (strings, numbers and the like) it refers to, the environment
+        variables read while building (e.g., by :meth:`Option.environment`),
+        ``key`` and the blargs version; changing any of these builds afresh.
+        Use ``key`` for anything else the definition depends on (e.g., the
+        version of a schema it is generated from).
+
+        Loading costs about as much as creating the parser's arguments and
+        conditions, so the saving is in the rest of ``build``: checking
+        names, descriptions, defaults and constraints. In the ``cached``
+        benchmark of ``bench.py`` (500 such arguments) it about halves the
+        time to get the parser; for plain lists of arguments it saves little.
+
+        Casts are stored by import path, so parsers with casts that cannot be
+        pickled (e.g., lambdas) are built every time, as are those that
+        ``build`` gives hooks (e.g., :meth:`on_token`) or an
+        :meth:`instrument` callback, which are not part of the pickled
+        definition.
+
+        Cache files are unpickled, so they must be trusted: ``cache_dir`` is
+        only used if it belongs to the current user and no one else may
+        write to it; otherwise the parser is built every time.
+
+        '''
+
+        import gc
+        import zlib
+
+        pickle = _pickle()
+        definition = _definition_key(build, key)
+        directory = cache_dir or _cache_dir()
+        path = os.path.join(directory, '%s.%08x.pickle' % (build.__name__,
+            zlib.crc32(definition) & 0xffffffff))
+
+        try:
+            if _trusted_dir(directory):
+                with open(path, 'rb') as f:
+                    # the file starts with the full key, in case names
+                    # collide; as raw bytes, since unpickling bytes of old
+                    # protocols imports codecs
+                    size = int(f.readline())
+                    if f.read(size) == definition:
+                        # the parser's objects are all kept, so collecting
+                        # while they are created (as their number triggers)
+                        # only takes time
+                        enabled = gc.isenabled()
+                        gc.disable()
+                        try:
+                            p = pickle.load(f)
+                        finally:
+                            if enabled:
+                                gc.enable()
+                        if isinstance(p, cls) and all(os.environ.get(name) ==
+                                value for name, value in iteritems(
+                                    p._environ)):
+                            p._init_user_set(store)
+                            return p
+        except Exception:
+            pass  # missing, stale or corrupt: rebuild
+
+        p = cls(store)
+        build(p)
+        if p._hooks is not None or p._instrument is not p._env_instrument():
+            return p  # these would be lost
+
+        tmp = '%s.%d.tmp' % (path, os.getpid())
+        try:
+            data = (('%d\n' % len(definition)).encode('ascii') + definition
+                    + pickle.dumps(p, -1))
+            if not os.path.isdir(directory):
+                os.makedirs(directory, 0o700)
+            if _trusted_dir(directory):
+                with open(tmp, 'wb') as f:
+                    f.write(data)
+                os.rename(tmp, path)
+        except Exception:
+            # not picklable, or cache not writable
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+        return p
+
+    def codegen(self, spec='<parser>'):
+        ''' Source of a module that parses command lines exactly as this
+        parser does, without building any :class:`Option` or
+        :class:`Condition` objects. The module provides ``parse(args=None)``,
+        which returns a ``dict`` of values, ``process_command_line(args=None)``
+        and ``print_help()``, and its own :class:`ArgumentError` classes. It
+        imports only ``UNSPECIFIED`` from blargs, so that the placeholders in
+        its values are those of this parser.
+
+        The same is available from the command line:
+
+        ::
+
+            python -m blargs codegen mycli:build -o _mycli_parser.py
+
+        Casts must be importable by name. Instrumented and hooked parsers,
+        and ``config``, ``executor``, resource and profiling arguments are
+        not supported; :class:`ValueError` is raised for these.
+
+        '''
+
+        return _Codegen(self, spec).source()
+
+    def __getstate__(self):
+        # the definition only: not hooks, instrumentation or what parsing
+        # left behind
+        state = dict(self.__dict__)
+        for key in ('out', '_store', '_resources', '_profiler', '_hooks',
+                '_instrument', '_help_term', '_command'):
+            del state[key]
+        # compiled conditions are closures
+        state['_cache'] = dict((k, v) for k, v in iteritems(self._cache)
+                if k not in ('conditions', 'constraints'))
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.out = sys.stdout
+        self._own_store = True
+        self._store = _Values() if self._derived else {}
+        self._resources = []
+        self._profiler = None
+        self._hooks = None
+        self._instrument = self._env_instrument()
+        self._help_term = None
+        self._command = None
+
+    def _env_instrument(self):
+        ''' The :meth:`instrument` callback set by ``BLARGS_INSTRUMENT``, if
+        it was set when this parser was created. '''
+
+        return _print_stats if self._environ.get('BLARGS_INSTRUMENT') else None
+
+    def subcommand(self, name, builder, description=None):
+        ''' Add command ``name``, selected by the first unlabeled argument.
+        For example:
+
+        ::
+
+            p = Parser(locals())
+            p.flag('verbose')
+            p.subcommand('deploy', 'tools.deploy:build_parser',
+                         'Deploy a release.')
+            p.subcommand('status', 'tools.status:build_parser')
+            p.process_command_line()
+
+        ``builder`` is a :class:`Parser`, a function that defines arguments on
+        the parser passed to it, or the ``module:name`` of either. Only the
+        builder of the selected command is imported and run. Arguments after
+        the command are parsed by its parser, and their values are added to
+        those of this parser, with the command's name under ``command``
+        (``None`` if no command is given); the command's arguments must not
+        share names with this parser's. Nothing is stored, or applied, unless
+        both parse. Help lists commands with their ``description``, without
+        building them.
+
+        '''
+
+        if name in self._subcommands:
+            raise ValueError('command %s specified more than once' % name)
+
+        if self._unspecified_default is not None or 'command' in self._readers:
+            raise ValueError('commands cannot be combined with an unspecified'
+                    + ' default or an argument named command')
+
+        self._subcommands[name] = _Subcommand(builder, description)
+        self._invalidate()
+        return self
+
+    def derived(self, name, function):
+        ''' Add argument ``name``, whose value is ``function`` of the values
+        of the arguments named by its parameters. For example:
+
+        ::
+
+            p = Parser()
+            p.int('nodes').default(1)
+            p.int('per_node').default(4)
+            workers = p.derived('total_workers',
+                                lambda nodes, per_node: nodes * per_node)
+            p.flag('pin').requires(workers <= 64)
 
-        self._default = name
-        return self
+        Derived values are not given on the command line. They are computed
+        when first used, by a condition or from the parsed values, and then
+        kept for the rest of the parse; with a store passed to
+        :class:`Parser`, such as ``locals()``, they are computed after
+        parsing. Arguments may be derived from other derived arguments, but
+        not, directly or otherwise, from themselves.
 
-    def _is_satisfied(self, parsed):
-        for item in self._names:
-            if item._is_satisfied(parsed):
-                return True
-        return False
+        '''
 
-    def __str__(self):
-        return ', '.join([str(name) for name in self._names])
-            
+        name = self._localize(name)
+        if self._argument_exists(name):
+            raise ValueError('multiple types specified for %s' % name)
+        _check_attribute(name)
 
-class Parser(object):
-    ''' Command line parser. '''
+        names = [self._localize(n) for n in _parameters(function)]
+        self._materialize(names)
+        self._derived[name] = (function, names)
+        try:
+            self._derived_order(check_known=False)
+        except ValueError:
+            del self._derived[name]
+            raise
 
-    def __init__(self, store=None):
-        self._options = {}
-        self._readers = {}
-        self._extras = []
-        self._unspecified_default = None
+        if self._own_store and not isinstance(self._store, _Values):
+            self._store = _Values(self._store)
 
-        # dict of A (required) -> args that could replace A if A is not
-        # specified
-        self._required = {}
+        self._invalidate()
+        return Option(name, self)
 
-        # dict of A -> args that A depends on
-        self._requires = {}
+    def _derived_order(self, check_known=True):
+        ''' Names of the derived arguments, each after those it is derived
+        from. Raises :class:`ValueError` on a cycle or, if ``check_known``,
+        an unknown argument. '''
 
-        # dict of A -> args that A conflicts with
-        self._conflicts = {}
+        order = self._cache.get('derived')
+        if order is not None:
+            return order
 
-        self._alias = {}
-        self._source_to_alias = {}
+        order, done = [], set()
 
-        # convert arg labels to understore in value dict
-        self._to_underscore = False
+        def visit(name, path):
+            if name in done:
+                return
+            if name in path:
+                cycle = path[path.index(name):] + [name]
+                raise ValueError('cycle in derived arguments: %s' %
+                        ' -> '.join(cycle))
 
-        # prefix to shorthand args
-        self._single_prefix = '-'
+            for n in self._derived[name][1]:
+                if n in self._derived:
+                    visit(n, path + [name])
+                elif check_known and n not in self._readers:
+                    raise ValueError('%s not known' % n)
 
-        # prefix to fullname args
-        self._double_prefix = '--'
+            done.add(name)
+            order.append(name)
 
-        # help message
-        self._help_prefix = None
+        for name in sorted(self._derived):
+            visit(name, [])
 
-        self._sys_exit_error = SystemExit
-        self.out = sys.stdout # XXX not documented
+        if check_known:
+            self._cache['derived'] = order
+        return order
 
-        # set by user
-        self._init_user_set(store)
+    def _dependents(self):
+        ''' For each argument, the derived arguments whose values depend on
+        it, directly or otherwise, in :meth:`_derived_order`. '''
 
-        self.flag('help').shorthand('h').described_as('Print help message.')
+        dependents = self._cache.get('dependents')
+        if dependents is None:
+            dependents, inputs = {}, {}
+            for name in (self._derived_order() if self._derived else ()):
+                names = inputs[name] = set()
+                for n in self._derived[name][1]:
+                    names.add(n)
+                    names.update(inputs.get(n, ()))
+                for n in names:
+                    dependents.setdefault(n, []).append(name)
 
-    def _init_user_set(self, store=None):
-        if store is None:
-            store = {}
-        self._store = store
-        self._namemaps = {}
-        self._rnamemaps = {}
+            self._cache['dependents'] = dependents
 
-    def _argument_exists(self, name_or_alias):
-        return name_or_alias in self._readers or name_or_alias in self._alias
+        return dependents
 
-    def set_help_prefix(self, message):
-        ''' Indicate text to appear before argument list when the ``help``
-        function is triggered. '''
+    @classmethod
+    def from_spec(cls, spec, store=None, lazy=False):
+        ''' Create a :class:`Parser` from a mapping of argument names to specs;
+        see :meth:`add_many`. '''
 
-        self._help_prefix = message
-        return self
+        p = cls(store)
+        p.add_many([dict(item, name=name) for name, item in iteritems(spec)],
+                lazy)
+        return p
 
-    def underscore(self):
-        ''' Convert '-' to '_' in argument names. This is enabled if
-        ``with_locals`` is used, as variable naming rules are applied. '''
+    def add_many(self, specs, lazy=False):
+        ''' Add arguments from a list of dicts. For example:
 
-        self._to_underscore = True
-        return self
+        ::
 
-    def set_single_prefix(self, flag):
-        ''' Set the single flag prefix. This appears before short arguments
-        (e.g., -a). '''
+            p.add_many([
+                {'name': 'port', 'type': 'int', 'shorthand': 'p',
+                 'default': 8080, 'requires': ['host']},
+                {'name': 'host', 'description': 'Server name'},
+                {'name': 'mode', 'type': 'enum', 'values': ['fast', 'slow']},
+            ])
+
+        Keys are ``name``, and optionally ``type`` (the name of a type method,
+        e.g., ``int``, ``flag``, ``range`` or ``enum``; default ``str``),
+        ``shorthand``, ``default``, ``description``, ``required``,
+        ``multiple``, ``requires`` and ``conflicts`` (names of arguments, here
+        or already added), ``cast``, ``unspecified_default`` and ``values``
+        (for ``enum``).
+
+        All specs are checked before any argument is added; a single
+        :class:`ValueError` lists every problem found. Creating the arguments
+        costs about as much as the equivalent calls (e.g., ``p.int('port')``);
+        use ``p['port']`` for the :class:`Option` of one.
+
+        With ``lazy``, specs are only recorded, and an argument is created
+        when it is first needed: when its label appears on the command line
+        or in a configuration file, when it is looked up (e.g., ``p['port']``)
+        or when help is printed. Parsers generated from large schemas then pay
+        only for the arguments actually used. Arguments with a ``default``,
+        the ``unspecified_default`` one and those of types other than
+        ``str``, ``int``, ``float``, ``url``, ``flag``, ``bool``,
+        ``multiword``, ``range`` and ``enum`` are created right away.
+
+        Returns ``None``.
 
-        if self._double_prefix in flag:
-            raise ValueError(
-                    'single_prefix cannot be superset of double_prefix')
+        '''
 
-        self._single_prefix = flag
-        return self
+        localized = self._check_specs(specs)
+        if not lazy:
+            self._register(localized, specs)
+            return
+
+        unspecified = {}
+        eager = []
+        for name, spec in zip(localized, specs):
+            kind = _spec_kind(spec)
+            if ('default' in spec or spec.get('unspecified_default') or kind
+                    not in _SPEC_TYPES):
+                eager.append((name, spec))
+                continue
+
+            self._lazy[name] = spec
+
+            key = (kind, bool(spec.get('multiple')))
+            if key not in unspecified:
+                unspecified[key] = self._unspecified_value(*key)
+            self._lazy_values[name] = unspecified[key]
+
+            if 'shorthand' in spec:
+                self._alias[spec['shorthand']] = name
+                self._source_to_alias[name] = spec['shorthand']
+
+            if spec.get('required'):
+                self._lazy_required.append(name)
+
+        self._invalidate()
+        if eager:
+            names, specs = zip(*eager)
+            self._register(names, specs)
+            # the lazy specs they refer to
+            self._materialize([self._localize(other) for spec in specs for key
+                in ('requires', 'conflicts') for other in spec.get(key, ())])
+
+    def _check_specs(self, specs):
+        ''' Localized names of ``specs``; raises :class:`ValueError` listing
+        every problem with them. '''
+
+        problems = []
+        names = set(self._readers)
+        names.update(self._lazy)
+        aliases = set(self._alias)
+        positional = self._unspecified_default
+        localized = []
+
+        for spec in specs:
+            name = spec.get('name')
+            if not name or not isstring(name):
+                problems.append('spec without name: %r' % (spec,))
+                localized.append(None)
+                continue
+
+            name = self._localize(name)
+            localized.append(name)
+
+            if not _SPEC_KEYS.issuperset(spec):
+                problems.append('%s: unknown keys %s' % (name, ', '.join(
+                    sorted(set(spec) - _SPEC_KEYS))))
+
+            kind = spec.get('type', 'str')
+            if kind not in _SPEC_TYPES:
+                if kind == 'enum':
+                    if not spec.get('values'):
+                        problems.append('%s: enum without values' % name)
+                elif kind not in _SPEC_METHODS:
+                    problems.append('%s: unknown type %s' % (name, kind))
+
+            if name in names:
+                problems.append('%s: defined more than once' % name)
+            names.add(name)
 
-    def set_double_prefix(self, flag):
-        ''' Set the double flag prefix. This appears before long arguments
-        (e.g., --arg). '''
+            try:
+                _check_attribute(name)
+            except ValueError as e:
+                problems.append(str(e))
+
+            if _SPEC_PLAIN.issuperset(spec):
+                continue
+
+            alias = spec.get('shorthand')
+            if 'shorthand' in spec and not isstring(alias):
+                problems.append('%s: shorthand %r is not a string' % (name,
+                    alias))
+            elif alias is not None:
+                if alias in aliases:
+                    problems.append('%s: shorthand %s already used' % (name,
+                        alias))
+                aliases.add(alias)
+
+            if spec.get('unspecified_default'):
+                if positional is not None:
+                    problems.append(('%s: %s already takes unlabeled values')
+                            % (name, positional))
+                positional = name
+
+        for name, spec in zip(localized, specs):
+            if name is None or _SPEC_PLAIN.issuperset(spec):
+                continue
+
+            for key in ('requires', 'conflicts'):
+                others = spec.get(key, ())
+                if isstring(others):
+                    problems.append('%s: %s must be a list of names' % (name,
+                        key))
+                    continue
 
-        if flag in self._single_prefix:
-            raise ValueError('single_flag cannot be superset of double_flag')
+                for other in others:
+                    if self._localize(other) not in names:
+                        problems.append('%s: %s %s not known' % (name, key,
+                            other))
 
-        self._double_prefix = flag
-        return self
+        if problems:
+            raise ValueError('%d problem(s) in argument specs:\n  %s' % (
+                len(problems), '\n  '.join(problems)))
 
-    def use_aliases(self):
-        raise NotImplementedError
+        return localized
 
-    @classmethod
-    def with_locals(cls):
-        ''' Create :class:`Parser` using locals() dict. '''
+    def _register(self, localized, specs):
+        ''' Add arguments for checked ``specs``. '''
 
-        import inspect
-        vals = inspect.currentframe().f_back.f_locals
-        return Parser(vals).underscore()
+        self._invalidate()
+
+        # create every argument first, so that constraints can refer to
+        # arguments later in the batch
+        options = []
+        for name, spec in zip(localized, specs):
+            kind = spec.get('type', 'str')
+            if kind in _SPEC_TYPES:
+                self._readers[name] = self._spec_reader(kind)
+                option = self._options[name] = Option(name, self)
+            elif kind == 'enum':
+                option = self.str(name)
+            else:
+                option = getattr(self, kind)(name)
+
+            options.append(option)
+
+        # then constrain them in order, as the equivalent calls would
+        for name, option, spec in zip(localized, options, specs):
+            if _SPEC_PLAIN.issuperset(spec):
+                continue
+
+            if 'cast' in spec:
+                option.cast(spec['cast'])
+            if 'default' in spec:
+                self._readers[name]._set_default(spec['default'])
+            if 'shorthand' in spec:
+                self._alias[spec['shorthand']] = name
+                self._source_to_alias[name] = spec['shorthand']
+
+            option._description = spec.get('description', option._description)
+            if spec.get('multiple'):
+                option._allows_multiple = True
+            if spec.get('required'):
+                self._required.setdefault(option, [])
+            if spec.get('unspecified_default'):
+                self._unspecified_default = name
+
+            if spec.get('type') == 'enum':
+                self._requires.setdefault(option, set()).add(
+                        _CallableCondition(_is_in, option,
+                            _Choices(spec['values'])))
+
+            for key, table in (('requires', self._requires), ('conflicts',
+                    self._conflicts)):
+                others = spec.get(key)
+                if others:
+                    table.setdefault(option, set()).update(
+                            self._options[self._localize(other)] for other
+                            in others)
+
+        return options
+
+    def _spec_reader(self, kind):
+        ''' New reader for arguments of type ``kind``, one of
+        ``_SPEC_TYPES``. '''
+
+        reader, cast = _SPEC_TYPES[kind]
+        reader = reader(self)
+        if cast is not None:
+            reader = Caster(reader, cast)
+        return reader
+
+    def _unspecified_value(self, kind, multiple):
+        ''' Value of an argument of type ``kind`` that is not given. '''
+
+        reader = self._spec_reader(kind)
+        if multiple:
+            return [reader.getvalue()]
+
+        value = reader.getvalue()
+        if value is _ArgumentReader.UNSPECIFIED:
+            value = None
+        return value
+
+    def _materialize(self, names):
+        ''' Create the arguments of lazy specs ``names``, and of those their
+        constraints refer to. Returns the names of the created arguments. '''
+
+        created, specs = [], []
+        pending = [name for name in names if name in self._lazy]
+        while pending:
+            name = pending.pop(0)
+            spec = self._lazy.pop(name, None)
+            if spec is None:
+                continue
+
+            del self._lazy_values[name]
+            created.append(name)
+            specs.append(spec)
+            for key in ('requires', 'conflicts'):
+                pending.extend(self._localize(other) for other in spec.get(key,
+                    ()))
+
+        if created:
+            # the definition is the same: results keep their class, and usage
+            # its order
+            kept = dict((key, self._cache[key]) for key in ('result', 'usage')
+                    if key in self._cache)
+            self._register(created, specs)
+            self._cache.update(kept)
+        return created
 
 # --- types --- #
 
@@ -952,17 +4264,20 @@ class Parser(object):
             config file, it must be indicated as allowing multiple (via
             :py:meth:`.multiple`).
 
+            Given more than once (with :py:meth:`.multiple`), the files are
+            read in order, and their values combined as if in one file.
+
+            The most recently used files (16 of them) are read once for all
+            parses (by any parser), and read again when their size or
+            modification time changes.
+
             '''
 
         return self.str(name).cast(_ConfigCaster(self))
 
     def enum(self, name, values):
         arg = self.str(name)
-        cond = arg == values[0]
-        for v in values[1:]:
-            cond = cond.or_(arg == v)
-
-        return arg.requires(cond)
+        return arg.requires(_CallableCondition(_is_in, arg, _Choices(values)))
 
     def int(self, name):
         ''' Add integer argument. '''
@@ -1067,16 +4382,80 @@ class Parser(object):
 
         return self.multiword(name).cast(_DirectoryOpenerCaster(create))
 
+    def executor(self, name, kind='threads', start_method=None):
+        ''' Worker pool argument. Accepts ``N``, ``auto``, ``threads:N`` or
+        ``procs:N`` (``N`` may itself be ``auto``) and defaults to ``auto``,
+        which is the number of CPUs available to this process, taking CPU
+        affinity and cgroup quotas into account. ``kind`` is the pool used
+        when none is given, and ``start_method`` is the ``multiprocessing``
+        start method for process pools.
+
+        The value is a :class:`LazyExecutor`; the pool itself is only created
+        on first use. It is shut down by :meth:`close` once stored (e.g., by
+        :meth:`process_command_line`), or by closing the result of
+        :meth:`parse`.
+
+        ::
+
+            with Parser(locals()) as p:
+                p.executor('jobs').environment()
+
+            results = list(jobs.map(work, items))
+
+        '''
+
+        if kind not in ('threads', 'processes'):
+            raise ValueError('%s not threads or processes' % kind)
+
+        return self.str(name).cast(_ExecutorCaster(kind,
+            start_method)).default('auto')
+
+    def cpus(self, name):
+        ''' CPU affinity, e.g., ``0-3,8-11``. The process is restricted to
+        these CPUs (via ``os.sched_setaffinity``) once the command line is
+        parsed. '''
+
+        return self._resource_option(name, _CpuSetCaster())
+
+    def nice(self, name):
+        ''' Scheduling priority (-20 to 19), applied to the process once the
+        command line is parsed. '''
+
+        return self._resource_option(name, _NiceCaster())
+
+    def max_memory(self, name):
+        ''' Address space limit in bytes, with optional ``K``, ``M``, ``G``,
+        ``T`` or ``P`` suffix (powers of 1024), or ``unlimited``. Applied as the
+        soft ``RLIMIT_AS`` once the command line is parsed, before the program
+        allocates anything.
+
+        ::
+
+            with Parser(locals()) as p:
+                p.max_memory('max-memory')
+                p.max_open_files('max-open-files')
+
+        ::
+
+            python test.py --max-memory 2G --max-open-files 4k
+
+        '''
+
+        return self._resource_option(name, _RlimitCaster('RLIMIT_AS', 1024))
+
+    def max_open_files(self, name):
+        ''' Open file limit, with optional ``k`` or ``m`` suffix (powers of
+        1000), or ``unlimited``. Applied as the soft ``RLIMIT_NOFILE`` once the
+        command line is parsed. '''
+
+        return self._resource_option(name, _RlimitCaster('RLIMIT_NOFILE',
+            1000))
+
     def url(self, name):
         ''' URL value; verifies that argument has a scheme (e.g., http, ftp,
         file). '''
 
-        def parse(value):
-            if urlparse(value).scheme == '':
-                raise FormatError('%s not valid URL' % value)
-            return value
-
-        return self.str(name).cast(parse)
+        return self.str(name).cast(_url)
 
 # --- aggregate calls --- #
 
@@ -1095,17 +4474,29 @@ class Parser(object):
         ''' If *any* of ``args`` is specified, then all of ``args`` must be
         specified. '''
 
-        list(starmap(self._set_requires, permutations(args, 2)))
+        members = self._members(args)
+        condition = _AllOf(members)
+        for m in members:
+            self._requires.setdefault(m, set()).add(condition)
+        self._invalidate()
+
         return Group(self, *args)
 
     def only_one_if_any(self, *args):
         ''' If *any* of ``args`` is specified, then none of the remaining
         ``args`` may be specified.'''
 
-        list(starmap(self._set_conflicts, permutations(args, 2)))
+        members = self._members(args)
+        condition = _MoreThanOne(members)
+        for m in members:
+            self._conflicts.setdefault(m, set()).add(condition)
+        self._invalidate()
+
         return Group(self, *args)
 
     def __getitem__(self, name):
+        if name in self._lazy:
+            self._materialize([name])
         return Option(name, self)
 
 # --- private --- #
@@ -1113,18 +4504,44 @@ class Parser(object):
     def _require_at_least_one(self, *names):
         ''' At least one of the arguments is required. '''
 
-        s = set(names)
-        for v in s:
-            self._set_required(v, s - set([v]))
+        members = self._members(names)
+        condition = _AnyOf(members)
+        for m in members:
+            self._required.setdefault(m, []).append(condition)
+        self._invalidate()
 
         return Group(self, *names)
 
+    def _members(self, args):
+        ''' Conditions for the arguments of an aggregate call, without
+        duplicates. '''
+
+        members = []
+        seen = set()
+        for arg in args:
+            if isstring(arg):
+                arg = self._localize(arg)
+                if arg not in self._readers and not self._materialize([arg]):
+                    raise ValueError('%s not known' % arg)
+                arg = self._options[arg]
+
+            if str(arg) not in seen:
+                seen.add(str(arg))
+                members.append(arg)
+
+        return members
+
     @localize
     def _set_unspecified_default(self, name):
         if self._unspecified_default is not None:
             raise ValueError('Trying to specify multiple unspecified defaults')
 
+        if self._subcommands:
+            raise ValueError('commands cannot be combined with an unspecified'
+                    + ' default')
+
         self._unspecified_default = name
+        self._invalidate()
 
     @localize
     @_verify_args_exist
@@ -1138,10 +4555,12 @@ class Parser(object):
 
         # XXX [] allows redundancy?
         self._required.setdefault(arg, []).extend(newreplacements)
+        self._invalidate()
 
     @localize
     def _set_reader(self, name, option):
         self._readers[name] = option
+        self._invalidate()
 
     def _add_shorthand(self, source, alias):
         if source not in self._readers:
@@ -1152,12 +4571,19 @@ class Parser(object):
 
         self._alias[alias] = source
         self._source_to_alias[source] = alias
+        self._invalidate()
+
+    def _resource_option(self, name, caster):
+        result = self.str(name).cast(caster)
+        self._appliers.append(result.argname)
+        return result
 
     def _add_option(self, name):
         name = self._localize(name)
 
-        if name in self._readers:
+        if name in self._readers or name in self._lazy or name in self._derived:
             raise ValueError('multiple types specified for %s' % name)
+        _check_attribute(name)
 
         self._set_reader(name, _SingleWordReader(self))
 
@@ -1190,25 +4616,97 @@ class Parser(object):
             return key
         return v
 
+    def _lookup(self, label, is_full):
+        ''' Name of the argument with (full or short) ``label``, or whose
+        label is the only one that starts with ``label``; ``None`` if there
+        is none. '''
+
+        if is_full:
+            if label in self._options or label in self._lazy:
+                return label
+        else:
+            name = self._alias.get(label)
+            if name is not None:
+                return name
+
+        if not label:
+            return None
+
+        # arguments are only ever added, so the number of labels tells
+        # whether the sorted ones are current
+        count = len(self._options) + len(self._lazy) if is_full else len(
+                self._alias)
+        labels = self._sorted_labels[is_full]
+        if labels is None or labels[0] != count:
+            if is_full:
+                keys = list(self._options) + list(self._lazy)
+            else:
+                keys = list(self._alias)
+            labels = self._sorted_labels[is_full] = (count, sorted(keys))
+
+        matches = _completions(labels[1], label)
+        if len(matches) > 1:
+            raise AmbiguousArgumentError(label, matches)
+        if not matches:
+            return None
+
+        return matches[0] if is_full else self._alias[matches[0]]
+
+    def _suggest(self, label):
+        ''' Known labels close to unknown ``label`` (with its prefix). '''
+
+        # built on the first error, so that parsing valid command lines does
+        # not pay for it
+        count = len(self._options) + len(self._lazy) + len(self._alias)
+        if self._label_index is None or self._label_index[0] != count:
+            labels = sorted([self._double_prefix + name for name in
+                list(self._options) + list(self._lazy)] + [self._single_prefix
+                    + alias for alias in self._alias])
+            self._label_index = (count, labels, _trigram_index(labels))
+
+        count, labels, index = self._label_index
+        return _suggestions(label, labels, index)
+
     def _tokenize(self, args):
+        self._help_term = None
+        help_labels = self._help_labels()
         new_args = []
         for arg in args:
             if '=' in arg:
-                new_args += arg.split('=')
+                parts = arg.split('=')
+                if parts[0] in help_labels:
+                    # --help=<term>
+                    self._help_term = '='.join(parts[1:])
+                    new_args.append(parts[0])
+                else:
+                    new_args += parts
             else:
                 new_args.append(arg)
 
         return new_args
 
+    def _help_labels(self):
+        labels = self._cache.get('help_labels')
+        if labels is None:
+            labels = [self._double_prefix + 'help']
+            alias = self._source_to_alias.get('help')
+            if alias is not None:
+                labels.append(self._single_prefix + alias)
+            labels = self._cache['help_labels'] = frozenset(labels)
+        return labels
+
     def _is_argument_label(self, arg):
         return (arg.startswith(self._single_prefix) or
                 arg.startswith(self._double_prefix))
 
-    def _parse(self, tokenized):
+    def _parse(self, tokenized, parsed=None):
         current_reader = None
-        parsed = Multidict()
+        if parsed is None:
+            parsed = Multidict()
 
-        for arg in tokenized:
+        self._command = None
+        tokens = iter(tokenized)
+        for arg in tokens:
             if current_reader is not None:
                 if current_reader.consume_or_skip(arg):
                     continue
@@ -1226,13 +4724,10 @@ class Parser(object):
 
                 arg = arg[len(prefix):]
 
-                argument_name = self._localize(arg)
-
-                if is_full:
-                    argument_name = self._options.get(argument_name)
-                else:
-                    argument_name = self._options.get(
-                            self._alias.get(argument_name))
+                argument_name = self._lookup(self._localize(arg), is_full)
+                if self._lazy and argument_name in self._lazy:
+                    self._materialize([argument_name])
+                argument_name = self._options.get(argument_name)
 
                 if argument_name is not None:
                     argument_name = argument_name.argname
@@ -1241,12 +4736,21 @@ class Parser(object):
 
                 if current_reader is None:
                     if argument_name is None:
-                        argument_name = arg
+                        raise UnspecifiedArgumentError(arg, self._suggest(
+                            prefix + arg))
                     raise UnspecifiedArgumentError(argument_name)
 
                 current_reader = current_reader.fresh_copy()
                 current_reader.activate()
 
+            elif self._subcommands:
+                if arg not in self._subcommands:
+                    raise UnknownCommandError(arg)
+
+                # the rest is for the command's parser
+                self._command = (arg, list(tokens))
+                break
+
             elif self._unspecified_default is not None:
                 argument_name = self._unspecified_default
 
@@ -1270,40 +4774,102 @@ class Parser(object):
 
     def _help_if_necessary(self, processed):
         if 'help' in processed:
-            self.print_help()
+            self.print_help(self._help_term)
             raise self._sys_exit_error(0)
 
-    def _config_values(self, parsed):
-        pc = parsed.copy()
-        for key, value in parsed:
-            if isinstance(value, Caster) and isinstance(value._cast,
-                    _ConfigCaster):  # XXX ugly
-
-                for k, v in value.getvalue():
-                    current_reader = pc.get(k)
+    def _configs(self):
+        ''' Names of the arguments added by :meth:`config`. '''
 
-                    if current_reader is None:
-                        # developer didn't specify this argument
-                        continue
+        configs = self._cache.get('configs')
+        if configs is None:
+            configs = self._cache['configs'] = [key for key, reader in
+                    iteritems(self._readers) if isinstance(reader, Caster)
+                    and isinstance(reader._cast, _ConfigCaster)]
+        return configs
 
-                    is_specified = current_reader.is_specified()
-                    if is_specified:
-                        current_reader = current_reader.fresh_copy()
+    def _executors(self):
+        ''' Names of the arguments added by :meth:`executor`. '''
 
-                    current_reader.consume_or_skip(v)
+        executors = self._cache.get('executors')
+        if executors is None:
+            executors = self._cache['executors'] = [key for key, reader in
+                    iteritems(self._readers) if isinstance(reader, Caster)
+                    and isinstance(reader._cast, _ExecutorCaster)]
+        return executors
 
-                    if is_specified:
-                        pc[k] = current_reader
+    def _config_values(self, parsed):
+        # parsed is the copy made by _combine_with_defaults, so is changed in
+        # place
+        for key in self._configs():
+            reader = parsed.get(key)
+            if reader is None:
+                continue
+
+            del parsed[key]
+            if isinstance(reader, list):
+                # given more than once: later files add to earlier ones
+                index = {}
+                for r in reader:
+                    for k, values in iteritems(r.getvalue() or {}):
+                        index.setdefault(k, []).extend(values)
+            else:
+                index = reader.getvalue()
+            if index is None:
+                # not given, and without a default
+                continue
+
+            # the keys of arguments that the developer specified
+            if len(index) <= len(self._readers) + len(self._lazy):
+                keys = [k for k in index if k in self._readers or k in
+                        self._lazy]
+            else:
+                keys = [k for k in chain(self._readers, self._lazy) if k in
+                        index]
+
+            for name in self._materialize([k for k in keys if k in
+                    self._lazy]):
+                parsed.overwrite(name, self._readers[name])
+
+            for k in keys:
+                for v in index[k]:
+                    current = parsed.get(k)
+                    if current is None:
+                        # a configuration argument
+                        break
+                    # never consume into the parser's own (default) reader,
+                    # which is shared by every parse
+                    reader = (current[0] if isinstance(current, list) else
+                            current).fresh_copy()
+                    reader.consume_or_skip(v)
+
+                    if isinstance(current, list):
+                        parsed.overwrite(k, current + [reader])
+                    elif current.is_specified():
+                        parsed.overwrite(k, [current, reader])
+                    else:
+                        parsed.overwrite(k, reader)
 
-                del pc[key]
+        return parsed
 
-        return pc
+    def _assign(self, combined, report=None, cast=None):
+        ''' The values of ``combined``; those in ``cast``, the values of an
+        :class:`_Evaluation` by name, are not cast again. '''
 
-    def _assign(self, combined):
+        # lists of multiple() values are copied, so that no two arguments or
+        # parses share one
         assigned = {}
+        if self._lazy_values:
+            assigned.update((name, list(value) if isinstance(value, list)
+                else value) for name, value in self._lazy_values.items())
         for key, values in combined:
             try:
-                if not self._options[key]._allows_multiple:
+                known = cast.get(key) if cast else None
+                if known is not None:
+                    if self._options[key]._allows_multiple:
+                        value = list(known)
+                    else:
+                        value = known[0]
+                elif not self._options[key]._allows_multiple:
                     value = values.getvalue()
                 else:
                     if not isinstance(values, list):
@@ -1317,61 +4883,360 @@ class Parser(object):
                 assigned[key] = value
 
             except MissingValueError:
-                raise MissingValueError('%s specified but missing given value'
-                        % key)
+                self._fail(report, 'value', (key,), None, _missing_value, key)
+            except FormatError:
+                if report is None:
+                    raise
+                self._fail(report, 'value', (key,), None, _invalid_value, key)
 
         return assigned
 
-    def _check_multiple(self, assigned):
+    def _fail(self, report, code, options, condition, error, *args):
+        ''' Raise ``error(*args)``; or, given a ``report`` list, add a
+        :class:`Violation` to it instead. '''
+
+        if report is None:
+            raise error(*args)
+        report.append(Violation(code, options, condition, error, args))
+
+    def _check_multiple(self, assigned, report=None):
         for key, values in assigned:
             if isinstance(values, list) and not self._options[key]._allows_multiple:
-                raise MultipleSpecifiedArgumentError(('%s specified multiple' +
-                    ' times') % self._options[key])
+                self._fail(report, 'multiple', (key,), None,
+                        _multiple_specified, self._options[key])
 
-    def _check_required(self, assigned):
-        for arg, replacements in iteritems(self._required):
+    def _check_required(self, assigned, required, report=None):
+        satisfied = self._evaluation(assigned).satisfied
+        for arg, replacements in iteritems(required):
             missing = []
-            if not arg._is_satisfied(assigned):
+            if not satisfied(arg):
                 for v in replacements:
+                    try:
+                        if satisfied(v):
+                            break
+                    except ArgumentError as e:
+                        if report is None:
+                            raise
+                        report.append(_unevaluable('required', arg, v, e))
+                        break
+
                     if isinstance(v, Group):
                         missing += v._names
+                    elif isinstance(v, _AnyOf):
+                        for m in v._others(arg):
+                            if isinstance(m, Group):
+                                missing += m._names
                     elif not isinstance(v, Condition):
                         missing.append(v)
-
-                    if v._is_satisfied(assigned):
-                        break
                 else:
                     if missing:
-                        raise ManyAllowedNoneSpecifiedArgumentError([arg] +
-                                missing)
+                        self._fail(report, 'required', tuple(str(m) for m in
+                            [arg] + missing), None,
+                            ManyAllowedNoneSpecifiedArgumentError,
+                            [arg] + missing)
                     else:
-                        raise MissingRequiredArgumentError(arg)
-
-    def _check_dependencies(self, assigned):
-        for arg, deps in iteritems(self._requires):
-            if arg._is_satisfied(assigned):
+                        self._fail(report, 'required', (arg.argname,), None,
+                                MissingRequiredArgumentError, arg)
+
+    def _check_dependencies(self, assigned, requires, report=None):
+        evaluation = self._evaluation(assigned)
+        satisfied = evaluation.satisfied
+        for arg, deps in iteritems(requires):
+            if satisfied(arg):
                 for v in deps:
-                    if not v._is_satisfied(assigned):
+                    try:
+                        holds = satisfied(v)
+                    except ArgumentError as e:
+                        if report is None:
+                            raise
+                        report.append(_unevaluable('requires', arg, v, e))
+                        continue
+
+                    if not holds:
                         if isinstance(v, _CallableCondition):
-                            raise ConditionError(arg.argname, v)
-                        raise DependencyError(arg, v)
+                            self._fail(report, 'condition', (arg.argname,), v,
+                                    ConditionError, arg.argname, v)
+                            continue
+                        condition = v
+                        if isinstance(v, _AllOf):
+                            v = v._missing(evaluation)
+                        options = (arg.argname,)
+                        if isinstance(v, Option):
+                            options += (v.argname,)
+                        self._fail(report, 'requires', options, condition,
+                                DependencyError, arg, v)
+
+    def _check_conflicts(self, assigned, conflicts, report=None):
+        evaluation = self._evaluation(assigned)
+        satisfied = evaluation.satisfied
+        for arg, others in iteritems(conflicts):
+            if satisfied(arg):
+                for conflict in others:
+                    try:
+                        holds = satisfied(conflict)
+                    except ArgumentError as e:
+                        if report is None:
+                            raise
+                        report.append(_unevaluable('conflicts', arg, conflict,
+                            e))
+                        continue
+
+                    if holds:
+                        condition = conflict
+                        if isinstance(conflict, _MoreThanOne):
+                            conflict = conflict._offender(arg, evaluation)
+                        options = (arg.argname,)
+                        if isinstance(conflict, Option):
+                            options += (conflict.argname,)
+                            conflict = conflict.argname
+                        self._fail(report, 'conflicts', options, condition,
+                                ConflictError, arg.argname, conflict)
+
+    def _check_lazy_required(self, report=None):
+        # arguments given on the command line or in a configuration file
+        # are no longer lazy
+        for name in self._lazy_required:
+            if name in self._lazy:
+                self._fail(report, 'required', (name,), None,
+                        MissingRequiredArgumentError, name)
+
+    def validate(self, args=None):
+        ''' Check ``args`` (by default, ``sys.argv[1:]``) and return every
+        :class:`Violation` found, in one pass; the list is empty if ``args``
+        are valid. Unlike :meth:`process_command_line`, nothing is printed or
+        stored. For example:
+
+        ::
+
+            for violation in p.validate(['--a', 'x', '--b', '1']):
+                print(violation.code, violation.options, violation)
+
+        '''
+
+        try:
+            tokenized = self._tokenize(self._get_args(args))
+            user_args = self._combine_with_defaults(self._parse(tokenized))
+            user_args = self._config_values(user_args)
+        except ArgumentError as e:
+            return [Violation('parse', (), None, e)]
+
+        report = []
+        self._check_multiple(user_args, report)
+        for violation in report:
+            # check the last of the values given more than once
+            name = violation.options[0]
+            user_args.overwrite(name, user_args[name][-1])
+
+        assigned = self._assign(user_args, report)
+
+        # conditions see the values just cast
+        evaluation = _Evaluation(self, user_args)
+        for name, value in iteritems(assigned):
+            if value is not None and name in self._options:
+                evaluation._values[name] = (value if
+                        self._options[name]._allows_multiple else [value])
+        for table, check in ((self._required, self._check_required),
+                             (self._requires, self._check_dependencies),
+                             (self._conflicts, self._check_conflicts)):
+            for arg, conditions in iteritems(table):
+                check(evaluation, {arg: conditions}, report)
+
+            if check == self._check_required:
+                self._check_lazy_required(report)
+
+        return _unique_violations(report)
+
+    def _constraints(self):
+        ''' The entries of the required, requires and conflicts tables, as
+        ``(check, {arg: conditions})``, and for each argument name the
+        indices of the entries that refer to it, or to arguments derived
+        from it. '''
+
+        constraints = self._cache.get('constraints')
+        if constraints is None:
+            dependents = self._dependents()
+            entries, index = [], {}
+            for table, check in ((self._required, self._check_required),
+                                 (self._requires, self._check_dependencies),
+                                 (self._conflicts, self._check_conflicts)):
+                for arg, conditions in iteritems(table):
+                    names = set()
+                    arg._argnames(names)
+                    for condition in conditions:
+                        if isinstance(condition, Condition):
+                            condition._argnames(names)
+                    # and those derived arguments are derived from
+                    names.update([n for n, derived in iteritems(dependents)
+                        if names.intersection(derived)])
+                    for name in names:
+                        index.setdefault(name, []).append(len(entries))
+                    entries.append((check, {arg: conditions}))
+
+            constraints = self._cache['constraints'] = (entries, index)
+
+        return constraints
+
+    def session(self, args=None):
+        ''' Start a :class:`ParseSession` from ``args`` (by default, none),
+        for changing arguments one at a time and seeing the
+        :class:`Violation` objects after each change. For example:
+
+        ::
+
+            session = p.session()
+            session.set('port', '80')
+            session.set('host', 'localhost')
+            for violation in session.unset('port'):
+                print(violation)
+            print(session.values['host'])
+
+        Each change casts only the changed argument, and checks only the
+        requirements, dependencies, conflicts and conditions that refer to
+        it. Raises :class:`ArgumentError` if ``args`` cannot be read.
+
+        '''
+
+        self._materialize(list(self._lazy))
+        args = self._get_args([] if args is None else args)
+        user_args = self._combine_with_defaults(self._parse(self._tokenize(
+            args)))
+        return ParseSession(self, self._config_values(user_args))
+
+    def _compiled(self, condition):
+        ''' ``condition`` compiled (see :meth:`Condition._compile`) and kept
+        until the definition changes; see :class:`_Evaluation` for how
+        results are shared. '''
+
+        compiled = self._cache.setdefault('conditions', {})
+        key = id(condition)
+        if key not in compiled:
+            # keep condition alive so that its id is not reused
+            compiled[key] = (condition, condition._compile(self._compiled))
+
+        return compiled[key][1]
 
-    def _check_conflicts(self, assigned):
-        for arg, conflicts in iteritems(self._conflicts):
-            if arg._is_satisfied(assigned):
-                for conflict in conflicts:
-                    if conflict._is_satisfied(assigned):
-                        raise ConflictError(arg.argname, conflict.argname)
+    def _evaluation(self, assigned):
+        if isinstance(assigned, _Evaluation):
+            return assigned
+        return _Evaluation(self, assigned)
 
     def _verify(self, assigned):
-        self._check_required(assigned)
-        self._check_dependencies(assigned)
-        self._check_conflicts(assigned)
+        evaluation = _Evaluation(self, assigned)
+        # most parsers have few of these, if any
+        if self._required:
+            self._check_required(evaluation, self._required)
+        if self._lazy_required:
+            self._check_lazy_required()
+        if self._requires:
+            self._check_dependencies(evaluation, self._requires)
+        if self._conflicts:
+            self._check_conflicts(evaluation, self._conflicts)
+        return evaluation
+
+    def _apply_resources(self, assigned):
+        for key in self._appliers:
+            value = assigned[key]
+            if value is None:
+                continue
 
-    def _assign_to_store(self, assigned):
+            try:
+                self._readers[key]._cast.apply(value)
+            except (OSError, ValueError, AttributeError) as e:
+                raise ResourceError('cannot apply %s %s: %s' % (
+                    self._options[key], self._readers[key]._reader.getvalue(),
+                    e))
+
+    def _start_profiling(self, assigned):
+        if self._profiling is None:
+            return
+
+        path, timing, top = [assigned.pop(key) for key in self._profiling]
+        if self._profiler is not None and self._profiler._running:
+            # started by an earlier parse; only one profiler can be active
+            return
+
+        if path or timing or top:
+            self._profiler = _Profiler(path, timing, top, sys.stderr)
+            self._profiler.start()
+
+    def _assign_to_store(self, assigned, derived):
         for key, value in iteritems(assigned):
             self._store[key] = value
 
+        executors = self._executors()
+        if executors:
+            # kept for close(); the pools of earlier parses that were never
+            # started need no shutting down
+            self._resources = [r for r in self._resources if r._executor is
+                    not None]
+            for key in executors:
+                value = assigned.get(key)
+                if isinstance(value, LazyExecutor):
+                    self._resources.append(value)
+
+        if self._derived:
+            self._assign_derived(self._store, derived)
+        return self._store
+
+    def _make_result(self, assigned, derived):
+        # keyed on every declared name, lazy ones included, so that the class
+        # does not depend on which arguments were created
+        names = frozenset(assigned)
+        cached = self._cache.get('result')
+        if cached is None or cached[0] != names:
+            cached = self._cache['result'] = (names, _result_class(self,
+                list(assigned)))
+
+        cls = cached[1]
+        return cls._make([assigned[name] for name in cls._fields[:len(names)]],
+                derived)
+
+    def _assign_derived(self, store, derived):
+        ''' Set the ``derived`` values, those computed while verifying, in
+        ``store``, and compute the rest: in a :class:`_Values` store, when
+        first used. '''
+
+        order = self._derived_order()
+        for name in order:
+            if name in derived:
+                store[name] = derived[name]
+            elif isinstance(store, _Values):
+                dict.pop(store, name, None)
+            else:
+                function, names = self._derived[name]
+                store[name] = function(*[store[n] for n in names])
+
+        if isinstance(store, _Values):
+            store._pending = dict((name, self._derived[name]) for name in
+                    order if name not in derived)
+
+    def _parse_command(self):
+        ''' Values of the selected command's arguments, with its name under
+        ``command``; ``None`` for parsers without commands. '''
+
+        if not self._subcommands:
+            return None
+
+        name, args = self._command or (None, None)
+        values = {}
+        if name is not None:
+            parser = self._subcommands[name].parser(self)
+            try:
+                values.update(parser._process_command_line(args))
+            except ArgumentError as e:
+                # reported with the command's usage; see bail()
+                e._command = name
+                raise
+            # help is this parser's
+            del values['help']
+
+        values['command'] = name
+        return values
+
+    def _assign_command(self, values):
+        for key, value in iteritems(values):
+            self._store[key] = value
+
     @_options_to_names
     def _set_one_required(self, *names):
         self.only_one_if_any(*names)
@@ -1387,6 +5252,10 @@ class Parser(object):
         return args
 
     def _combine_with_defaults(self, user_args):
+        if self._derived:
+            # derived arguments must be derived from known arguments
+            self._derived_order()
+
         copy = Multidict(self._readers.copy())
 
         for k, v in user_args:
@@ -1394,25 +5263,171 @@ class Parser(object):
 
         return copy
 
+    def _resolve(self, user_args):
+        user_args = self._combine_with_defaults(user_args)
+        user_args = self._config_values(user_args)
+        self._check_multiple(user_args)
+        evaluation = self._verify(user_args)
+
+        # derived values conditions needed are not computed again
+        return (self._assign(user_args, cast=evaluation._values),
+                evaluation._derived_values())
+
+    def _observed_resolve(self, user_args, stats, hooks):
+        ''' :meth:`_resolve`, with each step seen by ``stats`` and
+        ``hooks``. '''
+
+        phase = stats._time
+        user_args = phase('combine_with_defaults', self._combine_with_defaults,
+                user_args)
+        user_args = phase('config_values', self._config_values, user_args)
+        user_args = stats._watch(hooks._watch(user_args))
+        phase('check_multiple', self._check_multiple, user_args)
+        evaluation = phase('verify', hooks._verify, self, user_args)
+        assigned = phase('assign', self._assign, user_args, None,
+                evaluation._values)
+
+        return assigned, evaluation._derived_values()
+
     def _process_command_line(self, args=None):
+        return self._process(args, self._assign_to_store)
+
+    def _process(self, args, finish):
+        ''' Parse ``args``, and return ``finish`` of the values. '''
+
+        if self._instrument is not None or self._hooks is not None:
+            return self._observed_process(args, finish)
+
+        args = self._get_args(args)
+        user_args = self._parse(self._tokenize(args))
+        self._help_if_necessary(user_args)
+
+        assigned, derived = self._resolve(user_args)
+        # before anything is applied or stored, so that errors in the
+        # command's arguments leave no trace
+        command = self._parse_command() if self._subcommands else None
+        if self._appliers:
+            self._apply_resources(assigned)
+        if self._profiling is not None:
+            self._start_profiling(assigned)
+        result = finish(assigned, derived)
+        if command is not None:
+            self._assign_command(command)
+
+        return result
+
+    def _observed_process(self, args, finish):
+        ''' :meth:`_process`, for parsers with hooks or instrumentation. '''
+
+        stats = _UNOBSERVED
+        if self._instrument is not None:
+            stats = ParseStats()
+
+        hooks = self._hooks or _UNOBSERVED
+        phase = stats._time
+        start = _clock()
+
         try:
-            args = self._get_args(args)
-            tokenized = self._tokenize(args)
-            user_args = self._parse(tokenized)
+            args = phase('get_args', self._get_args, args)
+            tokenized = phase('tokenize', self._tokenize, args)
+            user_args = phase('parse', self._parse,
+                    hooks._tokens(stats._tokens(tokenized)),
+                    hooks._multidict())
             self._help_if_necessary(user_args)
-            user_args = self._combine_with_defaults(user_args)
-            user_args = self._config_values(user_args)
-            self._check_multiple(user_args)
-            self._verify(user_args)
 
-            assigned = self._assign(user_args)
-            self._assign_to_store(assigned)
+            assigned, derived = self._observed_resolve(user_args, stats, hooks)
+            command = phase('parse_command', self._parse_command)
+            phase('apply_resources', self._apply_resources, assigned)
+            phase('start_profiling', self._start_profiling, assigned)
+            # phase assign_to_store or make_result
+            result = phase(finish.__name__[1:], finish, assigned, derived)
+            if command is not None:
+                self._assign_command(command)
         except ArgumentError as e:
-            raise e
+            hooks._error(e)
+            raise
+        finally:
+            if stats is not _UNOBSERVED:
+                stats.total = _clock() - start
+                self._instrument(stats)
 
-#        self._init_user_set()  # reset
+        return result
 
-        return self._store
+    def parse(self, args=None):
+        ''' Parse ``args`` (by default, ``sys.argv[1:]``) and return the
+        values as a read-only object, with an attribute for each argument,
+        rather than writing them to the store. For example:
+
+        ::
+
+            p = Parser()
+            p.int('port').default(80)
+            p.str('files').multiple()
+
+            result = p.parse(['--files', 'a', '--files', 'b'])
+            result.port, result['files']    # 80, ('a', 'b')
+            result._asdict()                # a dict of the values
+            result._to_argv()               # arguments giving the same result
+
+        The values of :meth:`Option.multiple` arguments are tuples, and
+        names that are not identifiers have their other characters replaced
+        by ``_`` in attribute names. Results compare equal, and hash the
+        same, if their values do, so they may be used as dictionary keys.
+        They refer to neither the parser nor its arguments, and each takes
+        one slot per argument; their class is made once for each definition
+        of the parser. Derived values (see :meth:`derived`) are computed when
+        first used. As with ``namedtuple``, the methods of results start with
+        ``_``, so that they do not hide arguments; ``result._close()``, or
+        leaving a ``with`` block on it, shuts down the pools of its
+        :meth:`executor` values. Raises :class:`ArgumentError` on invalid
+        input.
+
+        '''
+
+        if self._subcommands:
+            raise ValueError('parse() does not support commands; use'
+                    + ' process_command_line()')
+
+        return self._process(args, self._make_result)
+
+    def sweep(self, args=None):
+        '''
+
+        Parses the command line in sweep mode, where any argument may be given
+        a comma-separated list of values, and :meth:`int` and :meth:`float`
+        arguments integer ranges of the form ``start:stop[:step]``. Returns a
+        lazy :class:`Sweep` over the Cartesian product of the values; each
+        point is a ``dict`` of fully parsed and verified values, derived ones
+        (see :meth:`derived`) included. For example:
+
+        ::
+
+            p = Parser()
+            p.float('lr')
+            p.int('bs')
+            p.int('seed')
+
+            for values in p.sweep(['--lr', '0.1,0.01', '--bs', '32,64',
+                                   '--seed', '0:10']):
+                train(**values)
+
+        Points that violate a requirement, conflict or condition are skipped;
+        values that cannot be read raise :class:`ArgumentError` as they would
+        when parsing. Values are not written to the parser's store.
+
+        '''
+
+        args = self._get_args(args)
+        user_args = self._parse(self._tokenize(args))
+        self._help_if_necessary(user_args)
+
+        axes = []
+        for key, reader in user_args:
+            values = _sweep_values(reader)
+            if values is not None:
+                axes.append((key, values))
+
+        return Sweep(self, user_args, axes)
 
     def _emit(self, *args):
         print(*args, file=self.out)
@@ -1443,30 +5458,42 @@ class Parser(object):
         except ArgumentError as e:
             self.bail(e)
 
-    def _usage(self):
-        return ('Usage: %s ' % sys.argv[0]) + ' '.join('[%s]' %
-                self._label(value) for value in self._options.values())
-
-    def _print_table(self, t):
-        # XXX what about empty list?
-        column_max_lengths = [len(x) for x in t[0]]
-
-        for row in t[1:]:
-            column_max_lengths = [max(column_max_lengths[i], len(column)) for i, column
-                    in enumerate(row)]
-
+    def _usage(self, command=None):
+        usage = self._cache.get('usage')
+        if usage is None:
+            # lazy specs are described without creating their arguments
+            usage = ' '.join(['[%s]' % self._label(value) for value in
+                    self._options.values()] + ['[%s]' % self._lazy_label(name)
+                        for name in self._lazy])
+            if self._subcommands:
+                usage += ' <command> ...'
+            self._cache['usage'] = usage
+
+        program = sys.argv[0]
+        if command is not None:
+            program += ' ' + command
+        return ('Usage: %s ' % program) + usage
+
+    def _print_table(self, t, widths=None):
+        if not t:
+            return
+
+        if widths is None:
+            widths = _column_widths(t)
+
+        fmt = ''.join('   %-' + str(width) + 's' for width in widths)
         for row in t:
-            line = ''
-            for i, column in enumerate(row):
-                fmt = '   %-' + str(column_max_lengths[i]) + 's'
-                line += fmt
-
-            self._emit(line % row)
+            self._emit(fmt % row)
 
     def bail(self, e):
         msg = []
         msg.append('Error: ' + str(e))
-        msg.append(self._usage())
+        command = getattr(e, '_command', None)
+        if command is not None and command in self._subcommands:
+            msg.append(self._subcommands[command].parser(self)._usage(
+                command))
+        else:
+            msg.append(self._usage())
 
         self._emit('\n'.join(msg))
 
@@ -1476,6 +5503,7 @@ class Parser(object):
     @_options_to_names
     def _set_default(self, name, value):
         self._readers[name]._set_default(value)
+        self._invalidate()
     #    self._defaults[name] = value
 
     @_localize_all
@@ -1483,12 +5511,22 @@ class Parser(object):
     @_names_to_options
     def _set_requires(self, a, b):
         self._requires.setdefault(a, set()).add(b)
+        self._invalidate()
 
     @_localize_all
     @_verify_args_exist
     @_names_to_options
     def _set_conflicts(self, a, b):
         self._conflicts.setdefault(a, set()).add(b)
+        self._invalidate()
+
+    def close(self):
+        ''' Release resources created by the values this parser stored, such
+        as the pools of :meth:`executor` arguments. Results of :meth:`parse`
+        release their own when closed. '''
+
+        while self._resources:
+            self._resources.pop().shutdown()
 
     def __enter__(self):
         return self
@@ -1503,18 +5541,21 @@ class Parser(object):
         if not isinstance(reader, Caster):
             return 'option'
 
-        if reader._cast is int:
-            return 'int'
+        return self._cast_label(reader._cast)
 
-        if reader._cast is float:
-            return 'float'
+    def _cast_label(self, cast):
+        if cast is int:
+            return 'int'
 
-        if reader._cast is float:
+        if cast is float:
             return 'float'
 
-        if isinstance(reader._cast, _RangeCaster):
+        if isinstance(cast, _RangeCaster):
             return 'range'
 
+        if isinstance(cast, _ExecutorCaster):
+            return 'executor'
+
         return 'option'
 
     def _label(self, opt):
@@ -1526,39 +5567,155 @@ class Parser(object):
 
         return pkey
 
-    def print_help(self):
-        self._emit(self._usage())
-
-        if self._help_prefix:
-            self._emit(self._help_prefix)
+    def _lazy_label(self, name):
+        ''' :meth:`_label` of lazy spec ``name``, without creating its
+        argument. '''
 
-        self._emit('Options: (! denotes required argument)')
-        column_width = -1
-
-        labels = []
-        for key, opt in iteritems(self._options):
-            name = self._label(opt)
-            desc = ''
-            if opt._description is not None:
-                desc = opt._description
+        pkey = self._double_prefix + name
+        alias = self._source_to_alias.get(name)
+        if alias:
+            pkey += '/%s%s' % (self._single_prefix, alias)
 
-            if opt._isrequired():
-                name = '!' + name
+        spec = self._lazy[name]
+        reader, cast = _SPEC_TYPES[_spec_kind(spec)]
+        if reader is not _FlagArgumentReader:
+            cast = spec.get('cast', cast)
+            pkey = '%s <%s>' % (pkey, 'option' if cast is None else
+                    self._cast_label(cast))
 
-            conflict_str = ''
-            conflicts = opt._getconflicts()
-            if conflicts:
-                conflict_str = 'Conflicts with %s' % ', '.join(str(item) for item in
-                        conflicts)
+        return pkey
 
-            requirement_str = ''
-            reqs = opt._getreqs()
-            if reqs:
-                requirement_str = 'Requires %s' % ', '.join(str(item) for item in reqs)
+    def _describe(self, opt, conditions):
+        items = []
+        for item in conditions:
+            if isinstance(item, _Members):
+                items += item._others(opt)
+            else:
+                items.append(item)
 
-            labels.append((name, desc, conflict_str, requirement_str))
+        return ', '.join(str(item) for item in items)
 
-        self._print_table(labels)
+    def _effective(self, opt):
+        reader = self._readers[opt.argname]
+        if not opt.argname in self._appliers:
+            return None
+        return reader._cast.effective()
+
+    def _help_table(self):
+        ''' Options, their rows in the help table, and the table's column
+        widths. '''
+
+        table = self._cache.get('help')
+        if table is None:
+            options = list(self._options.values())
+            rows = [self._help_row(opt) for opt in options]
+            table = self._cache['help'] = (options, rows, _column_widths(rows))
+
+        return table
+
+    def _help_row(self, opt):
+        name = self._label(opt)
+        desc = ''
+        if opt._description is not None:
+            desc = opt._description
+
+        if opt._isrequired():
+            name = '!' + name
+
+        conflict_str = ''
+        conflicts = opt._getconflicts()
+        if conflicts:
+            conflict_str = 'Conflicts with %s' % self._describe(opt, conflicts)
+
+        requirement_str = ''
+        reqs = opt._getreqs()
+        if reqs:
+            requirement_str = 'Requires %s' % self._describe(opt, reqs)
+
+        return (name, desc, conflict_str, requirement_str)
+
+    def _help_index(self):
+        ''' Sorted words of argument names and descriptions, and the rows of
+        the help table each appears in. '''
+
+        index = self._cache.get('help_index')
+        if index is None:
+            options, rows, widths = self._help_table()
+            rows_of = {}
+            for i, opt in enumerate(options):
+                for word in _words('%s %s' % (opt.argname, opt._description or
+                        '')):
+                    rows_of.setdefault(word, set()).add(i)
+
+            index = self._cache['help_index'] = (sorted(rows_of), rows_of)
+
+        return index
+
+    def _search_help(self, term):
+        ''' Rows of the help table with, for each word of ``term``, a word
+        (of the name or description) that starts with it. '''
+
+        words, rows_of = self._help_index()
+        found = None
+        for prefix in _words(term):
+            matches = set()
+            for word in _completions(words, prefix):
+                matches.update(rows_of[word])
+
+            found = matches if found is None else found & matches
+
+        return sorted(found or ())
+
+    def print_help(self, term=None):
+        ''' Print usage and a table of the arguments. With ``term``, only
+        arguments with a word in their name or description starting with each
+        word of ``term`` are listed. '''
+
+        self._materialize(list(self._lazy))
+        options, rows, widths = self._help_table()
+
+        if term:
+            selected = self._search_help(term)
+            if not selected:
+                self._emit('No options match %s' % term)
+                return
+
+            self._emit('Options matching %s: (! denotes required argument)'
+                    % term)
+            rows = [rows[i] for i in selected]
+            options = [options[i] for i in selected]
+            widths = _column_widths(rows)
+        else:
+            self._emit(self._usage())
+
+            if self._help_prefix:
+                self._emit(self._help_prefix)
+
+            self._emit('Options: (! denotes required argument)')
+
+        if self._appliers:
+            # current values are read when printing
+            rows = list(rows)
+            for i, opt in enumerate(options):
+                effective = self._effective(opt)
+                if effective is not None:
+                    name, desc, conflicts, reqs = rows[i]
+                    desc = ('%s (current: %s)' % (desc, effective)).lstrip()
+                    rows[i] = (name, desc, conflicts, reqs)
+            widths = _column_widths(rows)
+
+        self._print_table(rows, widths)
+
+        if self._subcommands and not term:
+            self._emit('Commands:')
+            self._print_table([(name, command.description or '') for name,
+                command in iteritems(self._subcommands)])
+
+if __name__ == '__main__':
+    # run with the importable module, so that parsers built by the target
+    # module are of the same classes
+    import blargs
+    blargs._codegen_main(sys.argv[1:])
 
 
 __all__ = ['Parser']
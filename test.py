@@ -18,13 +18,15 @@ from blargs import (Parser, Option, UnspecifiedArgumentError, ConflictError, Arg
                    FormatError, ConditionError,
                    MultipleSpecifiedArgumentError,
                    ManyAllowedNoneSpecifiedArgumentError,
-                   MissingValueError, FailedConditionError)
+                   MissingValueError, FailedConditionError,
+                   UnknownCommandError, AmbiguousArgumentError)
 
 
 import sys
 import os
 from itertools import permutations
 import unittest
+import re
 
 
 if sys.version_info[0] == 3:
@@ -149,6 +151,13 @@ b=3
         vals = p._process_command_line(['--a', fname])
         self.assertEqual(sorted(vals['b']), [3, 9])
 
+        # parsers can be reused
+        write_config(b=3, c='hello', d=5)
+        p = create()
+        for _ in range(2):
+            vals = p._process_command_line(['--a', fname])
+            self.assertEqual(vals['b'], 3)
+
         write_config(b='hello world')
         p = Parser()
         p.config('a')
@@ -156,6 +165,434 @@ b=3
         vals = p._process_command_line(['--a', fname])
         self.assertEqual(vals['b'], 'hello world')
 
+    def test_config_cache(self):
+        import time
+        import blargs
+
+        fname = os.path.join(self._dir, 'cached.cfg')
+        reads = []
+        read_config = blargs._read_config
+
+        def counting(filename):
+            reads.append(filename)
+            return read_config(filename)
+
+        def write(text, age):
+            with open(fname, 'w') as f:
+                f.write(text)
+            t = time.time() - age
+            os.utime(fname, (t, t))
+
+        p = Parser()
+        p.config('conf')
+        p.int('a')
+        p.str('b').multiple()
+
+        # not given
+        self.assertEqual(p._process_command_line([])['a'], None)
+
+        blargs._read_config = counting
+        try:
+            write('[one]\na = 1\nb = x\nconf = y\n[two]\nb = y\nz = 2\n',
+                    60)
+            for _ in range(3):
+                vals = p._process_command_line(['--conf', fname])
+                self.assertEqual((vals['a'], vals['b']), (1, ['x', 'y']))
+            self.assertEqual(len(reads), 1)
+
+            # read again when changed
+            write('[one]\na = 22\n', 30)
+            self.assertEqual(p._process_command_line(['--conf', fname])['a'],
+                    22)
+            self.assertEqual(len(reads), 2)
+
+            # but not kept when just changed, as the change may not show
+            write('[one]\na = 33\n', 0)
+            for _ in range(2):
+                vals = p._process_command_line(['--conf', fname])
+                self.assertEqual(vals['a'], 33)
+            self.assertEqual(len(reads), 4)
+        finally:
+            blargs._read_config = read_config
+
+        # several files, in order
+        other = os.path.join(self._dir, 'other.cfg')
+        with open(other, 'w') as f:
+            f.write('[x]\nb = z\n')
+        write('[one]\na = 1\nb = x\n', 60)
+        p = Parser()
+        p.config('conf').multiple()
+        p.int('a')
+        p.str('b').multiple()
+        vals = p._process_command_line(['--conf', fname, '--conf', other])
+        self.assertEqual((vals['a'], vals['b']), (1, ['x', 'z']))
+
+        # only the most recently used files are kept
+        for i in range(blargs._CONFIG_CACHE_SIZE + 2):
+            name = os.path.join(self._dir, '%d.cfg' % i)
+            with open(name, 'w') as f:
+                f.write('[x]\na = %d\n' % i)
+            os.utime(name, (0, 0))
+            self.assertEqual(p._process_command_line(['--conf', name])['a'],
+                    i)
+        self.assertEqual(len(blargs._CONFIG_FILES),
+                blargs._CONFIG_CACHE_SIZE)
+        self.assertTrue(os.path.abspath(name) in blargs._CONFIG_FILES)
+
+    def test_cached(self):
+        calls = []
+
+        def build(p):
+            calls.append(p)
+            p.float('b').default(2.5)
+            p.int('a').requires('b')
+            p.range('r')
+            p.only_one_if_any('a', 'r')
+            p.enum('mode', ('fast', 'slow'))
+
+        def check(p):
+            vals = p._process_command_line(['--a', '1', '--mode', 'slow'])
+            self.assertEqual(vals['a'], 1)
+            self.assertEqual(vals['b'], 2.5)
+            self.assertEqual(vals['mode'], 'slow')
+            self.assertRaises(ConflictError, p._process_command_line,
+                    ['--a', '1', '--r', '1:3'])
+            self.assertRaises(ConditionError, p._process_command_line,
+                    ['--mode', 'medium'])
+
+        for _ in range(3):
+            check(Parser.cached(build, cache_dir=self._dir))
+        self.assertEqual(len(calls), 1)
+
+        store = {}
+        Parser.cached(build, store, cache_dir=self._dir)._process_command_line(
+                ['--a', '3'])
+        self.assertEqual(store['a'], 3)
+        self.assertEqual(len(calls), 1)
+
+        # a different key is a different definition
+        check(Parser.cached(build, key='v2', cache_dir=self._dir))
+        self.assertEqual(len(calls), 2)
+
+        # corrupt cache files are rebuilt
+        for fname in os.listdir(self._dir):
+            with open(os.path.join(self._dir, fname), 'wb') as f:
+                f.write(b'junk')
+        check(Parser.cached(build, cache_dir=self._dir))
+        self.assertEqual(len(calls), 3)
+        check(Parser.cached(build, cache_dir=self._dir))
+        self.assertEqual(len(calls), 3)
+
+        # environment variables read while building are part of the key
+        def environment(p):
+            calls.append(p)
+            p.int('blargs_test_port').environment()
+
+        def port():
+            return Parser.cached(environment, cache_dir=self._dir
+                    )._process_command_line([])['blargs_test_port']
+
+        del calls[:]
+        try:
+            for value, expected in (('1', 1), ('1', 1), ('2', 2), (None,
+                    None), (None, None)):
+                os.environ.pop('BLARGS_TEST_PORT', None)
+                if value is not None:
+                    os.environ['BLARGS_TEST_PORT'] = value
+                self.assertEqual(port(), expected)
+        finally:
+            os.environ.pop('BLARGS_TEST_PORT', None)
+        self.assertEqual(len(calls), 3)
+
+        # as are the values of constants it refers to
+        del calls[:]
+        for limit in (1, 1, 2):
+            def bounded(p):
+                calls.append(p)
+                p.int('n').default(limit)
+
+            self.assertEqual(Parser.cached(bounded, cache_dir=self._dir
+                )._process_command_line([])['n'], limit)
+        self.assertEqual(len(calls), 2)
+
+        # parsers that cannot be pickled are built every time
+        del calls[:]
+
+        def unpicklable(p):
+            calls.append(p)
+            p.str('x').cast(lambda v: v.upper())
+
+        for _ in range(2):
+            p = Parser.cached(unpicklable, cache_dir=self._dir)
+            self.assertEqual(p._process_command_line(['--x', 'y'])['x'], 'Y')
+        self.assertEqual(len(calls), 2)
+
+        # as are those with hooks, which are not part of the definition
+        del calls[:]
+
+        def hooked(p):
+            calls.append(p)
+            p.int('x')
+            p.on_token(calls.append)
+
+        for _ in range(2):
+            Parser.cached(hooked, cache_dir=self._dir)._process_command_line(
+                    ['--x', '1'])
+        self.assertEqual(len(calls), 6)
+
+        import pickle
+        p = pickle.loads(pickle.dumps(Parser().on_token(calls.append)))
+        self.assertTrue(p._hooks is None and p._instrument is None)
+
+        # and cache directories others may write to are not used
+        del calls[:]
+        os.chmod(self._dir, 0o777)
+        try:
+            for _ in range(2):
+                check(Parser.cached(build, cache_dir=self._dir))
+        finally:
+            os.chmod(self._dir, 0o700)
+        self.assertEqual(len(calls), 2)
+        check(Parser.cached(build, cache_dir=self._dir))
+        self.assertEqual(len(calls), 2)
+
+    def test_subcommand(self):
+        for name in ('deploy', 'status'):
+            with open(os.path.join(self._dir, 'cmd_%s.py' % name), 'w') as f:
+                f.write('''
+def build(p):
+    p.str('target').required()
+    p.int('retries').default(1)
+''')
+
+        sys.path.insert(0, self._dir)
+        self.addCleanup(sys.path.remove, self._dir)
+        self.addCleanup(sys.modules.pop, 'cmd_deploy', None)
+        self.addCleanup(sys.modules.pop, 'cmd_status', None)
+
+        def create():
+            p = Parser()
+            p.flag('verbose').shorthand('v')
+            p.subcommand('deploy', 'cmd_deploy:build', 'Deploy a release.')
+            p.subcommand('status', 'cmd_status:build')
+            p._sys_exit_error = FakeSystemExit
+            p.out = StringIO()
+            return p
+
+        p = create()
+        vals = p._process_command_line(['-v', 'deploy', '--target', 'prod'])
+        self.assertEqual(vals['command'], 'deploy')
+        self.assertEqual(vals['target'], 'prod')
+        self.assertEqual(vals['retries'], 1)
+        self.assertTrue(vals['verbose'])
+
+        # only the selected command is imported
+        self.assertTrue('cmd_deploy' in sys.modules)
+        self.assertFalse('cmd_status' in sys.modules)
+
+        vals = create()._process_command_line([])
+        self.assertEqual(vals['command'], None)
+        self.assertFalse(vals['verbose'])
+
+        self.assertRaises(UnknownCommandError, create()._process_command_line,
+                ['deplyo'])
+        self.assertRaises(MissingRequiredArgumentError,
+                create()._process_command_line, ['deploy'])
+        # root arguments come before the command
+        self.assertRaises(UnspecifiedArgumentError,
+                create()._process_command_line, ['deploy', '--target', 'x',
+                    '-v'])
+
+        p = create()
+        self.assertRaises(FakeSystemExit, p._process_command_line, ['--help'])
+        self.assertTrue('<command> ...' in p.out.getvalue())
+        self.assertTrue('deploy   Deploy a release.' in p.out.getvalue())
+        self.assertFalse('cmd_status' in sys.modules)
+
+        p = create()
+        self.assertRaises(FakeSystemExit, p._process_command_line, ['status',
+            '--help'])
+        self.assertTrue('--target' in p.out.getvalue())
+
+        # functions and parsers work too
+        sub = Parser()
+        sub.int('n')
+        p = Parser()
+        p.subcommand('a', sub)
+        p.subcommand('b', lambda q: q.float('x'))
+        self.assertEqual(p._process_command_line(['a', '--n', '3'])['n'], 3)
+        self.assertEqual(p._process_command_line(['b', '--x', '2'])['x'], 2.0)
+
+        self.assertRaises(ValueError, p.subcommand, 'a', sub)
+        self.assertRaises(ValueError, p.str('files').unspecified_default)
+
+        # errors in the command's arguments store nothing, and are reported
+        # with the command's usage
+        store = {}
+        p = Parser(store)
+        p.flag('verbose')
+        p.subcommand('a', sub)
+        applied = []
+        p._apply_resources = applied.append
+        self.assertRaises(FormatError, p._process_command_line, ['--verbose',
+            'a', '--n', 'x'])
+        self.assertEqual((store, applied), ({}, []))
+
+        p._sys_exit_error = FakeSystemExit
+        p.out = StringIO()
+        self.assertRaises(FakeSystemExit, p.process_command_line, ['a',
+            '--n', 'x'])
+        self.assertTrue(('Usage: %s a [' % sys.argv[0]) in p.out.getvalue())
+        self.assertFalse('[--verbose]' in p.out.getvalue())
+
+        # the command's arguments cannot share names with the parser's
+        p = Parser()
+        p.int('n')
+        p.subcommand('a', sub)
+        self.assertRaises(ValueError, p._process_command_line, ['a'])
+
+    def test_codegen(self):
+        import blargs
+        import subprocess
+
+        with open(os.path.join(self._dir, 'cli.py'), 'w') as f:
+            f.write('''
+def build(p):
+    p.int('a').shorthand('x').described_as('an a')
+    p.range('r').requires('a')
+    p.flag('v').conflicts('r')
+''')
+
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.path.dirname(os.path.abspath(blargs.__file__))
+        subprocess.check_call([sys.executable, '-m', 'blargs', 'codegen',
+            'cli:build', '-o', 'gen.py'], cwd=self._dir, env=env)
+
+        out = subprocess.check_output([sys.executable, '-c', '''if 1:
+            import sys
+            import gen
+            print(gen.parse(['-x', '3', '--r', '1:4'])['r'])
+            # for UNSPECIFIED only
+            print(gen.UNSPECIFIED is sys.modules['blargs'].UNSPECIFIED)
+            try:
+                gen.parse(['--r', '2'])
+            except gen.DependencyError as e:
+                print(e)
+            '''], cwd=self._dir, env=env, universal_newlines=True)
+        self.assertEqual(out.splitlines(), [str(range(1, 4)), 'True',
+            '--r requires --a/-x'])
+
+        # help is the same as the parser's
+        p = Parser()
+        p.int('a').shorthand('x').described_as('an a').required()
+        p.float('b').conflicts('a').requires('a')
+        p.set_help_prefix('Does things.')
+        p.out = StringIO()
+        p.print_help()
+
+        module = {}
+        exec(compile(p.codegen(), '<codegen>', 'exec'), module)
+        stdout, sys.stdout = sys.stdout, StringIO()
+        try:
+            self.assertRaises(SystemExit, module['parse'], ['--help'])
+            self.assertEqual(sys.stdout.getvalue(), p.out.getvalue())
+        finally:
+            sys.stdout = stdout
+
+        # extras are kept per parse, not in the module
+        self.assertFalse('extras' in module)
+
+        p = Parser()
+        p.str('x').cast(lambda v: v)
+        self.assertRaises(ValueError, p.codegen)
+
+    def test_import_time(self):
+        import blargs
+        import subprocess
+
+        # the modules that importing blargs adds, in a fresh interpreter
+        out = subprocess.check_output([sys.executable, '-c', 'import sys; '
+            'before = set(sys.modules); import blargs; '
+            'print(" ".join(set(sys.modules) - before))'],
+            cwd=os.path.dirname(os.path.abspath(blargs.__file__)),
+            universal_newlines=True)
+        modules = out.split()
+        self.assertTrue('blargs' in modules)
+
+        # optional subsystems, and what they need, are imported on first use
+        for name in ('configparser', 'urllib.parse', 'inspect', 'json',
+                'multiprocessing', 'concurrent.futures', 'tracemalloc', 're',
+                'pickle', '_pickle', 'zlib', 'ast', 'subprocess', 'tempfile',
+                'shutil', 'threading', 'cProfile', 'pstats', 'argparse'):
+            self.assertFalse(name in modules, name)
+
+    def test_profiling(self):
+        import pstats
+
+        fname = os.path.join(self._dir, 'out.prof')
+
+        def create():
+            p = Parser().profiling()
+            p.int('a')
+            p._sys_exit_error = FakeSystemExit
+            return p
+
+        vals = create()._process_command_line(['--a', '1'])
+        self.assertEqual(sorted(vals), ['a', 'help'])
+
+        argv, stderr = sys.argv[1:], sys.stderr
+        sys.argv[1:] = ['--a', '2', '--blargs-profile', fname,
+                '--blargs-timing', '--blargs-tracemalloc', '2']
+        sys.stderr = StringIO()
+        try:
+            p = create()
+            self.assertEqual(p.run(lambda: sum(range(100)) + p._store['a']),
+                    4952)
+            output = sys.stderr.getvalue()
+        finally:
+            sys.argv[1:], sys.stderr = argv, stderr
+
+        self.assertTrue('blargs: ran in' in output)
+        self.assertEqual(len(output.splitlines()), 3)
+        self.assertEqual(sorted(p._store), ['a', 'help'])
+        self.assertTrue(pstats.Stats(fname).total_calls > 0)
+
+        # already reported; nothing more at exit
+        p._profiler.stop()
+
+        # parsing again while profiling keeps the running profiler
+        p = create()
+        p._process_command_line(['--blargs-profile', fname, '--a', '1'])
+        profiler = p._profiler
+        p._process_command_line(['--blargs-profile', fname, '--a', '2'])
+        self.assertTrue(p._profiler is profiler)
+        profiler.stop()
+        self.assertTrue(pstats.Stats(fname).total_calls > 0)
+
+        # each profiler is registered to stop at exit once, until stopped
+        import atexit
+        registered = []
+        register = atexit.register
+        atexit.register = registered.append
+        unregister = getattr(atexit, 'unregister', None)
+        if unregister is not None:
+            atexit.unregister = registered.remove
+        try:
+            for _ in range(3):
+                p = create()
+                p._process_command_line(['--blargs-profile', fname])
+                p._process_command_line(['--blargs-profile', fname])
+                self.assertEqual(registered, [p._profiler.stop])
+                p._profiler.stop()
+                if unregister is not None:
+                    self.assertEqual(registered, [])
+                else:
+                    del registered[:]
+        finally:
+            atexit.register = register
+            if unregister is not None:
+                atexit.unregister = unregister
+
     def test_file(self):
         def create():
             p = Parser()
@@ -292,6 +729,278 @@ class TestCase(unittest.TestCase):
         p.url('url')
         self.assertRaises(FormatError, p._process_command_line, ['--url', '/www.com'])
 
+    def test_sweep(self):
+        def create():
+            p = Parser()
+            p.float('lr')
+            p.int('bs')
+            p.int('seed').conflicts(p.flag('fixed'))
+            p.str('name')
+            return p
+
+        sweep = create().sweep(['--lr', '0.1,0.01', '--bs', '32,64,128',
+            '--seed', '0:3', '--name', 'run'])
+        self.assertEqual(len(sweep), 18)
+        points = list(sweep)
+        self.assertEqual(len(points), 18)
+        self.assertEqual(points[0]['lr'], 0.1)
+        self.assertEqual(points[0]['bs'], 32)
+        self.assertEqual(points[0]['seed'], 0)
+        self.assertEqual(points[1]['seed'], 1)
+        self.assertEqual(points[-1], sweep.point(17))
+        self.assertEqual(set(p['name'] for p in points), set(['run']))
+        self.assertEqual(sorted(set((p['lr'], p['bs'], p['seed']) for p in
+            points)), sorted((lr, bs, seed) for lr in (0.1, 0.01) for bs in
+                (32, 64, 128) for seed in range(3)))
+
+        shards = [list(sweep.shard(i, 4)) for i in range(4)]
+        self.assertEqual(sum(len(s) for s in shards), 18)
+        self.assertEqual(shards[1][0], points[1])
+        self.assertRaises(IndexError, sweep.point, 18)
+
+        # invalid points are pruned
+        p = Parser()
+        a = p.int('a')
+        p.int('b').requires(a < p['b'])
+        points = list(p.sweep(['--a', '0:4', '--b', '1,2']))
+        self.assertEqual(sorted((x['a'], x['b']) for x in points),
+                [(0, 1), (0, 2), (1, 2)])
+
+        sweep = create().sweep(['--seed', '1,2', '--fixed'])
+        self.assertEqual(len(sweep), 2)
+        self.assertEqual(list(sweep), [])
+
+        # bad values are reported, not pruned
+        self.assertRaises(FormatError, create().sweep(['--bs', 'x,2']).point, 0)
+        self.assertRaises(FormatError, list, create().sweep(['--bs', 'x,2']))
+        self.assertEqual(len(create().sweep(['--name', 'a:b'])), 1)
+
+        # only numbers are expanded as ranges
+        self.assertEqual([x['name'] for x in create().sweep(['--name',
+            '10:20,x'])], ['10:20', 'x'])
+
+        # points hold derived values
+        p = create()
+        p.derived('total', lambda bs, seed: bs * seed)
+        self.assertEqual([x['total'] for x in p.sweep(['--bs', '2',
+            '--seed', '1:4'])], [2, 4, 6])
+
+    def test_executor(self):
+        from blargs import _available_cpus
+
+        def create():
+            p = Parser()
+            p.executor('jobs')
+            return p
+
+        vals = create()._process_command_line([])
+        self.assertEqual(vals['jobs'].kind, 'threads')
+        self.assertEqual(vals['jobs'].max_workers, _available_cpus())
+
+        vals = create()._process_command_line(['--jobs', '3'])
+        self.assertEqual(vals['jobs'].max_workers, 3)
+
+        vals = create()._process_command_line(['--jobs', 'procs:2'])
+        self.assertEqual(vals['jobs'].kind, 'processes')
+        self.assertEqual(vals['jobs'].max_workers, 2)
+
+        vals = create()._process_command_line(['--jobs', 'threads:auto'])
+        self.assertEqual(vals['jobs'].max_workers, _available_cpus())
+
+        for bad in ('0', 'x', 'gpus:3', 'threads:x'):
+            self.assertRaises(FormatError, create()._process_command_line,
+                    ['--jobs', bad])
+
+        p = create()
+        jobs = p._process_command_line(['--jobs', '2'])['jobs']
+        self.assertTrue(jobs._executor is None)
+        self.assertEqual(list(jobs.map(abs, [-1, -2])), [1, 2])
+        self.assertTrue(jobs._executor is not None)
+        p.close()
+        self.assertTrue(jobs._executor is None)
+        self.assertEqual(p._resources, [])
+
+        # parse() results shut their own pools down
+        with create().parse(['--jobs', '2']) as result:
+            self.assertEqual(list(result.jobs.map(abs, [-3])), [3])
+            self.assertTrue(result.jobs._executor is not None)
+        self.assertTrue(result.jobs._executor is None)
+
+        # pools that were never started are not kept across parses
+        p = create()
+        for _ in range(3):
+            p._process_command_line([])
+        self.assertEqual(len(p._resources), 1)
+
+        self.assertRaises(ValueError, Parser().executor, 'jobs', kind='gpus')
+
+    @unittest.skipUnless(sys.platform.startswith('linux'),
+                         'resource arguments rely on Linux-only calls')
+    def test_resources(self):
+        import resource
+        from blargs import ResourceError, _format_cpus
+
+        def create():
+            p = Parser()
+            p.cpus('cpus')
+            p.nice('nice')
+            p.max_memory('max-memory')
+            p.max_open_files('max-open-files')
+            return p
+
+        vals = create()._process_command_line([])
+        self.assertEqual(vals['cpus'], None)
+        self.assertEqual(vals['max-memory'], None)
+
+        p = create()
+        p._apply_resources = lambda assigned: None
+        vals = p._process_command_line(['--cpus', '0-3,8,10-11', '--max-memory',
+            '1.5G', '--max-open-files', '4k', '--nice', '5'])
+        self.assertEqual(vals['cpus'], [0, 1, 2, 3, 8, 10, 11])
+        self.assertEqual(vals['max-memory'], 3 * 1024 ** 3 // 2)
+        self.assertEqual(vals['max-open-files'], 4000)
+        self.assertEqual(vals['nice'], 5)
+        self.assertEqual(_format_cpus(vals['cpus']), '0-3,8,10-11')
+
+        p = create()
+        p._apply_resources = lambda assigned: None
+        vals = p._process_command_line(['--max-memory', '512MiB',
+            '--max-open-files', 'unlimited'])
+        self.assertEqual(vals['max-memory'], 512 * 1024 ** 2)
+        self.assertEqual(vals['max-open-files'], -1)
+
+        for args, message in ((['--cpus', '3-x'], '3-x is not CPU list'),
+                (['--cpus', '-1'], '-1 is not CPU list'),
+                (['--nice', '40'], 'nice value 40 not in -20..19'),
+                (['--max-memory', '12Q'], '12Q is not limit format'),
+                (['--max-open-files', 'lots'], 'lots is not limit format')):
+            self.assertRaises(FormatError, create()._process_command_line,
+                    args)
+            try:
+                create()._process_command_line(args)
+            except FormatError as e:
+                self.assertTrue(str(e).startswith(message), str(e))
+
+        # applying the current settings is harmless
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        cpus = _format_cpus(os.sched_getaffinity(0))
+        create()._process_command_line(['--cpus', cpus, '--max-open-files',
+            str(soft)])
+        self.assertEqual(resource.getrlimit(resource.RLIMIT_NOFILE),
+                (soft, hard))
+
+        if hard != resource.RLIM_INFINITY:
+            self.assertRaises(ResourceError, create()._process_command_line,
+                    ['--max-open-files', str(hard + 1)])
+
+        p = create()
+        p._sys_exit_error = FakeSystemExit
+        p.out = StringIO()
+        self.assertRaises(FakeSystemExit, p._process_command_line, ['--help'])
+        self.assertTrue('(current: %s)' % cpus in p.out.getvalue())
+
+    def test_instrument(self):
+        import json
+
+        collected = []
+
+        def create():
+            p = Parser().instrument(collected.append)
+            a = p.int('a')
+            p.float('b').requires(a < 10)
+            p.str('c')
+            return p
+
+        vals = create()._process_command_line(['--a', '3', '--b', '1.5'])
+        self.assertEqual(vals['b'], 1.5)
+        stats = collected.pop()
+        self.assertEqual(stats.tokens, 4)
+        for phase in ('get_args', 'tokenize', 'parse', 'combine_with_defaults',
+                'config_values', 'check_multiple', 'verify', 'assign',
+                'assign_to_store'):
+            self.assertEqual(stats.calls[phase], 1)
+            self.assertTrue(stats.phases[phase] >= 0)
+        self.assertEqual(set(stats.casts), set(['a', 'b']))
+        # cast for the condition, and not again when assigned
+        self.assertEqual(stats.cast_calls, {'a': 1, 'b': 1})
+
+        casts = []
+        p = Parser()
+        x = p.str('x').cast(lambda v: casts.append(v) or int(v))
+        p.flag('y').requires(x > 0)
+        self.assertEqual(p.parse(['--x', '1', '--y']).x, 1)
+        self.assertEqual(casts, ['1'])
+        self.assertTrue(stats.condition_lookups > 0)
+        self.assertTrue(stats.total >= sum(stats.phases.values()))
+        self.assertEqual(json.loads(stats.to_json())['tokens'], 4)
+
+        # stats are reported for failed parses too
+        self.assertRaises(ConditionError, create()._process_command_line,
+                ['--a', '30', '--b', '1'])
+        self.assertEqual(collected.pop().calls['verify'], 1)
+
+        stderr = sys.stderr
+        sys.stderr = StringIO()
+        os.environ['BLARGS_INSTRUMENT'] = '1'
+        try:
+            p = Parser()
+            p.int('a')
+            p._process_command_line(['--a', '1'])
+            self.assertEqual(json.loads(sys.stderr.getvalue())['tokens'], 2)
+        finally:
+            del os.environ['BLARGS_INSTRUMENT']
+            sys.stderr = stderr
+
+    def test_hooks(self):
+        events = []
+
+        def create():
+            p = Parser()
+            a = p.int('a')
+            p.float('b').requires(a < 10)
+            p.str('c').conflicts('b')
+            p.on_token(lambda token: events.append(('token', token)))
+            p.on_option_start(lambda option: events.append(('start',
+                option.argname)))
+            p.on_cast(lambda option, seconds: events.append(('cast',
+                option.argname)))
+            p.on_constraint(lambda kind, option, result: events.append((kind,
+                option.argname, result)))
+            p.on_error(lambda e: events.append(('error', type(e))))
+            return p
+
+        vals = create()._process_command_line(['--a', '3', '--b', '1.5'])
+        self.assertEqual(vals['b'], 1.5)
+        self.assertEqual(events[:6], [('token', '--a'), ('start', 'a'),
+            ('token', '3'), ('token', '--b'), ('start', 'b'), ('token',
+                '1.5')])
+        self.assertTrue(('requires', 'b', True) in events)
+        self.assertTrue(('conflicts', 'c', True) in events)
+        self.assertEqual(events.count(('cast', 'a')), 1)
+        self.assertEqual(events.count(('cast', 'b')), 1)
+
+        del events[:]
+        self.assertRaises(ConflictError, create()._process_command_line,
+                ['--b', '1', '--c', 'x', '--a', '1'])
+        self.assertTrue(('conflicts', 'c', False) in events)
+        self.assertEqual(events[-1], ('error', ConflictError))
+
+        # hooks and instrumentation together
+        stats = []
+        p = create().instrument(stats.append)
+        p._process_command_line(['--a', '3'])
+        self.assertEqual(stats[0].tokens, 2)
+        self.assertTrue('a' in stats[0].casts)
+
+        # parsers with neither take the usual path, without observers
+        observed = []
+        p = Parser()
+        p.int('a')
+        p._observed_process = lambda *args: observed.append(args)
+        self.assertEqual(p._process_command_line(['--a', '3'])['a'], 3)
+        self.assertEqual(p.parse(['--a', '3']).a, 3)
+        self.assertEqual(observed, [])
+
     def test_non_arg_exception(self):
         def inner():
             with Parser() as p:
@@ -1000,6 +1709,18 @@ class TestCase(unittest.TestCase):
         except:
             self.assertTrue(False)
 
+        # conflicts with conditions
+        p = Parser()
+        p.flag('v').conflicts(p.int('y') > 3)
+        try:
+            p._process_command_line(['--v', '--y', '5'])
+            self.fail()
+        except ConflictError as e:
+            self.assertTrue(str(e).startswith('v conflicts with '))
+        p._process_command_line(['--v', '--y', '1'])
+        self.assertEqual([v.options for v in p.validate(['--v', '--y', '5'])],
+                [('v',)])
+
     def test_mutually_exclusive(self):
         def create():
             p = Parser()
@@ -1104,6 +1825,1010 @@ class TestCase(unittest.TestCase):
         p.require_one('a', 'b')
         p._process_command_line(['--b', '3'])
 
+    def test_memory_report(self):
+        p = Parser()
+        for i in range(100):
+            p.int('x%d' % i).described_as('x number %d' % i)
+        p.all_if_any('x0', 'x1')
+
+        report = p.memory_report()
+        self.assertEqual(set(report), set(['options', 'readers',
+            'constraints', 'names', 'total']))
+        for key in report:
+            self.assertTrue(report[key] > 0)
+        self.assertTrue(report['total'] >= report['options'] +
+                report['readers'] + report['constraints'])
+
+        p.int('y').described_as('another number')
+        self.assertTrue(p.memory_report()['options'] > report['options'])
+
+        # options and readers are kept compact
+        self.assertFalse(hasattr(p['y'], '__dict__'))
+        self.assertFalse(hasattr(p._readers['y'], '__dict__'))
+
+    def test_abbreviations(self):
+        def create():
+            p = Parser()
+            p.flag('verbose').shorthand('vb')
+            p.flag('verbatim')
+            p.int('count').shorthand('c')
+            p.int('counter')
+            return p
+
+        vals = create()._process_command_line(['--verbo', '--verba'])
+        self.assertTrue(vals['verbose'])
+        self.assertTrue(vals['verbatim'])
+
+        # exact matches win
+        vals = create()._process_command_line(['--count', '3', '--counte',
+            '4'])
+        self.assertEqual(vals['count'], 3)
+        self.assertEqual(vals['counter'], 4)
+
+        self.assertTrue(create()._process_command_line(['-v'])['verbose'])
+        self.assertEqual(create()._process_command_line(['-c', '2'])['count'],
+                2)
+
+        try:
+            create()._process_command_line(['--verb'])
+            self.fail()
+        except AmbiguousArgumentError as e:
+            self.assertEqual(str(e), 'ambiguous option verb: verbatim, verbose')
+
+        self.assertRaises(UnspecifiedArgumentError,
+                create()._process_command_line, ['--verbs'])
+        self.assertRaises(UnspecifiedArgumentError,
+                create()._process_command_line, ['--'])
+
+        # arguments added after a parse are matched too
+        p = create()
+        p._process_command_line(['--verbo'])
+        p.int('width')
+        self.assertEqual(p._process_command_line(['--wid', '3'])['width'], 3)
+
+        p = Parser()
+        p.add_many([{'name': 'alpha'}, {'name': 'beta'}], lazy=True)
+        self.assertEqual(p._process_command_line(['--al', 'x'])['alpha'], 'x')
+
+    def test_help_search(self):
+        def create():
+            p = Parser()
+            p.int('port').shorthand('p').described_as('TCP port to listen on')
+            p.str('host').described_as('Server name').requires('port')
+            p.flag('verbose').described_as('Print more')
+            p._sys_exit_error = FakeSystemExit
+            p.out = StringIO()
+            return p
+
+        def help(argv):
+            p = create()
+            user_args = p._parse(p._tokenize(argv))
+            self.assertRaises(FakeSystemExit, p._help_if_necessary, user_args)
+            return p.out.getvalue().splitlines()
+
+        lines = help(['--help=serv'])
+        self.assertEqual(lines[0],
+                'Options matching serv: (! denotes required argument)')
+        self.assertEqual([line.split()[0] for line in lines[1:]], ['--host'])
+
+        # every word must match
+        self.assertEqual(len(help(['-h=pr'])), 3)
+        self.assertEqual(len(help(['--help=listen port'])), 2)
+        self.assertEqual(help(['--help=nothing']), ['No options match nothing'])
+        self.assertEqual(help(['--help=']), help(['--help']))
+
+        # the table is kept until the definition changes
+        p = create()
+        p.print_help()
+        table = p._cache['help']
+        p.print_help()
+        self.assertTrue(p._cache['help'] is table)
+        p.int('width').described_as('Width in pixels')
+        p.out = StringIO()
+        p.print_help()
+        self.assertTrue('Width in pixels' in p.out.getvalue())
+
+    def test_shared_conditions(self):
+        casts = []
+
+        def cast(value):
+            casts.append(value)
+            return int(value)
+
+        p = Parser()
+        level = p.str('level').cast(cast)
+        low = level < 5
+        p.flag('quiet').requires(low, level >= 0)
+        p.flag('debug').requires(low, level > 3)
+        p.flag('trace').if_(low.and_(level != 2))
+
+        def verify(argv):
+            del casts[:]
+            p._verify(p._combine_with_defaults(p._parse(p._tokenize(argv))))
+
+        verify(['--level', '4', '--quiet', '--debug', '--trace'])
+        self.assertEqual(casts, ['4'])
+
+        self.assertRaises(ConditionError, verify, ['--level', '3', '--debug',
+            '--trace'])
+        self.assertEqual(casts, ['3'])
+
+        self.assertRaises(ConditionError, verify, ['--level', '7', '--quiet'])
+        self.assertEqual(casts, ['7'])
+
+        # compiled conditions are dropped when the definition changes
+        self.assertTrue('conditions' in p._cache)
+        p.flag('extra').requires(level > 1)
+        self.assertFalse('conditions' in p._cache)
+        self.assertRaises(ConditionError, verify, ['--level', '1', '--extra',
+            '--trace'])
+
+    def test_multiple_conditions(self):
+        import operator
+        from blargs import _holds
+
+        def brute(xs, ys, call):
+            return all(call(x, y) for x in xs for y in ys)
+
+        nan = float('nan')
+        lists = [[], [1], [1, 2], [2, 3.5], [3, 3], [0, 5, 2], [1, nan],
+                 [True, 2], ['a', 'b']]
+        for call in (operator.lt, operator.le, operator.gt, operator.ge,
+                operator.eq, operator.ne):
+            for xs in lists:
+                for ys in lists:
+                    try:
+                        expected = brute(xs, ys, call)
+                    except TypeError:
+                        self.assertRaises(TypeError, _holds, xs, ys, call)
+                        continue
+                    self.assertEqual(_holds(xs, ys, call), expected)
+
+        p = Parser()
+        lo = p.int('lo').multiple()
+        lo.requires(lo < p.int('hi').multiple())
+        p._process_command_line(['--lo', '1', '--lo', '2', '--hi', '3',
+            '--hi', '4'])
+        self.assertRaises(ConditionError, p._process_command_line, ['--lo',
+            '1', '--lo', '3', '--hi', '3', '--hi', '4'])
+
+    def test_validate(self):
+        p = Parser()
+        p.int('a').required()
+        p.int('c')
+        p.int('b').requires('c')
+        p.flag('q')
+        p.flag('v').conflicts('q')
+        p.only_one_if_any(p.int('x'), p.int('y'), p.int('z'))
+        p.float('f').requires(p['a'] > 3)
+        p.enum('mode', ['fast', 'slow'])
+        p.int('m')
+
+        self.assertEqual(p.validate(['--a', '5']), [])
+
+        violations = p.validate(['--b', '1', '--v', '--q', '--x', '1', '--z',
+            '2', '--mode', 'medium', '--m', '1', '--m', '2'])
+        self.assertEqual(sorted((v.code, v.options) for v in violations), [
+            ('condition', ('mode',)),
+            ('conflicts', ('v', 'q')),
+            ('conflicts', ('x', 'z')),
+            ('multiple', ('m',)),
+            ('required', ('a',)),
+            ('requires', ('b', 'c'))])
+
+        # messages are those parsing would give
+        for v in violations:
+            self.assertTrue(isinstance(v.error(), ArgumentError))
+        self.assertEqual(sorted(str(v) for v in violations), [
+            '--b requires --c',
+            '--m specified multiple times',
+            'No value passed for a',
+            'mode required unless mode in (fast, slow)',
+            'v conflicts with q',
+            'x conflicts with z'])
+
+        # conditions on values that cannot be cast cannot be checked, which
+        # is reported for the arguments they constrain
+        violations = p.validate(['--a', 'x', '--f', '2'])
+        self.assertEqual([(v.code, v.options) for v in violations],
+                [('value', ('a',)), ('condition', ('f',))])
+        self.assertEqual(str(violations[0]), 'invalid value for a')
+        self.assertEqual(str(violations[1]),
+                'cannot check a > 3 for f: no valid value for a')
+        self.assertTrue(isinstance(violations[1].error(),
+            FailedConditionError))
+
+        # or that are not given
+        violations = p.validate(['--f', '2'])
+        self.assertEqual([(v.code, v.options, str(v)) for v in violations],
+                [('required', ('a',), 'No value passed for a'),
+                 ('condition', ('f',), 'cannot check a > 3: no value for a')])
+        q = Parser()
+        q.int('d').requires(q.int('e') > 5)
+        self.assertRaises(FailedConditionError, q._process_command_line,
+                ['--d', '2'])
+
+        # without hiding the others
+        p.flag('w').requires(p['a'] > 3).requires('c')
+        violations = p.validate(['--a', 'x', '--a', 'y', '--w'])
+        self.assertEqual(sorted((v.code, v.options) for v in violations), [
+            ('condition', ('w',)), ('multiple', ('a',)), ('requires', ('w',
+                'c')), ('value', ('a',))])
+
+        violations = p.validate(['--nope'])
+        self.assertEqual([v.code for v in violations], ['parse'])
+        self.assertTrue(isinstance(violations[0].error(),
+            UnspecifiedArgumentError))
+
+    def test_session(self):
+        p = Parser()
+        p.int('a').required()
+        p.int('c')
+        p.int('b').requires('c')
+        p.flag('q')
+        p.flag('v').conflicts('q')
+        p.only_one_if_any(p.int('x'), p.int('y'))
+        p.float('f').requires(p['a'] > 3)
+        p.int('m').multiple()
+
+        def summary(violations):
+            return sorted((v.code, v.options) for v in violations)
+
+        session = p.session(['--b', '1'])
+        self.assertEqual(summary(session.violations()),
+                [('required', ('a',)), ('requires', ('b', 'c'))])
+
+        # each change gives the violations a full check would
+        argv = {'b': ['--b', '1']}
+        for name, value in [('a', '5'), ('c', '2'), ('v', True), ('q', True),
+                ('a', 'x'), ('f', '1.5'), ('a', '1'), ('x', '1'), ('y', '2'),
+                ('m', ['1', '2']), ('q', False), (('x'), None), ('f', None),
+                ('a', None), ('a', '4'), ('f', '1.5'), ('y', None),
+                ('b', None)]:
+            if value is None:
+                violations = session.unset(name)
+                argv.pop(name, None)
+            else:
+                violations = session.set(name, value)
+                if value is False:
+                    argv.pop(name, None)
+                elif value is True:
+                    argv[name] = ['--' + name]
+                elif isinstance(value, list):
+                    argv[name] = sum([['--' + name, v] for v in value], [])
+                else:
+                    argv[name] = ['--' + name, value]
+
+            args = sum(argv.values(), [])
+            self.assertEqual(summary(violations), summary(p.validate(args)))
+
+        self.assertEqual(session.violations(), [])
+        self.assertEqual((session.values['a'], session.values['m'],
+            session.values['f']), (4, [1, 2], 1.5))
+
+        # only the changed argument is cast
+        casts = []
+        p.str('level').cast(lambda v: casts.append(v) or int(v))
+        p.flag('debug').requires(p['level'] > 0)
+        session = p.session(['--a', '4', '--level', '1'])
+        del casts[:]
+        session.set('debug', True)
+        session.set('c', '1')
+        self.assertEqual(casts, [])
+        self.assertEqual([v.code for v in session.set('level', '0')],
+                ['condition'])
+        self.assertEqual(casts, ['0'])
+
+        self.assertRaises(ValueError, session.set, 'nope', '1')
+
+    def test_session_any_order(self):
+        p = Parser()
+        a = p.int('a').required()
+        p.int('d').requires(a > 5)
+        p.int('e').conflicts(p['d'] < a)
+
+        # arguments set before those their conditions refer to leave those
+        # conditions pending, as validate() reports them
+        session = p.session()
+        argv = {}
+        for name, value in [('d', '2'), ('e', '1'), ('a', '3'), ('a', '9'),
+                ('a', None), ('d', None), ('e', None), ('a', '6')]:
+            if value is None:
+                violations = session.unset(name)
+                argv.pop(name)
+            else:
+                violations = session.set(name, value)
+                argv[name] = ['--' + name, value]
+
+            self.assertEqual([(v.code, v.options, str(v)) for v in
+                violations], [(v.code, v.options, str(v)) for v in
+                    p.validate(sum(argv.values(), []))])
+
+        self.assertEqual(session.violations(), [])
+        self.assertEqual([v.code for v in session.unset('a')], ['required'])
+
+    def test_session_derived(self):
+        p = Parser()
+        p.int('nodes').default(1)
+        p.int('per_node').default(4)
+        total = p.derived('total', lambda nodes, per_node: nodes * per_node)
+        p.derived('label', lambda total: 'x%d' % total)
+        p.flag('pin').requires(total <= 64)
+
+        session = p.session(['--pin'])
+        self.assertEqual(session.violations(), [])
+        self.assertEqual((session.values['total'], session.values['label']),
+                (4, 'x4'))
+
+        # changing an argument rechecks what is derived from it
+        argv = {}
+        for name, value in [('nodes', '100'), ('per_node', '0'),
+                ('nodes', 'x'), ('nodes', None), ('per_node', None)]:
+            if value is None:
+                violations = session.unset(name)
+                argv.pop(name)
+            else:
+                violations = session.set(name, value)
+                argv[name] = ['--' + name, value]
+
+            args = ['--pin'] + sum(argv.values(), [])
+            self.assertEqual([(v.code, v.options) for v in violations],
+                    [(v.code, v.options) for v in p.validate(args)])
+
+        self.assertEqual(session.violations(), [])
+        self.assertEqual(session.values['total'], 4)
+
+        session.set('nodes', '100')
+        self.assertEqual([v.code for v in session.violations()],
+                ['condition'])
+        self.assertEqual((session.values['total'], session.values['label']),
+                (400, 'x400'))
+        session.set('nodes', 'x')
+        self.assertFalse('total' in session.values)
+        self.assertFalse('label' in session.values)
+
+    def test_derived(self):
+        calls = []
+
+        def workers(nodes, per_node):
+            calls.append('workers')
+            return nodes * per_node
+
+        def label(total_workers, name):
+            calls.append('label')
+            return '%s-%d' % (name, total_workers)
+
+        p = Parser()
+        p.int('nodes').default(1)
+        p.int('per_node').default(4)
+        p.str('name').default('job')
+        p.derived('label', label)  # derived from one defined later
+        total = p.derived('total_workers', workers)
+        p.flag('pin').requires(total <= 8)
+        p.flag('wide').conflicts('total_workers')
+
+        # computed when first used, once
+        vals = p._process_command_line(['--nodes', '2'])
+        self.assertEqual(calls, [])
+        self.assertEqual(vals['label'], 'job-8')
+        self.assertEqual(vals['total_workers'], 8)
+        self.assertEqual(calls, ['workers', 'label'])
+        self.assertEqual(vals['nodes'], 2)
+
+        # and in conditions
+        self.assertRaises(ConditionError, p._process_command_line,
+                ['--nodes', '3', '--pin'])
+        self.assertRaises(ConflictError, p._process_command_line, ['--wide'])
+
+        del calls[:]
+        vals = p._process_command_line(['--per_node', '2', '--pin'])
+        self.assertEqual(calls, ['workers'])
+        self.assertEqual(dict(vals)['label'], 'job-2')
+        # the value computed for the condition is kept
+        self.assertEqual(vals['total_workers'], 2)
+        self.assertEqual(calls, ['workers', 'label'])
+
+        del calls[:]
+        result = p.parse(['--per_node', '2', '--pin'])
+        self.assertEqual((result.total_workers, result.label), (2, 'job-2'))
+        self.assertEqual(calls, ['workers', 'label'])
+
+        # parsers without derived arguments use a plain dict
+        self.assertTrue(type(Parser()._process_command_line([])) is dict)
+
+        # stores passed to the parser get them after parsing
+        store = {}
+        q = Parser(store)
+        q.int('a')
+        q.derived('b', lambda a: a + 1)
+        q._process_command_line(['--a', '1'])
+        self.assertEqual(store['b'], 2)
+
+        self.assertRaises(ValueError, p.derived, 'nodes', lambda name: name)
+        p.derived('x', lambda y: y)
+        self.assertRaises(ValueError, p.derived, 'y', lambda x: x)
+        self.assertFalse('y' in p._derived)
+
+        # unknown arguments are reported when parsing
+        self.assertRaises(ValueError, p._process_command_line, [])
+
+    def test_parse(self):
+        import gc
+
+        p = Parser()
+        p.int('port').default(80)
+        p.str('files').multiple()
+        p.flag('verbose')
+        p.str('per-node')
+        p.derived('double', lambda port: port * 2)
+
+        result = p.parse(['--files', 'a', '--files', 'b', '--verbose',
+            '--per-node', 'x'])
+        self.assertEqual((result.port, result.files, result.verbose,
+            result.per_node, result['per-node']), (80, ('a', 'b'), True, 'x',
+                'x'))
+        self.assertEqual(result.double, 160)
+        self.assertEqual(result._asdict(), {'help': False, 'port': 80,
+            'files': ('a', 'b'), 'verbose': True, 'per-node': 'x',
+            'double': 160})
+        self.assertRaises(AttributeError, setattr, result, 'port', 1)
+        self.assertRaises(AttributeError, getattr, result, 'nope')
+        self.assertRaises(KeyError, result.__getitem__, 'nope')
+        self.assertFalse(hasattr(result, '__dict__'))
+
+        # _to_argv round trips, and equal results hash the same
+        again = p.parse(result._to_argv())
+        self.assertEqual(again, result)
+        self.assertEqual(len(set([again, result, p.parse([])])), 2)
+        self.assertTrue(type(again) is type(result))
+
+        # results do not keep the parser alive
+        self.assertFalse(any(isinstance(r, Parser) for r in
+            gc.get_referents(result)))
+
+        # the class follows the definition
+        p.int('extra')
+        self.assertEqual(p.parse(['--extra', '3']).extra, 3)
+
+        self.assertRaises(ArgumentError, p.parse, ['--port', 'x'])
+
+        # values are written in their command line form
+        p = Parser()
+        p.range('r')
+        p.range('steps')
+        p.multiword('words')
+        p.file('f')
+        p.directory('d')
+
+        result = p.parse(['--r', '1', '3', '--steps', '0:10:2', '--words',
+            'a', 'b', '--f', 'setup.py', '--d', 'doc'])
+        argv = result._to_argv()
+        self.assertEqual(argv, ['--r', '1:3', '--steps', '0:10:2', '--words',
+            'a', 'b', '--f', 'setup.py', '--d', 'doc'])
+        again = p.parse(argv)
+        self.assertEqual((again.r, again.steps, again.words, again.f.name,
+            again.d), (result.r, result.steps, result.words, 'setup.py',
+                'doc'))
+        result.f.close()
+        again.f.close()
+
+        # or refused, without one
+        p = Parser()
+        p.str('x').cast(lambda v: v.split(','))
+        self.assertEqual(p.parse([])._to_argv(), [])
+        self.assertRaises(ValueError, p.parse(['--x', 'a,b'])._to_argv)
+
+    def test_parse_result_names(self):
+        # arguments may be named like the methods of other objects
+        p = Parser()
+        p.flag('close')
+        p.str('to_argv')
+        p.int('asdict')
+
+        with p.parse(['--close', '--to_argv', 'x']) as result:
+            self.assertEqual((result.close, result.to_argv, result.asdict),
+                    (True, 'x', None))
+        self.assertEqual(result._to_argv(), ['--close', '--to_argv', 'x'])
+
+        # but not like those of results
+        for name in ('_fields', '_asdict', '_close', '_to-argv'):
+            self.assertRaises(ValueError, Parser().str, name)
+        self.assertRaises(ValueError, Parser().derived, '_fields',
+                lambda help: help)
+        self.assertRaises(ValueError, Parser.from_spec, {'_fields': {}})
+
+    def test_suggestions(self):
+        p = Parser()
+        p.flag('verbose').shorthand('v')
+        p.flag('verbatim')
+        p.str('colour')
+        p.int('count').shorthand('n')
+
+        p._process_command_line(['--verbose', '-n', '3'])
+        self.assertEqual(p._label_index, None)
+
+        def message(argv):
+            try:
+                p._process_command_line(argv)
+            except UnspecifiedArgumentError as e:
+                return str(e)
+
+        self.assertEqual(message(['--color', 'red']),
+                'illegal option color (did you mean --colour?)')
+        self.assertEqual(message(['--verbsoe']),
+                'illegal option verbsoe (did you mean --verbose?)')
+        self.assertEqual(message(['-verbatim']),
+                'illegal option verbatim (did you mean --verbatim?)')
+        self.assertEqual(message(['--xyz']), 'illegal option xyz')
+
+        # the index follows added arguments
+        p.int('width')
+        self.assertEqual(message(['--widht']),
+                'illegal option widht (did you mean --width?)')
+
+    def test_add_many(self):
+        def fluent():
+            p = Parser()
+            p.str('host').described_as('Server name')
+            p.int('port').shorthand('p').default(8080).requires('host')
+            p.flag('quiet')
+            p.flag('verbose').conflicts('quiet')
+            p.enum('mode', ('fast', 'slow')).required()
+            p.str('files').unspecified_default().multiple()
+            return p
+
+        def bulk():
+            return Parser.from_spec({
+                'port': {'type': 'int', 'shorthand': 'p', 'default': 8080,
+                    'requires': ['host']},
+                'host': {'description': 'Server name'},
+                'verbose': {'type': 'flag', 'conflicts': ['quiet']},
+                'quiet': {'type': 'flag'},
+                'mode': {'type': 'enum', 'values': ['fast', 'slow'],
+                    'required': True},
+                'files': {'unspecified_default': True, 'multiple': True},
+                })
+
+        for argv in (['--mode', 'fast', '--host', 'h', 'a', 'b'],
+                     ['--mode', 'slow', '-p', '1', '--host', 'h', '--quiet'],
+                     ['--mode', 'fast', '-p', '1'],
+                     ['--mode', 'medium'],
+                     ['--verbose', '--quiet', '--mode', 'fast'],
+                     []):
+            self.assertEqual(_outcome(fluent()._process_command_line, argv),
+                    _outcome(bulk()._process_command_line, argv))
+
+        p = Parser()
+        p.int('a').shorthand('x')
+        try:
+            p.add_many([{'name': 'a'},
+                        {'name': 'b', 'type': 'integer', 'shorthand': 'x'},
+                        {'name': 'c', 'requires': ['d', 'a'], 'colour': 1},
+                        {'type': 'int'}])
+            self.fail()
+        except ValueError as e:
+            self.assertEqual(str(e).splitlines()[1:], [
+                '  a: defined more than once',
+                '  b: unknown type integer',
+                '  b: shorthand x already used',
+                "  c: unknown keys colour",
+                "  spec without name: {'type': 'int'}",
+                '  c: requires d not known'])
+
+        # nothing was added
+        self.assertEqual(sorted(p._readers), ['a', 'help'])
+
+        try:
+            p.add_many([{'name': 'b', 'type': 'bail'},
+                        {'name': 'c', 'type': 'process_command_line'},
+                        {'name': 'd', 'shorthand': None},
+                        {'name': 'e', 'requires': 'a', 'conflicts': 'b'}])
+            self.fail()
+        except ValueError as e:
+            self.assertEqual(str(e).splitlines()[1:], [
+                '  b: unknown type bail',
+                '  c: unknown type process_command_line',
+                '  d: shorthand None is not a string',
+                '  e: requires must be a list of names',
+                '  e: conflicts must be a list of names'])
+
+        self.assertEqual(p.add_many([{'name': 'f', 'type': 'file'},
+                                     {'name': 'g', 'type': 'max_open_files'}]),
+                None)
+        self.assertTrue('f' in p._readers and 'g' in p._readers)
+
+    def test_add_many_lazy(self):
+        spec = {
+            'host': {'description': 'Server name', 'shorthand': 'H'},
+            'port': {'type': 'int', 'shorthand': 'p', 'requires': ['host']},
+            'quiet': {'type': 'flag'},
+            'verbose': {'type': 'flag', 'conflicts': ['quiet']},
+            'mode': {'type': 'enum', 'values': ['fast', 'slow']},
+            'name': {'required': True},
+            'ratio': {'type': 'float', 'default': 0.5},
+            'ranges': {'type': 'range', 'multiple': True},
+            'files': {'unspecified_default': True, 'multiple': True},
+            }
+
+        for argv in (['--name', 'x'],
+                     [],
+                     ['--name', 'x', '-p', '3'],
+                     ['--name', 'x', '-p', '3', '-H', 'h', 'a', 'b'],
+                     ['--name', 'x', '--verbose', '--quiet'],
+                     ['--name', 'x', '--mode', 'medium'],
+                     ['--name', 'x', '--ranges', '1', '3', '--ranges', '4'],
+                     ['--name', 'x', '--colour', 'red']):
+            self.assertEqual(
+                    _outcome(Parser.from_spec(spec)._process_command_line,
+                        argv),
+                    _outcome(Parser.from_spec(spec, lazy=True)
+                        ._process_command_line, argv))
+
+        # lazy multiple() values are fresh lists for each argument and parse
+        p = Parser.from_spec({'a': {'multiple': True},
+                              'b': {'multiple': True}}, lazy=True)
+        vals = p._process_command_line([])
+        self.assertFalse(vals['a'] is vals['b'])
+        vals['a'].append('x')
+        self.assertEqual(len(p._process_command_line([])['a']), 1)
+
+        p = Parser.from_spec(spec, lazy=True)
+        self.assertEqual(sorted(p._readers), ['files', 'help', 'ratio'])
+
+        # given arguments are created with those their constraints refer to
+        p._parse(p._tokenize(['-p', '3']))
+        self.assertEqual(sorted(p._readers), ['files', 'help', 'host', 'port',
+            'ratio'])
+
+        p['verbose']
+        self.assertTrue('quiet' in p._readers)
+        self.assertRaises(ValueError, p.int, 'mode')
+
+        p.out = StringIO()
+        p.print_help()
+        self.assertEqual(p._lazy, {})
+        self.assertTrue('Requires mode in (fast, slow)' in p.out.getvalue())
+
+        # errors are reported without creating every argument
+        p = Parser.from_spec(spec, lazy=True)
+        p.out = StringIO()
+        p._sys_exit_error = ValueError
+        self.assertRaises(ValueError, p.bail, FormatError('bad ratio'))
+        self.assertEqual(sorted(p._readers), ['files', 'help', 'ratio'])
+
+        def labels(usage):
+            return sorted(re.findall(r'\[([^]]*)\]', usage))
+
+        self.assertEqual(labels(p._usage()), labels(
+            Parser.from_spec(spec)._usage()))
+
+        # results keep their class as arguments are created
+        p = Parser.from_spec({'a': {'type': 'int'}, 'b': {}}, lazy=True)
+        first = p.parse([])
+        again = p.parse(['--b', 'x'])
+        self.assertTrue(type(first) is type(again))
+        self.assertEqual(p.parse([]), first)
+        self.assertEqual(again._to_argv(), ['--b', 'x'])
+        self.assertEqual(p.parse(['--a', '1'])._to_argv(), ['--a', '1'])
+
+    def test_aggregate_errors(self):
+        def create(method):
+            p = Parser()
+            p.int('a')
+            p.int('b')
+            p.int('c')
+            getattr(p, method)('a', 'b', 'c')
+            return p
+
+        try:
+            create('all_if_any')._process_command_line(['--a', '1', '--c', '2'])
+            self.fail()
+        except DependencyError as e:
+            self.assertEqual(str(e), '--a requires --b')
+
+        try:
+            create('only_one_if_any')._process_command_line(['--a', '1', '--c',
+                '2'])
+            self.fail()
+        except ConflictError as e:
+            self.assertEqual(str(e), 'a conflicts with c')
+
+        # copies do not share values given more than once
+        from blargs import Multidict
+        d = Multidict()
+        d['a'] = 1
+        d['a'] = 2
+        c = d.copy()
+        c['a'] = 3
+        self.assertEqual(d['a'], [1, 2])
+        self.assertEqual(c['a'], [1, 2, 3])
+
+
+def _outcome(f, *args):
+    ''' What calling ``f`` does, in a form that can be compared across the
+    original and generated parsers. '''
+
+    def normalize(v):
+        if isinstance(v, list):
+            return [normalize(x) for x in v]
+        if hasattr(v, 'read'):
+            v.close()
+            return ('file', v.name, v.mode)
+        return v
+
+    try:
+        values = f(*args)
+    except SystemExit as e:
+        return ('exit', e.args)
+    except FakeSystemExit as e:
+        return ('exit', e.args)
+    except Exception as e:
+        return (type(e).__name__, str(e))
+
+    return ('values', dict((k, normalize(v)) for k, v in values.items()))
+
+
+class CodegenTestCase(TestCase):
+    ''' Runs the :class:`TestCase` tests again, checking every parse against
+    the module generated from the parser by :meth:`Parser.codegen`. '''
+
+    def setUp(self):
+        original = self.original = Parser._process_command_line
+        self.addCleanup(setattr, Parser, '_process_command_line', original)
+        # test_with changes sys.argv for the tests that follow it
+        self.addCleanup(setattr, sys, 'argv', sys.argv[:])
+
+        def process(parser, args=None):
+            try:
+                source = parser.codegen()
+            except ValueError:
+                return original(parser, args)  # not supported
+
+            module = {}
+            exec(compile(source, '<codegen>', 'exec'), module)
+            stdout, sys.stdout = sys.stdout, StringIO()
+            try:
+                generated = _outcome(module['parse'], args)
+            finally:
+                sys.stdout = stdout
+
+            expected = _outcome(original, parser, args)
+            if expected[0] == 'values':
+                expected = ('values', dict((k, v) for k, v in
+                    expected[1].items() if k in parser._readers))
+            self.assertEqual(generated, expected)
+            return original(parser, args)
+
+        Parser._process_command_line = process
+
+    # not run twice: these fail in TestCase too, as they expect the option
+    # order of unordered dicts in printed usage
+    @unittest.skip('expects usage in unordered dict order; fails in TestCase')
+    def test_help(self):
+        pass
+
+    @unittest.skip('expects usage in unordered dict order; fails in TestCase')
+    def test_error_printing(self):
+        pass
+
+    def test_fuzz(self):
+        # random parsers and command lines, for the error each raises first
+        import random
+
+        rnd = random.Random(0)
+        values = ['1', '3', '5', 'x', '2.5', '-1']
+
+        def build():
+            p = Parser({})
+            options = []
+            for i in range(5):
+                kind = rnd.choice(['int', 'float', 'str', 'flag', 'enum',
+                    'multiword'])
+                if kind == 'enum':
+                    o = p.enum('o%d' % i, ('1', '3', 'x'))
+                else:
+                    o = getattr(p, kind)('o%d' % i)
+                if kind not in ('flag', 'multiword') and rnd.random() < .3:
+                    o.multiple()
+                if kind in ('int', 'float') and rnd.random() < .3:
+                    o.default(3)
+                if kind == 'str' and rnd.random() < .5:
+                    o.cast(int)
+                    kind = 'int'
+                options.append((o, kind))
+
+            numbers = [o for o, kind in options if kind in ('int', 'float')]
+            for _ in range(rnd.randint(0, 6)):
+                o = rnd.choice(options)[0]
+                other = rnd.choice([m for m, kind in options if m is not o])
+                r = rnd.random()
+                if r < .15:
+                    o.requires(other)
+                elif r < .3:
+                    o.conflicts(other)
+                elif r < .5 and numbers:
+                    o.requires(rnd.choice(numbers) > rnd.choice([0, 2, 4]))
+                elif r < .6 and len(numbers) > 1:
+                    n, m = rnd.sample(numbers, 2)
+                    o.requires(n < m)
+                elif r < .7 and numbers:
+                    c = (rnd.choice(numbers) > 2).or_(other)
+                    rnd.choice([o.if_, o.unless, o.conflicts])(c)
+                elif r < .9:
+                    rnd.choice([p.require_one, p.only_one_if_any,
+                        p.all_if_any])(o, other)
+                else:
+                    o.required()
+
+            return p, [kind for o, kind in options]
+
+        for _ in range(100):
+            p, kinds = build()
+            module = {}
+            exec(compile(p.codegen(), '<codegen>', 'exec'), module)
+            for _ in range(40):
+                args = []
+                for _ in range(rnd.randint(0, 5)):
+                    i = rnd.randrange(len(kinds))
+                    args.append('--o%d' % i)
+                    if kinds[i] != 'flag':
+                        args.append(rnd.choice(values))
+
+                self.assertEqual(_outcome(module['parse'], args),
+                        _outcome(self.original, p, args), args)
+
+
+class ComplexityTestCase(unittest.TestCase):
+    ''' Parse time must grow (roughly) linearly with the size of the parser
+    or the command line. '''
+
+    sizes = (250, 500, 1000, 2000)
+
+    def exponent(self, setup):
+        ''' Empirical exponent of parse time as a function of size. ``setup``
+        takes a size and returns a callable that performs one parse. '''
+
+        from math import log
+        from timeit import default_timer
+
+        times = []
+        for n in self.sizes:
+            f = setup(n)
+            best = None
+            for _ in range(3):
+                start = default_timer()
+                f()
+                elapsed = default_timer() - start
+                if best is None or elapsed < best:
+                    best = elapsed
+            times.append(max(best, 1e-6))
+
+        return log(times[-1] / times[0]) / log(float(self.sizes[-1]) /
+                self.sizes[0])
+
+    def assertLinear(self, setup):
+        self.assertLess(self.exponent(setup), 1.5)
+
+    def test_options(self):
+        def setup(n):
+            p = Parser()
+            for i in range(n):
+                p.int('opt%d' % i)
+            argv = []
+            for i in range(0, n, 2):
+                argv += ['--opt%d' % i, str(i)]
+            return lambda: p._process_command_line(argv)
+
+        self.assertLinear(setup)
+
+    def test_abbreviations(self):
+        def setup(n):
+            p = Parser()
+            for i in range(n):
+                p.int('opt%05d_value' % i)
+            argv = []
+            for i in range(0, n, 2):
+                argv += ['--opt%05d' % i, str(i)]
+            return lambda: p._process_command_line(argv)
+
+        self.assertLinear(setup)
+
+    def test_multiple_conditions(self):
+        def setup(n):
+            p = Parser()
+            lo = p.int('lo').multiple()
+            hi = p.int('hi').multiple()
+            lo.requires(lo < hi, lo != hi)
+            argv = []
+            for i in range(n):
+                argv += ['--lo', str(i), '--hi', str(n + i)]
+            return lambda: p._process_command_line(argv)
+
+        self.assertLinear(setup)
+
+    def test_session(self):
+        # a change costs the same however many arguments there are
+        def setup(n):
+            p = Parser()
+            for i in range(n):
+                p.int('opt%d' % i).requires(p.int('dep%d' % i) > i)
+            session = p.session()
+            values = [str(i) for i in range(100)]
+
+            def change():
+                for value in values:
+                    session.set('dep0', value)
+                    session.set('opt0', value)
+            return change
+
+        self.assertLess(self.exponent(setup), 0.5)
+
+    def test_multiple(self):
+        def setup(n):
+            p = Parser()
+            p.int('x').multiple()
+            argv = ['--x', '1'] * (n * 10)
+            return lambda: p._process_command_line(argv)
+
+        self.assertLinear(setup)
+
+    def aggregate(self, method, specified):
+        def setup(n):
+            p = Parser()
+            names = ['x%d' % i for i in range(n)]
+            for name in names:
+                p.int(name)
+            getattr(p, method)(*names)
+            argv = []
+            for name in names[:specified(n)]:
+                argv += ['--' + name, '1']
+            return lambda: p._process_command_line(argv)
+
+        return setup
+
+    def test_all_if_any(self):
+        self.assertLinear(self.aggregate('all_if_any', lambda n: n))
+
+    def test_only_one_if_any(self):
+        self.assertLinear(self.aggregate('only_one_if_any', lambda n: 1))
+
+    def test_at_least_one(self):
+        self.assertLinear(self.aggregate('at_least_one', lambda n: 1))
+
+    def test_enum(self):
+        def setup(n):
+            p = Parser()
+            values = ['v%d' % i for i in range(n * 10)]
+            p.enum('mode', values)
+            argv = ['--mode', values[-1]]
+            return lambda: p._process_command_line(argv)
+
+        self.assertLinear(setup)
+
+    def test_nested_conditions(self):
+        def setup(n):
+            # depth is bounded by the recursion limit
+            n //= 10
+            p = Parser()
+            x = p.int('x')
+            cond = x > 0
+            for i in range(n):
+                cond = (x == -i - 1).or_(cond)
+            x.requires(cond)
+            argv = ['--x', '1']
+            return lambda: p._process_command_line(argv)
+
+        self.assertLinear(setup)
+
+
+class BenchTestCase(unittest.TestCase):
+    def test_tiny_scale(self):
+        import bench
+
+        for name, create in bench.BENCHMARKS:
+            for op, f in sorted(create(0.001).items()):
+                f()
+
 
 if __name__ == '__main__':
     unittest.main()